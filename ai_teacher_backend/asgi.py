@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_teacher_backend.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.ASYNC_VIEWS:
+    # WhiteNoiseMiddleware is dropped in async mode, so serve /static/ here
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+    application = ASGIStaticFilesHandler(application)
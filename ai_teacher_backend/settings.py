@@ -48,8 +48,10 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',   # serves static files in production
+    'core.middleware.MetricsMiddleware',  # outermost app middleware, so /metrics sees the full cost
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.RateLimitMiddleware',  # before any view touches the profile
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -57,6 +59,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Serve /ask/, /history/ and /dashboard/stats/ from async views.
+# Only worth enabling when running under an ASGI server (see DEPLOYMENT_GUIDE.md).
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# WhiteNoise is sync-only: under ASGI it would push every request through a
+# worker thread. In async mode asgi.py serves static files instead.
+if ASYNC_VIEWS:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'ai_teacher_backend.urls'
 
 TEMPLATES = [
@@ -75,6 +86,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ai_teacher_backend.wsgi.application'
+ASGI_APPLICATION = 'ai_teacher_backend.asgi.application'
 
 
 # Database
@@ -94,10 +106,93 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Writers queue on the busy timeout instead of failing with "database is locked"
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            },
+            # File-backed so the threaded concurrency tests share one real database
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
         }
     }
 
 
+# Caches
+# Local memory by default; set REDIS_URL to share caches between workers.
+# `answers` holds tutor answers (core/answer_cache.py) and evicts least-recently-used entries.
+
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', str(60 * 60 * 24)))
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        },
+        'answers': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+            'KEY_PREFIX': 'answers',
+            'TIMEOUT': ANSWER_CACHE_TTL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'answers': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'answers',
+            'TIMEOUT': ANSWER_CACHE_TTL,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+    }
+
+# Near-duplicate question matching for the answer cache; '' disables it.
+# e.g. ANSWER_CACHE_EMBEDDER=core.answer_cache.ngram_embedding
+ANSWER_CACHE_EMBEDDER = os.environ.get('ANSWER_CACHE_EMBEDDER', '')
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', '0.85'))
+ANSWER_CACHE_SIMILAR_MAX = 200
+
+# Identical tutor questions in flight at the same time share one LLM call (core/singleflight.py).
+# SINGLEFLIGHT_DISTRIBUTED also coalesces across workers through a lock in the default cache;
+# only useful when that cache is shared (REDIS_URL).
+SINGLEFLIGHT_DISTRIBUTED = os.environ.get('SINGLEFLIGHT_DISTRIBUTED', 'False') == 'True'
+SINGLEFLIGHT_LOCK_SECONDS = 20
+SINGLEFLIGHT_RESULT_SECONDS = 10
+
+# Per-student /dashboard/stats/ payloads (core/dashboard.py); events invalidate them sooner
+DASHBOARD_CACHE_TTL = 60 * 5
+
+# Subject curricula and students' current day (core/curriculum.py); saves invalidate them sooner
+CURRICULUM_CACHE_TTL = 60 * 60
+
+# Level/Achievement tables held by each process (core/catalog.py); saves invalidate them sooner
+# when the default cache is shared, otherwise other processes reload after this many seconds
+CATALOG_MAX_AGE = 60 * 5
+
+# Ranked weekly leaderboards held by each process (core/leaderboard.py); without a shared
+# cache, other processes see a rank_leaderboard run once their copy is this many seconds old
+LEADERBOARD_SNAPSHOT_MAX_AGE = 60
+
+# Quiz answer keys used to grade submissions (core/grading.py); quiz, question and option saves invalidate them sooner
+ANSWER_KEY_CACHE_TTL = 60 * 60
+
+# Quiz content served by /quiz/<id>/ (core/quiz_content.py): cached until its quiz, questions or options change;
+# browsers and CDNs may reuse a copy for QUIZ_CONTENT_MAX_AGE seconds before revalidating its ETag
+QUIZ_CONTENT_CACHE_TTL = 60 * 60 * 24
+QUIZ_CONTENT_MAX_AGE = 60
+
+# /metrics (Prometheus text, core/metrics.py): scrapers send "Authorization: Bearer <METRICS_TOKEN>";
+# without a token only staff users can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Add a Server-Timing header (db / llm / total) to every response
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'False') == 'True'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -164,6 +259,69 @@ REST_FRAMEWORK = {
     ],
 }
 
+# AI Tutor LLM client: keep-alive connections pooled per provider (see core/llm.py)
+LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', '10'))
+LLM_KEEPALIVE_SECONDS = float(os.environ.get('LLM_KEEPALIVE_SECONDS', '60'))
+
+# Provider routing (core/router.py). Providers without an API key are skipped.
+LLM_PROVIDERS = [p.strip() for p in os.environ.get('LLM_PROVIDERS', 'groq,gemini,openai').split(',') if p.strip()]
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+# 'ordered' tries LLM_PROVIDERS in order; 'latency' tries the fastest (EWMA) first
+LLM_ROUTING = os.environ.get('LLM_ROUTING', 'ordered')
+LLM_EWMA_ALPHA = 0.2
+# Whole-call deadline when the caller doesn't pass one
+LLM_TIMEOUT_SECONDS = 15.0
+# Hedging: ask the next provider too once the first is slower than its p95 (clamped to these bounds)
+LLM_HEDGE = os.environ.get('LLM_HEDGE', 'False') == 'True'
+LLM_HEDGE_MIN_DELAY_MS = 300
+LLM_HEDGE_MAX_DELAY_MS = 5000
+# Circuit breaker: skip a provider for the cooldown after this many failures in a row
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_COOLDOWN_SECONDS = 30
+
+# Tutor prompt size (core/context.py): recent turns are kept within TUTOR_CONTEXT_TOKENS,
+# older ones are folded into a rolling summary of at most TUTOR_SUMMARY_TOKENS.
+TUTOR_CONTEXT_TOKENS = int(os.environ.get('TUTOR_CONTEXT_TOKENS', '600'))
+TUTOR_SUMMARY_TOKENS = int(os.environ.get('TUTOR_SUMMARY_TOKENS', '150'))
+TUTOR_CONTEXT_MAX_TURNS = 10
+
+# Background tasks (core/tasks.py). Eager runs them in-line on the request, as
+# before; set TASKS_EAGER=False and run `python manage.py run_tasks` to queue them.
+TASKS_EAGER = os.environ.get('TASKS_EAGER', 'True') == 'True'
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BASE_SECONDS = 5
+TASK_RETRY_MAX_SECONDS = 60 * 10
+TASK_LEASE_SECONDS = 60 * 5
+TASK_RETENTION_HOURS = 24
+
+# Append-only LoginHistory / XPTransaction rows (core/write_buffer.py). 'sync' saves each row
+# as it happens; 'buffered' batches them into one INSERT per 500 rows or 200ms, trading up
+# to that much history on a hard crash for far fewer writes during login storms.
+WRITE_BUFFER_MODE = os.environ.get('WRITE_BUFFER_MODE', 'sync')
+WRITE_BUFFER_MAX_ROWS = 500
+WRITE_BUFFER_MAX_DELAY_MS = 200
+
+# Database sessions that also store the user id, for one-query "log out all devices"
+SESSION_ENGINE = 'core.sessions'
+
+# Token-bucket limits on the tutor endpoints (core/ratelimit.py, core/middleware.py):
+# plan -> (burst, questions per minute). Guests are limited per client IP.
+RATE_LIMITED_PATHS = ['/ask/', '/ask/stream/']
+RATE_LIMITS = {
+    'GUEST': (5, 3),
+    'FREE': (5, 6),
+    'BASIC': (10, 20),
+    'ULTRA': (20, 60),
+}
+# Buckets live in each process by default; with Redis they are shared by all workers
+if os.environ.get('REDIS_URL'):
+    RATE_LIMIT_BACKEND = 'core.ratelimit.RedisTokenBucket'
+    RATE_LIMIT_REDIS_URL = os.environ.get('REDIS_URL')
+else:
+    RATE_LIMIT_BACKEND = 'core.ratelimit.LocMemTokenBucket'
+# e.g. HTTP_X_FORWARDED_FOR when running behind Railway's proxy; '' uses REMOTE_ADDR
+RATE_LIMIT_CLIENT_IP_HEADER = os.environ.get('RATE_LIMIT_CLIENT_IP_HEADER', '')
+
 # Login Redirect
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
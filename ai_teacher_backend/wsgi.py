@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_teacher_backend.settings')
 
+if settings.ASYNC_VIEWS:
+    # Each async view would run in its own short-lived event loop, and the pooled
+    # LLM clients only work on the loop that first used them
+    raise ImproperlyConfigured(
+        "ASYNC_VIEWS=True needs an ASGI server (ai_teacher_backend.asgi:application, see DEPLOYMENT_GUIDE.md); "
+        "unset it to serve ai_teacher_backend.wsgi"
+    )
+
 application = get_wsgi_application()
@@ -0,0 +1,147 @@
+import hashlib
+import math
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+STAT_NAMES = ('hits', 'similar_hits', 'misses', 'saved_ms', 'saved_tokens')
+
+
+def normalize_question(text):
+    """Lowercase, drop punctuation and collapse whitespace so trivial variants share a key."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+def history_fingerprint(messages, turns=2):
+    """
+    Short hash of the last `turns` question/answer pairs in a tutor prompt
+    (system message and the new question excluded), so an answer given in
+    one conversation is only reused where the recent context matches.
+    """
+    history = messages[1:-1][-turns * 2:]
+    if not history:
+        return ''
+    digest = hashlib.sha1()
+    for message in history:
+        digest.update(f"{message['role']}:{normalize_question(message['content'])}\n".encode())
+    return digest.hexdigest()[:12]
+
+def ngram_embedding(text, dims=256):
+    """
+    Cheap local embedding: hashed character trigrams, L2-normalised.
+    Good enough to match rephrasings like "what's a black hole" without an API call.
+    """
+    text = f" {normalize_question(text)} "
+    vector = [0.0] * dims
+    for i in range(len(text) - 2):
+        bucket = int(hashlib.md5(text[i:i + 3].encode()).hexdigest()[:8], 16) % dims
+        vector[bucket] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class AnswerCache:
+    """
+    Cache of tutor answers keyed on (topic, normalised question, skill level,
+    history fingerprint), stored in the `answers` cache alias. TTL and LRU
+    eviction come from that backend (locmem MAX_ENTRIES, or Redis with an
+    LRU maxmemory-policy in production).
+
+    With settings.ANSWER_CACHE_EMBEDDER set, misses fall back to a
+    similarity tier: recent questions in the same bucket are compared by
+    cosine similarity and anything above ANSWER_CACHE_SIMILARITY is reused.
+    """
+    def __init__(self, alias='answers'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def lookup(self, topic, question, skill_level, messages):
+        """Return the cached entry ({"answer", "latency_ms", "tokens"}) or None."""
+        bucket = self._bucket(topic, skill_level, messages)
+        entry = self.cache.get(self._key(bucket, question))
+        kind = 'hits'
+
+        if entry is None and settings.ANSWER_CACHE_EMBEDDER:
+            entry = self._lookup_similar(bucket, question)
+            kind = 'similar_hits'
+
+        if entry is None:
+            self._incr('misses')
+            return None
+
+        self._incr(kind)
+        self._incr('saved_ms', entry['latency_ms'])
+        self._incr('saved_tokens', entry['tokens'])
+        return entry
+
+    def store(self, topic, question, skill_level, messages, answer, latency_seconds, tokens=0):
+        if not answer:
+            return
+        bucket = self._bucket(topic, skill_level, messages)
+        entry = {"answer": answer, "latency_ms": int(latency_seconds * 1000), "tokens": tokens}
+        self.cache.set(self._key(bucket, question), entry, settings.ANSWER_CACHE_TTL)
+
+        if settings.ANSWER_CACHE_EMBEDDER:
+            index_key = f"similar:{bucket}"
+            index = self.cache.get(index_key, [])
+            index.append((self._embed(question), normalize_question(question)))
+            index = index[-settings.ANSWER_CACHE_SIMILAR_MAX:]
+            self.cache.set(index_key, index, settings.ANSWER_CACHE_TTL)
+
+    def key(self, topic, question, skill_level, messages):
+        """The exact-match key for a question, also used to coalesce identical in-flight questions."""
+        return self._key(self._bucket(topic, skill_level, messages), question)
+
+    def stats(self):
+        values = self.cache.get_many([f"stats:{name}" for name in STAT_NAMES])
+        stats = {name: values.get(f"stats:{name}", 0) for name in STAT_NAMES}
+        lookups = stats['hits'] + stats['similar_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['similar_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        self.cache.clear()
+
+    def _lookup_similar(self, bucket, question):
+        index = self.cache.get(f"similar:{bucket}")
+        if not index:
+            return None
+        vector = self._embed(question)
+        best_score, best_question = 0.0, None
+        for other_vector, other_question in index:
+            score = sum(a * b for a, b in zip(vector, other_vector))
+            if score > best_score:
+                best_score, best_question = score, other_question
+        if best_score < settings.ANSWER_CACHE_SIMILARITY:
+            return None
+        return self.cache.get(self._key(bucket, best_question))
+
+    def _embed(self, text):
+        return import_string(settings.ANSWER_CACHE_EMBEDDER)(text)
+
+    def _bucket(self, topic, skill_level, messages):
+        raw = f"{topic.strip().lower()}|{skill_level}|{history_fingerprint(messages)}"
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    def _key(self, bucket, question):
+        digest = hashlib.sha1(normalize_question(question).encode()).hexdigest()
+        return f"answer:{bucket}:{digest}"
+
+    def _incr(self, name, amount=1):
+        if not amount:
+            return
+        key = f"stats:{name}"
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key, amount)
+        except ValueError:
+            # Evicted between add() and incr(); losing one sample is fine
+            pass
+
+
+answer_cache = AnswerCache()
@@ -7,3 +7,9 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         import core.signals
+        # Installs the per-connection query timer before any connection opens
+        import core.metrics
+        from .llm import llm_clients
+
+        # Build the pooled LLM client once per process instead of per /ask/ request
+        llm_clients.build()
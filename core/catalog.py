@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the Level and Achievement tables at one catalog version.
+    The model instances are shared between requests: read them, never save them.
+    """
+    __slots__ = ('version', 'loaded_at', 'levels_by_number', 'levels_by_id', 'achievements', 'achievements_by_id')
+
+    def __init__(self, version, levels, achievements):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'loaded_at', time.monotonic())
+        object.__setattr__(self, 'levels_by_number', MappingProxyType({lvl.number: lvl for lvl in levels}))
+        object.__setattr__(self, 'levels_by_id', MappingProxyType({lvl.id: lvl for lvl in levels}))
+        object.__setattr__(self, 'achievements', tuple(achievements))
+        object.__setattr__(self, 'achievements_by_id', MappingProxyType({ach.id: ach for ach in achievements}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CatalogSnapshot is immutable")
+
+
+class GamificationCatalog:
+    """
+    Process-local cache of the (tiny, nearly static) Level and Achievement
+    tables, so award_xp, check_achievements and the dashboard/account views
+    don't query them on every request.
+
+    Each gunicorn worker loads the snapshot as it starts (warm(), called from
+    gunicorn.conf.py); elsewhere it loads on first use. CoreConfig.ready()
+    doesn't load it because ready() also runs for manage.py commands such as
+    migrate, before the tables exist, and Django warns about queries there.
+
+    The snapshot is tagged with a version number kept
+    in the default cache. Saving or deleting a Level/Achievement bumps that
+    version (see core.signals); every process compares versions on access and
+    reloads when its snapshot is stale. With Redis as the default cache this
+    invalidates all workers; with locmem it covers the current process, so
+    snapshots are also reloaded once settings.CATALOG_MAX_AGE seconds old,
+    and an id lookup that misses (a row another process just created)
+    reloads once before giving up.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self):
+        version = self._version()
+        snapshot = self._snapshot
+        if not self._fresh(snapshot, version):
+            with self._lock:
+                snapshot = self._snapshot
+                if not self._fresh(snapshot, version):
+                    snapshot = self._load(version)
+                    self._snapshot = snapshot
+        return snapshot
+
+    def warm(self):
+        """Load the snapshot now; a database without the tables yet is left for get() to retry."""
+        try:
+            self.get()
+        except DatabaseError:
+            logger.warning("Gamification catalog not loaded at startup", exc_info=True)
+
+    def level(self, number):
+        return self.get().levels_by_number.get(number)
+
+    def level_by_id(self, level_id):
+        if level_id is None:
+            return None
+        return self._by_id('levels_by_id', level_id)
+
+    def achievement(self, achievement_id):
+        return self._by_id('achievements_by_id', achievement_id)
+
+    @property
+    def achievements(self):
+        return self.get().achievements
+
+    def invalidate(self):
+        """Drop this process's snapshot and tell the other processes to do the same."""
+        self._snapshot = None
+        self._bump()
+        # Bump again once the change is visible to other connections, so nobody
+        # keeps a snapshot they reloaded from before the commit
+        transaction.on_commit(self._bump)
+
+    def _by_id(self, index, pk):
+        snapshot = self.get()
+        found = getattr(snapshot, index).get(pk)
+        if found is None:
+            # Ids come from foreign keys, so the row exists: it was created after this snapshot
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = self._load(snapshot.version)
+                snapshot = self._snapshot
+            found = getattr(snapshot, index).get(pk)
+        return found
+
+    @staticmethod
+    def _fresh(snapshot, version):
+        return (
+            snapshot is not None and snapshot.version == version
+            and time.monotonic() - snapshot.loaded_at < settings.CATALOG_MAX_AGE
+        )
+
+    def _version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            # First process up, or the key was evicted. Seed from the clock so a
+            # restarted counter can't land on a version someone already holds.
+            cache.add(VERSION_KEY, time.time_ns(), None)
+            version = cache.get(VERSION_KEY)
+        return version
+
+    def _bump(self):
+        self._version()
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # Evicted between the read and incr(); the next get() reseeds it
+            pass
+
+    def _load(self, version):
+        from .models import Level, Achievement
+
+        return CatalogSnapshot(
+            version,
+            list(Level.objects.order_by('number')),
+            list(Achievement.objects.order_by('id')),
+        )
+
+
+catalog = GamificationCatalog()
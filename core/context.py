@@ -0,0 +1,113 @@
+import math
+import re
+
+from django.conf import settings
+
+from .models import Conversation, ConversationSummary
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """
+    Local token estimate: words and punctuation marks, scaled for BPE splitting
+    long words. Within ~10-15% of tiktoken on English tutor answers, at no cost.
+    """
+    return math.ceil(len(_TOKEN_RE.findall(text)) * 1.3)
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` down to roughly `max_tokens`, on a word boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    kept = []
+    for word in words:
+        if estimate_tokens(" ".join(kept + [word])) > max_tokens:
+            break
+        kept.append(word)
+    return " ".join(kept) + " …"
+
+def system_prompt(topic):
+    return (
+        f"You are Mentora, a friendly AI Tutor for {topic}. "
+        "Sound like a caring teacher. Keep responses concise (under 100 words). "
+        "Use emojis! 🌈✨"
+    )
+
+def build_tutor_messages(user, topic, question):
+    """
+    Build the LLM prompt for a tutor question: system prompt, rolling summary
+    of older turns, then as many of the last settings.TUTOR_CONTEXT_MAX_TURNS
+    turns as fit in settings.TUTOR_CONTEXT_TOKENS, then the new question.
+    Every turn left out of the prompt is folded into ConversationSummary once.
+    """
+    record = (
+        ConversationSummary.objects.filter(user=user, topic=topic)
+        .only('id', 'summary', 'summarized_until')
+        .first()
+    )
+    summarized_until = record.summarized_until if record else 0
+    # Only turns the summary hasn't seen: the recent window, plus whatever
+    # left it since the last prompt. A backlog beyond TUTOR_SUMMARY_TOKENS // 2
+    # older turns (a bulk import) can't survive the summary's token cap anyway,
+    # as each folded question costs at least two tokens.
+    max_turns = settings.TUTOR_CONTEXT_MAX_TURNS
+    turns = list(
+        Conversation.objects.filter(user=user, topic=topic, id__gt=summarized_until)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'question', 'answer')[:max_turns + settings.TUTOR_SUMMARY_TOKENS // 2]
+    )
+
+    budget = settings.TUTOR_CONTEXT_TOKENS
+    included = []
+    for turn_id, turn_question, turn_answer in turns[:max_turns]:
+        cost = estimate_tokens(turn_question) + estimate_tokens(turn_answer)
+        if cost > budget:
+            if not included:
+                # Always keep the latest turn, trimming its answer to fit
+                remaining = max(budget - estimate_tokens(turn_question), 0)
+                included.append((turn_id, turn_question, truncate_to_tokens(turn_answer, remaining)))
+            break
+        included.append((turn_id, turn_question, turn_answer))
+        budget -= cost
+
+    summary = _fold_into_summary(user, topic, record, turns[len(included):])
+
+    messages = [{"role": "system", "content": system_prompt(topic)}]
+    if summary:
+        messages.append({"role": "system", "content": f"Earlier in this lesson the student asked about: {summary}"})
+    for _, turn_question, turn_answer in reversed(included):
+        messages.append({"role": "user", "content": turn_question})
+        messages.append({"role": "assistant", "content": turn_answer})
+    messages.append({"role": "user", "content": question})
+    return messages
+
+def _fold_into_summary(user, topic, record, dropped):
+    """
+    Append the questions of the turns left out of the prompt (newest first)
+    to the stored summary `record`, keeping its tail within
+    settings.TUTOR_SUMMARY_TOKENS, and move summarized_until past them.
+    Returns the summary text; only writes when something new was folded in.
+    """
+    if not dropped:
+        return record.summary if record else ''
+
+    fresh = list(reversed(dropped))
+    points = [record.summary] if record and record.summary else []
+    points += [truncate_to_tokens(" ".join(q.split()), 25) for _, q, _ in fresh]
+    summary = "; ".join(points)
+    while estimate_tokens(summary) > settings.TUTOR_SUMMARY_TOKENS and "; " in summary:
+        summary = summary.split("; ", 1)[1]
+    summary = truncate_to_tokens(summary, settings.TUTOR_SUMMARY_TOKENS)
+
+    newest = max(turn_id for turn_id, _, _ in fresh)
+    if record:
+        record.summary = summary
+        record.summarized_until = newest
+        record.save(update_fields=['summary', 'summarized_until', 'updated_at'])
+    else:
+        # A concurrent request may have stored the first summary since we looked
+        ConversationSummary.objects.update_or_create(
+            user=user, topic=topic, defaults={'summary': summary, 'summarized_until': newest}
+        )
+    return summary
@@ -0,0 +1,120 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Subject, SubjectProgress
+
+DEFAULT_DAYS = 14
+GENERATION_KEY = 'curriculum:generation'
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so an evicted counter can't reuse an old value
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+def _build(name, subject):
+    titles = list(subject.curriculum) if subject is not None and subject.curriculum else []
+    labels = titles or [f"Day {day}" for day in range(1, DEFAULT_DAYS + 1)]
+    # One finished day list per possible position, the last being "all done"
+    day_lists = [
+        [
+            {
+                "day": day,
+                "status": "completed" if day < current else "in_progress" if day == current else "locked",
+                "label": label,
+            }
+            for day, label in enumerate(labels, start=1)
+        ]
+        for current in range(1, len(labels) + 2)
+    ]
+    return {
+        "subject_id": subject.id if subject is not None else None,
+        "name": subject.name if subject is not None else name,
+        "days": len(labels),
+        "day_lists": day_lists,
+    }
+
+def get_curriculum(name):
+    """
+    A subject's curriculum with its day-status lists precomputed, from the
+    default cache. A name with no Subject row gets the default 14 days
+    (nothing is created on a read). Subject saves/deletes expire every entry.
+    """
+    key = f"curriculum:{_generation()}:{hashlib.sha1(name.encode()).hexdigest()}"
+    entry = cache.get(key)
+    if entry is None:
+        entry = _build(name, Subject.objects.filter(name=name).first())
+        cache.set(key, entry, settings.CURRICULUM_CACHE_TTL)
+    return entry
+
+def invalidate_curriculum():
+    def bump():
+        _generation()
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            # Evicted between the read and incr(); the next read reseeds it
+            pass
+
+    bump()
+    # Again once the change commits, in case a reader rebuilt an entry in between
+    transaction.on_commit(bump)
+
+
+def _progress_key(user_id, subject_id):
+    return f"subject_progress:{user_id}:{subject_id}"
+
+def current_day(user_id, subject_id):
+    """The student's current day in a subject (1 for guests and unknown subjects), cached."""
+    if user_id is None or subject_id is None:
+        return 1
+    key = _progress_key(user_id, subject_id)
+    day = cache.get(key)
+    if day is None:
+        day = SubjectProgress.objects.filter(
+            user_id=user_id, subject_id=subject_id
+        ).values_list('current_day', flat=True).first() or 1
+        cache.set(key, day, settings.CURRICULUM_CACHE_TTL)
+    return day
+
+def subject_days(curriculum, day):
+    """(day list, current day) for a student at `day`; days past the end count as all completed."""
+    day = min(day, curriculum["days"] + 1)
+    return curriculum["day_lists"][day - 1], min(day, curriculum["days"])
+
+def forget_progress(user_id, subject_id):
+    key = _progress_key(user_id, subject_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+def complete_day(user_id, subject_id, days):
+    """
+    Mark the student's current day in a subject completed, unlocking the
+    next one. A student who has finished all `days` of the subject stays on
+    days + 1 ("all done").
+    """
+    def advance():
+        return SubjectProgress.objects.filter(
+            user_id=user_id, subject_id=subject_id, current_day__lte=days
+        ).update(current_day=F('current_day') + 1, updated_at=timezone.now())
+
+    # One UPDATE for a student already on the subject; the row is only created on their first day
+    if not advance():
+        _, created = SubjectProgress.objects.get_or_create(
+            user_id=user_id, subject_id=subject_id, defaults={'current_day': 2}
+        )
+        if not created:
+            # Already past the last day, or a concurrent first completion
+            # created the row between the two statements
+            advance()
+    # update() sends no post_save
+    forget_progress(user_id, subject_id)
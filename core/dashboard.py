@@ -0,0 +1,94 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Quiz, UserAchievement, UserProfile, UserQuizAttempt
+
+GLOBAL_GENERATION_KEY = 'dashboard:generation'
+RECENT_ACHIEVEMENTS = 4
+
+
+def _count_subquery(queryset, field='pk', distinct=False):
+    """Correlated COUNT(...) as an annotation; 0 when there are no rows."""
+    grouped = queryset.order_by().annotate(_group=Value(1)).values('_group')
+    return Coalesce(
+        Subquery(grouped.annotate(n=Count(field, distinct=distinct)).values('n')[:1]),
+        0,
+    )
+
+def dashboard_profile(user):
+    """
+    The student's profile with every dashboard counter annotated and the
+    latest achievements prefetched: two queries, whatever the user's history.
+    """
+    return UserProfile.objects.select_related('user').annotate(
+        achievements_count=_count_subquery(UserAchievement.objects.filter(user=OuterRef('user_id'))),
+        quizzes_taken=_count_subquery(
+            UserQuizAttempt.objects.filter(user=OuterRef('user_id')), field='quiz', distinct=True
+        ),
+        quizzes_total=_count_subquery(Quiz.objects.all()),
+    ).prefetch_related(
+        Prefetch(
+            'user__achievements',
+            queryset=UserAchievement.objects.order_by('-unlocked_at')[:RECENT_ACHIEVEMENTS],
+            to_attr='recent_achievements',
+        )
+    ).get(user=user)
+
+
+def _generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so an evicted counter can't reuse an old value
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+def _user_generation_key(user_id):
+    return f"dashboard:generation:{user_id}"
+
+def dashboard_cache_key(user_id):
+    """
+    Per-user payload key. It embeds a global generation (bumped when the quiz
+    catalogue changes) and a per-user one (bumped on that user's XP,
+    achievement, quiz and profile changes), so invalidation is one incr and
+    a payload built from stale data lands under a key nobody reads.
+    """
+    return (
+        f"dashboard:{_generation(GLOBAL_GENERATION_KEY)}"
+        f":{_generation(_user_generation_key(user_id))}:{user_id}"
+    )
+
+def invalidate_dashboard(user_id=None):
+    """Expire one student's cached dashboard, or everyone's when user_id is None."""
+    key = GLOBAL_GENERATION_KEY if user_id is None else _user_generation_key(user_id)
+
+    def bump():
+        _generation(key)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between the read and incr(); the next read reseeds it
+            pass
+
+    bump()
+    # Again once the change commits, in case a reader rebuilt the payload in between
+    transaction.on_commit(bump)
+
+def store_dashboard(key, data, streak_date):
+    """Cache a freshly built payload with its ETag and return the entry."""
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    entry = {
+        "data": json.loads(body),
+        "etag": f'"{hashlib.md5(body.encode()).hexdigest()}"',
+        "streak_date": streak_date,
+    }
+    cache.set(key, entry, settings.DASHBOARD_CACHE_TTL)
+    return entry
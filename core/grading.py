@@ -0,0 +1,130 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .curriculum import complete_day, get_curriculum
+from .models import ActivityEvent, Option, Quiz, UserAnswer, UserQuizAttempt
+from .services import award_xp
+from .write_buffer import activity_event_writes
+
+GENERATION_KEY = 'answer_key:generation'
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so an evicted counter can't reuse an old value
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+def _build(quiz_id):
+    quiz = Quiz.objects.select_related('subject').filter(pk=quiz_id).first()
+    if quiz is None:
+        return None
+    options, correct = {}, {}
+    rows = Option.objects.filter(question__quiz_id=quiz_id).values_list('question_id', 'id', 'is_correct')
+    for question_id, option_id, is_correct in rows:
+        options.setdefault(question_id, set()).add(option_id)
+        correct.setdefault(question_id, set())
+        if is_correct:
+            correct[question_id].add(option_id)
+    # Questions without options can't be answered, but still count towards the total
+    for question_id in quiz.questions.values_list('id', flat=True):
+        options.setdefault(question_id, set())
+        correct.setdefault(question_id, set())
+    return {
+        "quiz_id": quiz.id,
+        "title": quiz.title,
+        "xp_reward": quiz.xp_reward,
+        "subject_id": quiz.subject_id,
+        "subject_name": quiz.subject.name,
+        "options": options,
+        "correct": correct,
+    }
+
+def answer_key(quiz_id):
+    """
+    What grading needs to know about a quiz, from the default cache: its
+    reward and subject, and per question the option ids and the correct ones.
+    None for an unknown quiz. Quiz, Question and Option changes expire every key.
+    """
+    key = f"answer_key:{_generation()}:{quiz_id}"
+    entry = cache.get(key)
+    if entry is None:
+        entry = _build(quiz_id)
+        if entry is None:
+            return None
+        cache.set(key, entry, settings.ANSWER_KEY_CACHE_TTL)
+    return entry
+
+def invalidate_answer_keys():
+    def bump():
+        _generation()
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            # Evicted between the read and incr(); the next read reseeds it
+            pass
+
+    bump()
+    # Again once the change commits, in case a reader rebuilt a key in between
+    transaction.on_commit(bump)
+
+
+def grade(key, answers):
+    """
+    Grade `answers` ({question id: option id}) against an answer key.
+    Returns (score, [(question id, option id, is correct)]); unanswered
+    questions score nothing. Raises ValueError for a question outside the
+    quiz or an option outside its question.
+    """
+    graded = []
+    for question_id, option_id in answers.items():
+        options = key["options"].get(question_id)
+        if options is None:
+            raise ValueError(f"Question {question_id} is not part of this quiz.")
+        if option_id not in options:
+            raise ValueError(f"Option {option_id} is not an answer to question {question_id}.")
+        graded.append((question_id, option_id, option_id in key["correct"][question_id]))
+    return sum(is_correct for _, _, is_correct in graded), graded
+
+def submit_quiz(user, key, answers, time_taken=0):
+    """
+    Grade a whole submission and record it in one transaction: the attempt
+    and its UserAnswer rows (one bulk_create) and, on the student's first
+    passing attempt at the quiz, the completed-quiz counter and XP (one
+    profile UPDATE, see award_xp) and their subject day.
+    Returns (attempt, graded answers, XP earned); raises ValueError like grade().
+    """
+    score, graded = grade(key, answers)
+    with transaction.atomic():
+        # Retakes and zero scores earn nothing and don't move the student on to the next day
+        first_pass = score > 0 and not UserQuizAttempt.objects.filter(
+            user=user, quiz_id=key["quiz_id"], score__gt=0
+        ).exists()
+        xp = key["xp_reward"] if first_pass else 0
+        attempt = UserQuizAttempt.objects.create(
+            user=user,
+            quiz_id=key["quiz_id"],
+            score=score,
+            total_questions=len(key["options"]),
+            time_taken_seconds=time_taken,
+            completed_at=timezone.now(),
+        )
+        UserAnswer.objects.bulk_create([
+            UserAnswer(attempt=attempt, question_id=question_id, selected_option_id=option_id, is_correct=is_correct)
+            for question_id, option_id, is_correct in graded
+        ])
+        activity_event_writes.add(ActivityEvent(
+            user=user, kind='quiz', title=key["title"], detail=key["subject_name"], xp=xp,
+            created_at=attempt.completed_at,
+        ))
+        if first_pass:
+            # The quiz's own activity event already shows the XP
+            award_xp(user, xp, f"Quiz Completed: {key['title']}", activity=False, quiz_completed=True)
+            complete_day(user.id, key["subject_id"], get_curriculum(key["subject_name"])["days"])
+    return attempt, graded, xp
@@ -0,0 +1,163 @@
+import bisect
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from django.utils import timezone
+
+from .models import WeeklyLeaderboard
+
+
+def week_start(day=None):
+    """Monday of the week containing `day` (default: today)."""
+    day = day or timezone.localdate()
+    return day - timedelta(days=day.weekday())
+
+def record_weekly_xp(user, amount, day=None):
+    """
+    Add `amount` to the user's WeeklyLeaderboard row for this week: an
+    `UPDATE ... SET xp_gained = xp_gained + n`, inserting the row on the
+    first award of the week. Call inside the award's transaction.
+    """
+    week = week_start(day)
+    rows = WeeklyLeaderboard.objects.filter(user=user, week_start=week)
+    if rows.update(xp_gained=F('xp_gained') + amount):
+        return
+    try:
+        with transaction.atomic():
+            WeeklyLeaderboard.objects.create(user=user, week_start=week, xp_gained=amount)
+    except IntegrityError:
+        # A concurrent award inserted it first
+        rows.update(xp_gained=F('xp_gained') + amount)
+
+def rank_week(week):
+    """
+    Recompute `rank` for every row of `week` with RANK() OVER (ORDER BY
+    xp_gained DESC) in one UPDATE ... FROM (SQLite 3.33+ / PostgreSQL),
+    touching only rows whose rank moved, then publish a new snapshot.
+    Returns the number of rows in the week.
+    """
+    ranked = WeeklyLeaderboard.objects.filter(week_start=week).annotate(
+        new_rank=Window(Rank(), order_by=F('xp_gained').desc())
+    ).values('id', 'new_rank')
+    ranked_sql, params = ranked.query.sql_with_params()
+    table = connection.ops.quote_name(WeeklyLeaderboard._meta.db_table)
+    rank = connection.ops.quote_name('rank')
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET {rank} = ranked.new_rank FROM ({ranked_sql}) AS ranked "
+            f"WHERE {table}.id = ranked.id AND {table}.{rank} IS DISTINCT FROM ranked.new_rank",
+            params,
+        )
+    leaderboards.invalidate(week)
+    return WeeklyLeaderboard.objects.filter(week_start=week).count()
+
+def display_name(full_name, username):
+    """
+    How a student appears on the public leaderboard: their full name, else a
+    masked handle. Usernames are email addresses, so they are never shown.
+    """
+    if full_name and full_name.strip():
+        return full_name.strip()
+    handle = username.split('@', 1)[0]
+    return f"{handle[:2]}***"
+
+
+class LeaderboardSnapshot:
+    """
+    One week's ranking as of the last rank_week() run, sorted by rank.
+    `page()` is a slice and `rank_for_xp()` a binary search, so reads stay
+    O(log n) however many students took part.
+    """
+    def __init__(self, week, version, rows):
+        self.week = week
+        self.version = version
+        self.loaded_at = time.monotonic()
+        # (rank, user_id, display name, xp_gained), best first
+        self.entries = tuple(rows)
+        # Ascending negated XP so bisect can count students strictly ahead
+        self._neg_xp = [-xp for _, _, _, xp in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def page(self, offset, limit):
+        return self.entries[offset:offset + limit]
+
+    def rank_for_xp(self, xp):
+        """Rank a student with `xp` this week would have among the ranked rows."""
+        return bisect.bisect_left(self._neg_xp, -xp) + 1
+
+
+class LeaderboardRegistry:
+    """
+    Process-local LeaderboardSnapshots, one per week, rebuilt once they are
+    settings.LEADERBOARD_SNAPSHOT_MAX_AGE seconds old. rank_week() also bumps
+    a version per week in the default cache; with a shared cache (REDIS_URL)
+    every process rebuilds right after a ranking run, with locmem only the
+    process that ran it does and the others catch up within the max age.
+    """
+    MAX_WEEKS = 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def get(self, week):
+        version = self._version(week)
+        snapshot = self._snapshots.get(week)
+        if not self._fresh(snapshot, version):
+            with self._lock:
+                snapshot = self._snapshots.get(week)
+                if not self._fresh(snapshot, version):
+                    snapshot = self._load(week, version)
+                    self._snapshots[week] = snapshot
+                    # Only the last few weeks are read in practice
+                    while len(self._snapshots) > self.MAX_WEEKS:
+                        self._snapshots.pop(next(iter(self._snapshots)))
+        return snapshot
+
+    def invalidate(self, week):
+        self._version(week)
+        try:
+            cache.incr(self._version_key(week))
+        except ValueError:
+            # Evicted between the read and incr(); the next get() reseeds it
+            pass
+
+    @staticmethod
+    def _fresh(snapshot, version):
+        return (
+            snapshot is not None and snapshot.version == version
+            and time.monotonic() - snapshot.loaded_at < settings.LEADERBOARD_SNAPSHOT_MAX_AGE
+        )
+
+    def _version_key(self, week):
+        return f"leaderboard:version:{week.isoformat()}"
+
+    def _version(self, week):
+        key = self._version_key(week)
+        version = cache.get(key)
+        if version is None:
+            # Seed from the clock so an evicted counter can't reuse an old value
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        return version
+
+    def _load(self, week, version):
+        rows = WeeklyLeaderboard.objects.filter(
+            week_start=week, rank__isnull=False
+        ).order_by('rank', 'user_id').values_list('rank', 'user_id', 'user__profile__full_name', 'user__username', 'xp_gained')
+        return LeaderboardSnapshot(week, version, (
+            (rank, user_id, display_name(full_name, username), xp)
+            for rank, user_id, full_name, username, xp in rows.iterator(chunk_size=5000)
+        ))
+
+
+leaderboards = LeaderboardRegistry()
@@ -0,0 +1,183 @@
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from freeflow_llm import GeminiProvider, GroqProvider
+from freeflow_llm.utils import get_env_var
+
+from .router import ProviderRouter, attempt_time_left
+
+
+class OpenAIProvider(GroqProvider):
+    """
+    OpenAI's chat completions API (same wire format as Groq's), used as a
+    paid fallback when OPENAI_API_KEY is set. Comma-separated keys rotate
+    like FreeFlow's own providers.
+    """
+    def __init__(self, api_key=None):
+        if api_key is None:
+            api_key = [key.strip() for key in (get_env_var('OPENAI_API_KEY') or '').split(',') if key.strip()]
+        super().__init__(api_key=api_key)
+
+    def get_api_base_url(self):
+        return "https://api.openai.com/v1"
+
+    def build_request_payload(self, messages, temperature, max_tokens, top_p, model, stream=False, **kwargs):
+        from django.conf import settings
+
+        if model == 'default':
+            model = settings.OPENAI_MODEL
+        return super().build_request_payload(messages, temperature, max_tokens, top_p, model, stream, **kwargs)
+
+
+PROVIDER_CLASSES = {'groq': GroqProvider, 'gemini': GeminiProvider, 'openai': OpenAIProvider}
+
+def default_providers():
+    """settings.LLM_PROVIDERS, in order, skipping any without an API key."""
+    from django.conf import settings
+
+    providers = [PROVIDER_CLASSES[name]() for name in settings.LLM_PROVIDERS]
+    return [provider for provider in providers if provider.is_available()]
+
+
+class LLMClientRegistry:
+    """
+    Process-wide ProviderRouter (failover, breakers, hedging) shared by
+    every request.
+
+    Each provider's HTTP clients, sync and async, are swapped for keep-alive
+    pools of settings.LLM_POOL_SIZE connections, so repeated /ask/ calls
+    reuse open TLS connections instead of handshaking every time. The client is built
+    once (CoreConfig.ready) and dropped in forked children, so a gunicorn
+    --preload master never shares its sockets with the workers.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._handshakes = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def build(self, providers=None):
+        """(Re)build the shared client; `providers` overrides settings.LLM_PROVIDERS (tests)."""
+        with self._lock:
+            return self._build(providers)
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                client = self._client or self._build()
+        return client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+
+    def stats(self):
+        """Connection pool stats for the shared client, summed over providers."""
+        from django.conf import settings
+
+        in_use = idle = 0
+        for http_client in self._http_clients():
+            pool = getattr(http_client._transport, '_pool', None)
+            for connection in getattr(pool, 'connections', []):
+                if connection.is_idle():
+                    idle += 1
+                else:
+                    in_use += 1
+        return {
+            "pool_size": settings.LLM_POOL_SIZE,
+            "in_use": in_use,
+            "idle": idle,
+            "handshakes": self._handshakes,
+        }
+
+    def router_stats(self):
+        """Breaker state, latency and hedge counts of the shared router; {} before it is built."""
+        client = self._client
+        return client.stats() if isinstance(client, ProviderRouter) else {}
+
+    def _build(self, providers=None):
+        from django.conf import settings
+
+        if self._client is not None:
+            self._client.close()
+        load_dotenv(os.path.join(settings.BASE_DIR, '.env'))
+        if providers is None:
+            providers = default_providers()
+        for provider in providers:
+            self._pool_provider(provider)
+        client = ProviderRouter(providers)
+        self._client = client
+        self._handshakes = 0
+        return client
+
+    def _pool_provider(self, provider):
+        from django.conf import settings
+
+        limits = httpx.Limits(
+            max_connections=settings.LLM_POOL_SIZE,
+            max_keepalive_connections=settings.LLM_POOL_SIZE,
+            keepalive_expiry=settings.LLM_KEEPALIVE_SECONDS,
+        )
+        hooks = {'request': [self._trace_request]}
+        async_hooks = {'request': [self._atrace_request]}
+        provider.client.close()
+        provider.stream_client.close()
+        provider.client = httpx.Client(timeout=30.0, limits=limits, event_hooks=hooks)
+        provider.stream_client = httpx.Client(timeout=60.0, limits=limits, event_hooks=hooks)
+        # The async views' clients (built lazily by FreeFlow, unpooled) get the same limits
+        provider._async_client = httpx.AsyncClient(timeout=30.0, limits=limits, event_hooks=async_hooks)
+        provider._async_stream_client = httpx.AsyncClient(timeout=60.0, limits=limits, event_hooks=async_hooks)
+
+    def _trace_request(self, request):
+        request.extensions['trace'] = self._trace
+        # A router attempt gets no longer than its deadline allows, so an abandoned
+        # one gives its pool thread back instead of waiting out the 30s default
+        time_left = attempt_time_left()
+        if time_left is not None:
+            time_left = max(time_left, 0.01)
+            timeout = request.extensions.get('timeout') or dict.fromkeys(('connect', 'read', 'write', 'pool'))
+            request.extensions['timeout'] = {
+                name: time_left if limit is None else min(limit, time_left) for name, limit in timeout.items()
+            }
+
+    async def _atrace_request(self, request):
+        request.extensions['trace'] = self._atrace
+
+    def _trace(self, event_name, info):
+        # httpcore only opens a TCP (+TLS) connection when none is reusable
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self._handshakes += 1
+
+    async def _atrace(self, event_name, info):
+        # Async httpcore awaits its trace callback
+        self._trace(event_name, info)
+
+    def _http_clients(self):
+        client = self._client
+        if client is None:
+            return []
+        return [
+            c for p in client.providers
+            for c in (p.client, p.stream_client, p._async_client, p._async_stream_client)
+            if c is not None
+        ]
+
+    def _after_fork(self):
+        # The parent's lock state and open sockets must not leak into a worker
+        self._lock = threading.Lock()
+        self._client = None
+        self._handshakes = 0
+
+
+llm_clients = LLMClientRegistry()
+
+def get_freeflow_client():
+    """Return the shared, connection-pooled provider router."""
+    return llm_clients.get()
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import ActivityEvent, LoginHistory, UserAchievement, UserQuizAttempt, XPTransaction
+
+
+def _login_event(row):
+    return ActivityEvent(
+        user_id=row.user_id, kind='login', title="Logged in", detail=row.ip_address or '',
+        created_at=row.timestamp, source_key=f"login:{row.pk}",
+    )
+
+def _quiz_event(row):
+    return ActivityEvent(
+        user_id=row.user_id, kind='quiz', title=row.quiz.title, detail=row.quiz.subject.name,
+        xp=row.quiz.xp_reward, created_at=row.completed_at, source_key=f"quiz:{row.pk}",
+    )
+
+def _xp_event(row):
+    return ActivityEvent(
+        user_id=row.user_id, kind='xp', title=row.reason, xp=row.amount,
+        created_at=row.timestamp, source_key=f"xp:{row.pk}",
+    )
+
+def _achievement_event(row):
+    return ActivityEvent(
+        user_id=row.user_id, kind='achievement', title=row.achievement.name, created_at=row.unlocked_at,
+        source_key=f"achievement:{row.user_id}:{row.achievement_id}",
+    )
+
+
+class Command(BaseCommand):
+    help = 'Copy login, quiz, XP and achievement history written before the activity feed existed into ActivityEvent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows read and inserted per batch')
+        parser.add_argument(
+            '--until',
+            help="Only copy rows older than this ISO datetime; defaults to the first event written at event time",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        try:
+            until = datetime.fromisoformat(options['until']) if options['until'] else self._default_until()
+        except ValueError:
+            raise CommandError(f"Invalid --until: {options['until']}")
+        if timezone.is_naive(until):
+            until = timezone.make_aware(until)
+
+        # Every copied row is keyed by its source, so re-running (or overlapping with live achievement writes) is a no-op
+        sources = [
+            ('logins', LoginHistory.objects.filter(timestamp__lt=until).order_by('pk'), _login_event),
+            ('quizzes', UserQuizAttempt.objects.filter(completed_at__lt=until)
+                .select_related('quiz__subject').order_by('pk'), _quiz_event),
+            # Quiz rewards are shown on the quiz's own event
+            ('xp rewards', XPTransaction.objects.filter(timestamp__lt=until)
+                .exclude(reason__startswith="Quiz Completed:").order_by('pk'), _xp_event),
+            ('achievements', UserAchievement.objects.select_related('achievement').order_by('pk'), _achievement_event),
+        ]
+        for label, queryset, to_event in sources:
+            read = written = 0
+            batch = []
+            for row in queryset.iterator(chunk_size=chunk_size):
+                batch.append(to_event(row))
+                if len(batch) >= chunk_size:
+                    written += self._insert(batch)
+                    read += len(batch)
+                    batch = []
+            if batch:
+                written += self._insert(batch)
+                read += len(batch)
+            self.stdout.write(f"{label}: {read} read, {written} new")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled activity before {until.isoformat()}"))
+
+    def _default_until(self):
+        # Events without a source key were written live; everything older than the first one needs copying
+        first_live = (
+            ActivityEvent.objects.filter(source_key__isnull=True)
+            .order_by('created_at').values_list('created_at', flat=True).first()
+        )
+        return first_live or timezone.now()
+
+    def _insert(self, events):
+        keys = [event.source_key for event in events]
+        existing = ActivityEvent.objects.filter(source_key__in=keys).count()
+        ActivityEvent.objects.bulk_create(events, ignore_conflicts=True)
+        return ActivityEvent.objects.filter(source_key__in=keys).count() - existing
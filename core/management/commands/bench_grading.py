@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.grading import answer_key, submit_quiz
+from core.models import Level, Option, Question, Quiz, Subject
+from core.write_buffer import flush_all
+
+TARGET_PER_MINUTE = 10_000
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the quiz submission pipeline (grade, save answers, XP), each submission committed on its own, '
+        'against a throwaway student and quiz that are deleted afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=2000)
+        parser.add_argument('--questions', type=int, default=10, help='Questions per quiz (3 options each)')
+
+    def handle(self, *args, **options):
+        submissions, questions = options['submissions'], options['questions']
+        if submissions < 1 or questions < 1:
+            raise CommandError("--submissions and --questions must be at least 1")
+
+        # award_xp creates missing Level rows as the student levels up
+        levels = set(Level.objects.values_list('id', flat=True))
+        user = User.objects.create_user(username=f"bench-grading-{time.time_ns()}")
+        subject = Subject.objects.create(name=user.username)
+        try:
+            quiz = Quiz.objects.create(subject=subject, title="Grading benchmark")
+            created = Question.objects.bulk_create([Question(quiz=quiz, text=f"Q{i}", order=i) for i in range(questions)])
+            Option.objects.bulk_create([
+                Option(question=question, text=str(n), is_correct=n == 0) for question in created for n in range(3)
+            ])
+            key = answer_key(quiz.id)
+            choices = {question_id: sorted(option_ids) for question_id, option_ids in key["options"].items()}
+
+            # Each submit_quiz() is its own transaction and commits, as in production
+            started = time.perf_counter()
+            for _ in range(submissions):
+                answers = {question_id: random.choice(option_ids) for question_id, option_ids in choices.items()}
+                submit_quiz(user, key, answers, 60)
+            # Buffered rows (WRITE_BUFFER_MODE=buffered) are part of the cost too
+            flush_all()
+            elapsed = time.perf_counter() - started
+        finally:
+            # Cascades to the attempts, answers, XP and activity rows; the delete signals expire the caches
+            subject.delete()
+            user.delete()
+            # Levels created for the benchmark student, unless a real student has reached one since
+            Level.objects.exclude(id__in=levels).filter(userprofile__isnull=True).delete()
+
+        per_minute = submissions / elapsed * 60
+        message = (
+            f"{submissions} submissions of {questions} questions in {elapsed:.2f}s: "
+            f"{per_minute:,.0f}/minute ({elapsed / submissions * 1000:.2f} ms each, target {TARGET_PER_MINUTE:,}/minute)"
+        )
+        style = self.style.SUCCESS if per_minute >= TARGET_PER_MINUTE else self.style.WARNING
+        self.stdout.write(style(message))
@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+
+from core.models import Option, Question, Quiz
+
+QUIZ_FIELDS = ('title', 'description', 'difficulty', 'xp_reward', 'time_limit_seconds')
+
+
+def quiz_as_dict(quiz):
+    return {
+        'subject': quiz.subject.name,
+        **{field: getattr(quiz, field) for field in QUIZ_FIELDS},
+        'questions': [
+            {
+                'text': question.text,
+                'order': question.order,
+                'options': [{'text': option.text, 'is_correct': option.is_correct} for option in question.options.all()],
+            }
+            for question in quiz.questions.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Write quizzes with their questions and options (answers included) as JSONL, one quiz per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="File to write, or - for stdout (the default)")
+        parser.add_argument('--subject', help='Only export quizzes of this subject')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Quizzes read per batch of queries')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        quizzes = Quiz.objects.select_related('subject').prefetch_related(
+            Prefetch(
+                'questions',
+                queryset=Question.objects.order_by('order', 'id').prefetch_related(
+                    Prefetch('options', queryset=Option.objects.order_by('id'))
+                ),
+            )
+        ).order_by('pk')
+        if options['subject']:
+            quizzes = quizzes.filter(subject__name=options['subject'])
+
+        started = time.perf_counter()
+        output = self.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        exported = 0
+        try:
+            # iterator() with prefetch_related fetches questions and options once per chunk
+            for quiz in quizzes.iterator(chunk_size=chunk_size):
+                output.write(json.dumps(quiz_as_dict(quiz), ensure_ascii=False) + '\n')
+                exported += 1
+        finally:
+            if output is not self.stdout:
+                output.close()
+        elapsed = time.perf_counter() - started
+
+        # With --output - the summary would end up in the JSONL, so it goes to stderr
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {exported} quizzes in {elapsed:.2f}s: {exported / elapsed if elapsed else exported:,.0f} quizzes/second"
+        ))
@@ -0,0 +1,107 @@
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.dashboard import invalidate_dashboard
+from core.models import Option, Question, Quiz, Subject
+
+QUIZ_FIELDS = ('description', 'difficulty', 'xp_reward', 'time_limit_seconds')
+
+
+class Command(BaseCommand):
+    help = (
+        'Load quizzes from JSONL (one quiz with nested questions and options per line, as written by '
+        'export_quizzes) with bulk inserts, one transaction per chunk'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSONL file to read, or - for stdin")
+        parser.add_argument('--chunk-size', type=int, default=500, help='Quizzes inserted per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        # Subjects and existing quizzes are looked up in memory, not once per line
+        self.subject_ids = dict(Subject.objects.values_list('name', 'id'))
+        self.existing = set(Quiz.objects.values_list('subject_id', 'title'))
+        self.counts = {'quizzes': 0, 'questions': 0, 'options': 0, 'skipped': 0}
+
+        started = time.perf_counter()
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            lines = enumerate(stream, start=1)
+            while chunk := list(islice(lines, chunk_size)):
+                self._load_chunk([(number, line) for number, line in chunk if line.strip()])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - started
+
+        rows = self.counts['quizzes'] + self.counts['questions'] + self.counts['options']
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.counts['quizzes']} quizzes, {self.counts['questions']} questions and "
+            f"{self.counts['options']} options ({self.counts['skipped']} quizzes already existed) in "
+            f"{elapsed:.2f}s: {rows / elapsed if elapsed else rows:,.0f} rows/second"
+        ))
+
+    def _load_chunk(self, lines):
+        quizzes = [self._parse(number, line) for number, line in lines]
+        new = []
+        for quiz in quizzes:
+            key = (self._subject_id(quiz['subject']), quiz['title'])
+            if key in self.existing:
+                self.counts['skipped'] += 1
+                continue
+            self.existing.add(key)
+            new.append((key, quiz))
+        if not new:
+            return
+
+        with transaction.atomic():
+            # bulk_create sets the primary keys, so each level can point at the one above
+            quiz_rows = Quiz.objects.bulk_create([
+                Quiz(subject_id=subject_id, title=title, **{f: quiz[f] for f in QUIZ_FIELDS if f in quiz})
+                for (subject_id, title), quiz in new
+            ])
+            question_rows, option_lists = [], []
+            for quiz_row, (_, quiz) in zip(quiz_rows, new):
+                for order, question in enumerate(quiz['questions']):
+                    question_rows.append(Question(quiz=quiz_row, text=question['text'], order=question.get('order', order)))
+                    option_lists.append(question['options'])
+            Question.objects.bulk_create(question_rows)
+            option_rows = Option.objects.bulk_create([
+                Option(question=question_row, text=option['text'], is_correct=bool(option.get('is_correct')))
+                for question_row, question_options in zip(question_rows, option_lists)
+                for option in question_options
+            ])
+            # bulk_create sends no post_save: every dashboard's quizzes_remaining moved
+            invalidate_dashboard()
+
+        self.counts['quizzes'] += len(quiz_rows)
+        self.counts['questions'] += len(question_rows)
+        self.counts['options'] += len(option_rows)
+
+    def _parse(self, number, line):
+        try:
+            quiz = json.loads(line)
+            if not quiz['subject'] or not quiz['title']:
+                raise ValueError("subject and title must not be empty")
+            for question in quiz.setdefault('questions', []):
+                if not question.get('text') or not all(option.get('text') for option in question.setdefault('options', [])):
+                    raise ValueError("every question and option needs a text")
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            # Earlier chunks are already committed; this one is not
+            raise CommandError(f"Line {number}: invalid quiz ({e!r}); {self.counts['quizzes']} quizzes imported before it")
+        return quiz
+
+    def _subject_id(self, name):
+        subject_id = self.subject_ids.get(name)
+        if subject_id is None:
+            subject_id = self.subject_ids[name] = Subject.objects.get_or_create(name=name)[0].id
+        return subject_id
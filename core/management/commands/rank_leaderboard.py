@@ -0,0 +1,21 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.leaderboard import rank_week, week_start
+
+
+class Command(BaseCommand):
+    help = 'Recompute weekly leaderboard ranks and publish them to /leaderboard/ (run e.g. every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week', help='Any date in the week to rank (YYYY-MM-DD); defaults to this week')
+
+    def handle(self, *args, **options):
+        try:
+            week = week_start(date.fromisoformat(options['week'])) if options['week'] else week_start()
+        except ValueError:
+            raise CommandError(f"Invalid --week: {options['week']}")
+
+        ranked = rank_week(week)
+        self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} students for the week of {week.isoformat()}'))
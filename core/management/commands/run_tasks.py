@@ -0,0 +1,44 @@
+import signal
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.tasks import purge_finished, run_pending
+from core.write_buffer import flush_all
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (login bookkeeping) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the due tasks once and exit')
+        parser.add_argument('--batch', type=int, default=100, help='Tasks claimed per poll')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # SIGTERM (a deploy or scale-down) finishes the current batch instead of killing it
+        previous = signal.signal(signal.SIGTERM, self._stop)
+        self.stdout.write('Task worker started.')
+        try:
+            while not self.stopping:
+                ran = run_pending(limit=options['batch'])
+                if ran:
+                    self.stdout.write(f'Ran {ran} task(s)')
+                    continue
+                if options['once']:
+                    break
+                # Idle: tidy up finished tasks, then wait for more work
+                purge_finished(timezone.now() - timedelta(hours=settings.TASK_RETENTION_HOURS))
+                time.sleep(options['sleep'])
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            # Write the rows the tasks left in the write buffers before exiting
+            flush_all()
+        self.stdout.write(self.style.SUCCESS('Task worker stopped.'))
+
+    def _stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,205 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+
+# Seconds; the same buckets serve request, SQL and LLM latencies
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestTimings:
+    """What one request spent on SQL and LLM calls; collected through a context variable."""
+    __slots__ = ('db_queries', 'db_seconds', 'llm_calls', 'llm_seconds')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+
+_current = ContextVar('request_timings', default=None)
+
+
+class MetricsRegistry:
+    """
+    In-process request, SQL and LLM metrics, rendered in the Prometheus text
+    format by /metrics. Like the locmem rate limiter, every worker process
+    keeps its own numbers: scrape each worker, or sum them in Prometheus.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._requests = {}
+            self._request_queries = {}
+            self._request_db_seconds = {}
+            self._llm = {}
+            self._llm_tokens = {}
+            self._llm_errors = {}
+
+    def observe_request(self, view, method, status, seconds, timings):
+        labels = (('view', view), ('method', method), ('status', str(status)))
+        view_labels = (('view', view),)
+        with self._lock:
+            self._histogram(self._requests, labels).observe(seconds)
+            self._request_queries[view_labels] = self._request_queries.get(view_labels, 0) + timings.db_queries
+            self._request_db_seconds[view_labels] = self._request_db_seconds.get(view_labels, 0.0) + timings.db_seconds
+
+    def observe_llm(self, provider, seconds, tokens=0, ok=True):
+        labels = (('provider', provider),)
+        with self._lock:
+            if ok:
+                self._histogram(self._llm, labels).observe(seconds)
+                self._llm_tokens[labels] = self._llm_tokens.get(labels, 0) + tokens
+            else:
+                self._llm_errors[labels] = self._llm_errors.get(labels, 0) + 1
+
+    def render(self):
+        with self._lock:
+            lines = []
+            self._render_histogram(lines, 'mentora_request_duration_seconds',
+                                   "Time to build a response, per view", self._requests)
+            self._render_counter(lines, 'mentora_request_db_queries_total',
+                                 "SQL queries issued while serving requests", self._request_queries)
+            self._render_counter(lines, 'mentora_request_db_seconds_total',
+                                 "Time spent in SQL while serving requests", self._request_db_seconds)
+            self._render_histogram(lines, 'mentora_llm_call_duration_seconds',
+                                   "Successful LLM calls, by provider", self._llm)
+            self._render_counter(lines, 'mentora_llm_tokens_total',
+                                 "Tokens used by LLM calls (prompt and completion)", self._llm_tokens)
+            self._render_counter(lines, 'mentora_llm_call_errors_total',
+                                 "Failed LLM calls, by provider", self._llm_errors)
+        return lines
+
+    def _histogram(self, family, labels):
+        histogram = family.get(labels)
+        if histogram is None:
+            histogram = family[labels] = Histogram()
+        return histogram
+
+    def _render_histogram(self, lines, name, help_text, family):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, histogram in sorted(family.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+    def _render_counter(self, lines, name, help_text, family):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for labels, value in sorted(family.items()):
+            lines.append(f"{name}{format_labels(labels)} {value}")
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def gauge_lines(name, help_text, samples, kind='gauge'):
+    """Prometheus lines for `samples`: {labels tuple: value}, skipping missing values."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{format_labels(labels)} {value}" for labels, value in samples.items() if value is not None]
+    return lines
+
+
+metrics = MetricsRegistry()
+
+def app_stat_lines():
+    """The stats the LLM pool, provider router, answer cache and question coalescing already keep."""
+    from .answer_cache import answer_cache
+    from .llm import llm_clients
+    from .singleflight import llm_flights
+
+    pool = llm_clients.stats()
+    router = llm_clients.router_stats()
+    answers = answer_cache.stats()
+    flights = llm_flights.stats()
+    providers = router.get("providers", {})
+    return (
+        gauge_lines('mentora_llm_pool_connections', "Keep-alive connections to LLM providers",
+                    {(('state', 'in_use'),): pool["in_use"], (('state', 'idle'),): pool["idle"]})
+        + gauge_lines('mentora_llm_handshakes_total', "New TCP/TLS connections to LLM providers",
+                      {(): pool["handshakes"]}, kind='counter')
+        + gauge_lines('mentora_llm_breaker_open', "1 while a provider's circuit breaker is open",
+                      {(('provider', name),): int(p["state"] == 'open') for name, p in providers.items()})
+        + gauge_lines('mentora_llm_ewma_seconds', "Recent LLM latency (EWMA), by provider",
+                      {(('provider', name),): p["ewma_ms"] / 1000 if p["ewma_ms"] is not None else None
+                       for name, p in providers.items()})
+        + gauge_lines('mentora_llm_hedges_total', "Hedged (second-provider) LLM requests",
+                      {(): router.get("hedges", 0)}, kind='counter')
+        + gauge_lines('mentora_answer_cache_lookups_total', "Answer cache lookups, by result",
+                      {(('result', name),): answers[name] for name in ('hits', 'similar_hits', 'misses')}, kind='counter')
+        + gauge_lines('mentora_answer_cache_saved_tokens_total', "LLM tokens saved by cached answers",
+                      {(): answers["saved_tokens"]}, kind='counter')
+        + gauge_lines('mentora_llm_coalesced_total', "Identical in-flight questions, by role",
+                      {(('role', name),): flights[name] for name in ('leaders', 'coalesced', 'remote_coalesced')},
+                      kind='counter')
+    )
+
+
+# ─── Collection ──────────────────────────────────────────────────────────────
+
+def start_request(timings=None):
+    """
+    Begin collecting timings for the current request, or resume collecting
+    into `timings` (a streaming body's next chunk); returns (timings, reset token).
+    """
+    if timings is None:
+        timings = RequestTimings()
+    return timings, _current.set(timings)
+
+def end_request(token):
+    _current.reset(token)
+
+def record_llm_wait(seconds):
+    """Charge time the current request spent waiting on the LLM to its Server-Timing."""
+    timings = _current.get()
+    if timings is not None:
+        timings.llm_calls += 1
+        timings.llm_seconds += seconds
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_queries += 1
+        timings.db_seconds += time.perf_counter() - started
+
+def instrument_connection(sender, connection, **kwargs):
+    """Time every query on `connection` (an execute_wrapper installed for its lifetime)."""
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+# Connections are per thread (and sync_to_async threads inherit the request's context),
+# so each one is instrumented as it connects
+connection_created.connect(instrument_connection)
@@ -0,0 +1,160 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.http import JsonResponse
+
+from .metrics import end_request, metrics, start_request
+from .ratelimit import check_rate_limit
+
+RATE_LIMIT_ERROR = "You're asking questions faster than Mentora can answer. Please wait a moment!"
+
+
+class RateLimitMiddleware:
+    """
+    Token-bucket limit on the tutor endpoints (settings.RATE_LIMITED_PATHS),
+    checked before the view runs so a flood of requests is turned away with
+    a 429 and Retry-After before any profile read or write. Signed-in
+    students are keyed by user id (from the session, without loading the
+    User) and sized by plan; guests by client IP.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if self._is_limited(request):
+            retry_after = check_rate_limit(request.session.get(SESSION_KEY), self._client_ip(request))
+            if retry_after:
+                return self._too_many_requests(retry_after)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if self._is_limited(request):
+            user_id = await request.session.aget(SESSION_KEY)
+            retry_after = await sync_to_async(check_rate_limit)(user_id, self._client_ip(request))
+            if retry_after:
+                return self._too_many_requests(retry_after)
+        return await self.get_response(request)
+
+    def _is_limited(self, request):
+        return request.method == 'POST' and request.path in settings.RATE_LIMITED_PATHS
+
+    def _client_ip(self, request):
+        header = settings.RATE_LIMIT_CLIENT_IP_HEADER
+        if header and request.META.get(header):
+            # Behind a proxy: the left-most address is the original client
+            return request.META[header].split(',')[0].strip()
+        return request.META.get('REMOTE_ADDR')
+
+    def _too_many_requests(self, retry_after):
+        response = JsonResponse({"error": RATE_LIMIT_ERROR, "retry_after": retry_after}, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Per-view latency histogram plus the SQL queries/time and LLM time each
+    request spent, for /metrics. With settings.METRICS_SERVER_TIMING the same
+    numbers go out in a Server-Timing header, so browser dev tools show how
+    much of /ask/ was the LLM and how much the database.
+
+    Streaming responses are observed when their body has been sent (or the
+    client went away), so the histogram and query counts cover the whole
+    stream; their Server-Timing header goes out before the body, so it only
+    covers the work done before the first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        timings, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self._finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        timings, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self._finish(request, response, timings, started)
+
+    def _finish(self, request, response, timings, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        # Unresolved paths share one label so scanners can't blow up the series count
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+        if response.streaming:
+            observe = lambda: metrics.observe_request(
+                view, request.method, response.status_code, time.perf_counter() - started, timings
+            )
+            if response.is_async:
+                response.streaming_content = self._atimed(response.streaming_content, timings, observe)
+            else:
+                response.streaming_content = self._timed(response.streaming_content, timings, observe)
+        else:
+            metrics.observe_request(view, request.method, response.status_code, elapsed, timings)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.db_queries} queries", '
+                f'llm;dur={timings.llm_seconds * 1000:.1f};desc="{timings.llm_calls} calls", '
+                f'total;dur={elapsed * 1000:.1f}'
+            )
+        return response
+
+    @staticmethod
+    def _timed(content, timings, observe):
+        # The body is produced after __call__ returned: charge each chunk's
+        # queries and LLM waits to this request again
+        try:
+            iterator = iter(content)
+            while True:
+                _, token = start_request(timings)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    end_request(token)
+                yield chunk
+        finally:
+            observe()
+
+    @staticmethod
+    async def _atimed(content, timings, observe):
+        try:
+            iterator = aiter(content)
+            while True:
+                _, token = start_request(timings)
+                try:
+                    chunk = await anext(iterator)
+                except StopAsyncIteration:
+                    break
+                finally:
+                    end_request(token)
+                yield chunk
+        finally:
+            observe()
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_conversation_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'topic', 'created_at'], name='conversation_user_topic_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loginhistory',
+            index=models.Index(fields=['user', 'timestamp'], name='loginhistory_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userquizattempt',
+            index=models.Index(fields=['user', 'completed_at'], name='quizattempt_user_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xptransaction',
+            index=models.Index(fields=['user', 'timestamp'], name='xptransaction_user_time_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='weeklyleaderboard',
+            index=models.Index(fields=['week_start', 'rank'], name='leaderboard_week_rank_idx'),
+        ),
+    ]
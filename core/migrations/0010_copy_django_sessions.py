@@ -0,0 +1,56 @@
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+
+def copy_sessions(apps, schema_editor):
+    """
+    Carry live sessions over from django_session to core_usersession, so
+    switching SESSION_ENGINE to core.sessions doesn't sign everyone out.
+    """
+    Session = apps.get_model('sessions', 'Session')
+    UserSession = apps.get_model('core', 'UserSession')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    store = SessionStore()
+
+    sessions = Session.objects.filter(expire_date__gt=timezone.now()).iterator(chunk_size=BATCH_SIZE)
+    while batch := list(islice(sessions, BATCH_SIZE)):
+        user_ids = {}
+        for session in batch:
+            try:
+                user_ids[session.session_key] = int(store.decode(session.session_data).get(SESSION_KEY))
+            except (TypeError, ValueError):
+                user_ids[session.session_key] = None
+        # Sessions of since-deleted users are kept, signed out like guests
+        existing = set(User.objects.filter(pk__in=set(user_ids.values())).values_list('pk', flat=True))
+        UserSession.objects.bulk_create(
+            [
+                UserSession(
+                    session_key=session.session_key,
+                    session_data=session.session_data,
+                    expire_date=session.expire_date,
+                    user_id=user_ids[session.session_key] if user_ids[session.session_key] in existing else None,
+                )
+                for session in batch
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_activity_event'),
+        ('sessions', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_sessions, migrations.RunPython.noop),
+    ]
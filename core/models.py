@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.sessions.base_session import AbstractBaseSession
 from django.utils import timezone
 
 # 1. Level System
@@ -54,6 +55,7 @@ class Subject(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     icon_name = models.CharField(max_length=50, default='book')
+    curriculum = models.JSONField(default=list, blank=True, help_text="Day titles, in order; empty means 14 untitled days")
 
     def __str__(self):
         return self.name
@@ -103,6 +105,12 @@ class UserQuizAttempt(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     time_taken_seconds = models.IntegerField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Account page: a user's latest completed attempts
+            models.Index(fields=['user', 'completed_at'], name='quizattempt_user_done_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.quiz.title} ({self.score}/{self.total_questions})"
 
@@ -145,6 +153,11 @@ class XPTransaction(models.Model):
     reason = models.CharField(max_length=255)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='xptransaction_user_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} +{self.amount} XP ({self.reason})"
 
@@ -156,15 +169,23 @@ class WeeklyLeaderboard(models.Model):
 
     class Meta:
         unique_together = ('user', 'week_start')
+        indexes = [
+            # Ranking job and leaderboard snapshot: one week, in rank order
+            models.Index(fields=['week_start', 'rank'], name='leaderboard_week_rank_idx'),
+        ]
 
 class LoginHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_history')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by the caller (defaults to now) so a queued or buffered write keeps the login time
+    timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(null=True, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='loginhistory_user_time_idx'),
+        ]
 
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
@@ -173,5 +194,115 @@ class Conversation(models.Model):
     answer = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Tutor prompt history and /history/ both filter on (user, topic) newest first
+            models.Index(fields=['user', 'topic', 'created_at'], name='conversation_user_topic_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.topic}"
+
+class ConversationSummary(models.Model):
+    """
+    Rolling summary of the older turns of a (user, topic) conversation that
+    no longer fit in the tutor prompt (see core/context.py).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_summaries')
+    topic = models.CharField(max_length=255)
+    summary = models.TextField(blank=True)
+    summarized_until = models.BigIntegerField(default=0, help_text="Newest Conversation id folded into the summary")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'topic')
+
+    def __str__(self):
+        return f"{self.user.username} - {self.topic} (summary)"
+
+# 6. Background Work
+class BackgroundTask(models.Model):
+    """
+    A queued side effect (login bookkeeping, XP awards, ...) run by
+    `manage.py run_tasks` instead of on the request thread (see core/tasks.py).
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Due time, or lease expiry while RUNNING")
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Worker poll: due tasks, oldest first
+            models.Index(fields=['status', 'run_after'], name='backgroundtask_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} [{self.status}] (attempt {self.attempts}/{self.max_attempts})"
+
+class UserSession(AbstractBaseSession):
+    """
+    Database session (SESSION_ENGINE = 'core.sessions') that also records the
+    signed-in user, so all of a user's sessions can be found or revoked with
+    one indexed query instead of decoding every session in the table.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='sessions')
+
+    @classmethod
+    def get_session_store_class(cls):
+        from .sessions import SessionStore
+        return SessionStore
+
+class SubjectProgress(models.Model):
+    """ How far a student is through a subject's day-by-day curriculum. """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subject_progress')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='progress')
+    current_day = models.PositiveIntegerField(default=1, help_text="Days before this one are completed")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'subject')
+
+    def __str__(self):
+        return f"{self.user.username} - {self.subject.name} (Day {self.current_day})"
+
+class ActivityEvent(models.Model):
+    """
+    Append-only feed of what a student did, written when it happens (see
+    core.write_buffer.activity_event_writes) so the account page reads it
+    with one index scan instead of stitching the history tables together.
+    """
+    KIND_CHOICES = [
+        ('login', 'Login'),
+        ('quiz', 'Quiz completed'),
+        ('xp', 'XP reward'),
+        ('achievement', 'Achievement unlocked'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='activity_events')
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    title = models.CharField(max_length=255)
+    detail = models.CharField(max_length=255, blank=True, help_text="e.g. the quiz's subject")
+    xp = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Identifies the source row for events that have one (backfilled rows, achievements), so they are never doubled
+    source_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Account page / /activity/: a user's newest events
+            models.Index(fields=['user', 'created_at'], name='activityevent_user_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} {self.kind}: {self.title}"
@@ -0,0 +1,90 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from .models import Option, Question, Quiz
+from .singleflight import SingleFlight
+
+GLOBAL_GENERATION_KEY = 'quiz_content:generation'
+
+quiz_builds = SingleFlight('quiz_content')
+
+
+def _generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so an evicted counter can't reuse an old value
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+def _quiz_version_key(quiz_id):
+    return f"quiz_content:version:{quiz_id}"
+
+def quiz_content_key(quiz_id):
+    """
+    Cache key of a quiz's payload: a global generation (bumped when subjects
+    change) and the quiz's own version (bumped when it, or any of its
+    questions or options, changes).
+    """
+    return (
+        f"quiz_content:{_generation(GLOBAL_GENERATION_KEY)}"
+        f":{_generation(_quiz_version_key(quiz_id))}:{quiz_id}"
+    )
+
+def invalidate_quiz_content(quiz_id=None):
+    """Expire one quiz's cached payload, or every quiz's when quiz_id is None."""
+    key = GLOBAL_GENERATION_KEY if quiz_id is None else _quiz_version_key(quiz_id)
+
+    def bump():
+        _generation(key)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between the read and incr(); the next read reseeds it
+            pass
+
+    bump()
+    # Again once the change commits, in case a reader rebuilt the payload in between
+    transaction.on_commit(bump)
+
+
+def _build(quiz_id):
+    from .serializers import QuizContentSerializer
+
+    quiz = Quiz.objects.select_related('subject').prefetch_related(
+        Prefetch(
+            'questions',
+            queryset=Question.objects.order_by('order', 'id').prefetch_related(
+                Prefetch('options', queryset=Option.objects.only('id', 'question_id', 'text').order_by('id'))
+            ),
+        )
+    ).filter(pk=quiz_id).first()
+    if quiz is None:
+        return None
+    body = JSONRenderer().render(QuizContentSerializer(quiz).data)
+    return {"body": body, "etag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+def quiz_content(quiz_id):
+    """
+    A quiz with its questions and options (correct answers left out), as
+    ready-to-send JSON bytes with an ETag: {"body", "etag"}, or None for an
+    unknown quiz. Built with three queries on a miss, and concurrent misses
+    for the same quiz share one build.
+    """
+    key = quiz_content_key(quiz_id)
+    entry = cache.get(key)
+    if entry is None:
+        entry, _ = quiz_builds.do(key, lambda: _build_and_store(key, quiz_id))
+    return entry
+
+def _build_and_store(key, quiz_id):
+    entry = _build(quiz_id)
+    if entry is not None:
+        cache.set(key, entry, settings.QUIZ_CONTENT_CACHE_TTL)
+    return entry
@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+
+class LocMemTokenBucket:
+    """
+    Token buckets kept in process memory: (tokens, last refill, full at) per
+    key, refilled lazily on each call. Each worker process limits on its own,
+    so the effective limit is per process; use RedisTokenBucket to share it.
+    """
+    def __init__(self, max_keys=100_000):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.max_keys = max_keys
+
+    def consume(self, key, capacity, refill_per_second, cost=1):
+        """Take `cost` tokens; returns (allowed, seconds until enough tokens exist)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - last) * refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                self._evict(now)
+            full_at = now + (capacity - tokens) / refill_per_second
+            self._buckets[key] = (tokens, now, full_at)
+        return allowed, 0.0 if allowed else (cost - tokens) / refill_per_second
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def _evict(self, now):
+        # A bucket that has refilled completely is the same as no bucket at all
+        idle = [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for key in idle or list(self._buckets)[:self.max_keys // 10]:
+            del self._buckets[key]
+
+
+class RedisTokenBucket:
+    """
+    Token buckets in Redis, shared by every worker. The refill-and-take step
+    runs as one Lua script, so concurrent requests can't overdraw a bucket,
+    and idle buckets expire once they would be full again.
+    """
+    SCRIPT = """
+    local capacity, rate, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url=None):
+        import redis
+
+        self.client = redis.Redis.from_url(url or settings.RATE_LIMIT_REDIS_URL)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, refill_per_second, cost=1):
+        allowed, tokens = self.script(keys=[f"ratelimit:{key}"], args=[capacity, refill_per_second, time.time(), cost])
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else (cost - tokens) / refill_per_second
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_rate_limiter():
+    """The configured settings.RATE_LIMIT_BACKEND, built once per process."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.RATE_LIMIT_BACKEND)()
+    return _backend
+
+
+def plan_for_user(user_id):
+    """A user's plan code, cached so the limiter doesn't read the profile per request."""
+    from .models import UserProfile
+
+    key = f"ratelimit:plan:{user_id}"
+    plan = cache.get(key)
+    if plan is None:
+        plan = UserProfile.objects.filter(user_id=user_id).values_list('plan', flat=True).first() or 'FREE'
+        cache.set(key, plan, 60 * 60)
+    return plan
+
+def forget_plan(user_id):
+    cache.delete(f"ratelimit:plan:{user_id}")
+
+def check_rate_limit(user_id, ip_address):
+    """
+    Take one token from the caller's bucket: per user for signed-in students
+    (sized by their plan), per IP address for guests.
+    Returns None when the request may proceed, else the Retry-After in whole seconds.
+    """
+    if user_id is None:
+        key, plan = f"ip:{ip_address}", 'GUEST'
+    else:
+        key, plan = f"user:{user_id}", plan_for_user(user_id)
+    burst, per_minute = settings.RATE_LIMITS.get(plan, settings.RATE_LIMITS['FREE'])
+    allowed, retry_after = get_rate_limiter().consume(key, burst, per_minute / 60)
+    return None if allowed else max(1, math.ceil(retry_after))
@@ -0,0 +1,389 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from freeflow_llm.exceptions import NoProvidersAvailableError
+
+from .metrics import metrics, record_llm_wait
+
+# Deadline of the provider attempt running in this thread (or task); the pooled
+# HTTP clients cap each request's timeout by it (see core.llm)
+_attempt_deadline = contextvars.ContextVar('llm_attempt_deadline', default=None)
+
+
+def attempt_time_left():
+    """Seconds left for the current provider attempt, or None outside one."""
+    deadline = _attempt_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class ProviderHealth:
+    """
+    Circuit breaker and latency history for one provider.
+
+    CLOSED: requests flow. After LLM_BREAKER_FAILURES consecutive failures the
+    breaker OPENs and the provider is skipped for LLM_BREAKER_COOLDOWN_SECONDS;
+    then it is HALF_OPEN and one trial request decides whether it closes
+    again or re-opens.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.ewma = None
+        self.latencies = deque(maxlen=100)
+        self.calls = 0
+        self.failures = 0
+
+    @property
+    def name(self):
+        return self.provider.name
+
+    def acquire(self, now):
+        """May a request go to this provider now? Claims the half-open trial slot."""
+        if self.state == self.OPEN and now - self.opened_at >= settings.LLM_BREAKER_COOLDOWN_SECONDS:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+        return self.state != self.OPEN
+
+    def record_success(self, latency=None):
+        self.calls += 1
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.trial_in_flight = False
+        if latency is None:
+            return
+        self.latencies.append(latency)
+        alpha = settings.LLM_EWMA_ALPHA
+        self.ewma = latency if self.ewma is None else alpha * latency + (1 - alpha) * self.ewma
+
+    def record_failure(self, now):
+        self.calls += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= settings.LLM_BREAKER_FAILURES:
+            self.state = self.OPEN
+            self.opened_at = now
+
+    def p95(self):
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[math.ceil(0.95 * len(ordered)) - 1]
+
+
+class ProviderRouter:
+    """
+    Drop-in replacement for FreeFlowClient's chat()/async_chat()/chat_stream()
+    that routes over the same providers with:
+
+    * failover: providers are tried in order until one answers; with
+      settings.LLM_ROUTING = 'latency' the order is by latency EWMA
+      (providers without samples keep their configured place at the end);
+    * circuit breakers: a provider that keeps failing is skipped for a while
+      instead of costing every request a timeout (see ProviderHealth);
+    * hedging (settings.LLM_HEDGE): if the first provider hasn't answered
+      after its p95 latency, the next one is asked too and the first answer
+      wins;
+    * a deadline: `timeout` bounds the whole call, not each attempt.
+    """
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self.health = [ProviderHealth(provider) for provider in self.providers]
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def chat(self, messages, timeout=None, **kwargs):
+        started = time.monotonic()
+        try:
+            return self._chat(messages, timeout, kwargs)
+        finally:
+            record_llm_wait(time.monotonic() - started)
+
+    async def async_chat(self, messages, timeout=None, **kwargs):
+        started = time.monotonic()
+        try:
+            return await self._async_chat(messages, timeout, kwargs)
+        finally:
+            record_llm_wait(time.monotonic() - started)
+
+    def _chat(self, messages, timeout, kwargs):
+        deadline = time.monotonic() + (timeout or settings.LLM_TIMEOUT_SECONDS)
+        queue = self._candidates()
+        call = lambda provider: provider.chat(messages=messages, **kwargs)
+        # Attempts run in the pool even without hedging, so the deadline can
+        # cut one short instead of only being checked between attempts
+        return self._in_pool(queue, call, deadline, hedge=settings.LLM_HEDGE)
+
+    async def _async_chat(self, messages, timeout, kwargs):
+        deadline = time.monotonic() + (timeout or settings.LLM_TIMEOUT_SECONDS)
+        queue = self._candidates()
+        pending, errors = {}, []
+        hedge_at = math.inf
+
+        def launch():
+            health = self._take(queue)
+            if health is not None:
+                pending[asyncio.ensure_future(self._async_attempt(health, messages, kwargs))] = health
+            return health
+
+        if (first := launch()) is not None and settings.LLM_HEDGE:
+            hedge_at = time.monotonic() + self._hedge_delay(first)
+        try:
+            while pending:
+                wake_at = min(deadline, hedge_at)
+                done, _ = await asyncio.wait(
+                    pending, timeout=max(0.0, wake_at - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if time.monotonic() >= deadline:
+                        errors.append("deadline exceeded")
+                        break
+                    hedge_at = math.inf
+                    if launch() is not None:
+                        self._count_hedge()
+                    continue
+                for task in done:
+                    health = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{health.name}: {task.exception()}")
+                if not pending:
+                    launch()
+        finally:
+            # The losing hedge (or a request past the deadline) is abandoned
+            for task in pending:
+                task.cancel()
+        raise self._exhausted(errors)
+
+    def chat_stream(self, messages, timeout=None, **kwargs):
+        """
+        Stream from the first provider that answers. Failover only happens
+        before the first chunk: once tokens have been relayed, switching
+        providers would splice two different answers together. Streams feed
+        the breakers and /metrics but not the routing latency stats, and
+        aren't hedged; `timeout` is accepted for FreeFlowClient compatibility
+        and left to the providers.
+        """
+        started = time.monotonic()
+        try:
+            yield from self._chat_stream(messages, kwargs)
+        finally:
+            record_llm_wait(time.monotonic() - started)
+
+    def _chat_stream(self, messages, kwargs):
+        queue, errors = self._candidates(), []
+        while (health := self._take(queue)) is not None:
+            relayed, last, started = False, None, time.monotonic()
+            try:
+                for chunk in health.provider.chat_stream(messages=messages, **kwargs):
+                    relayed, last = True, chunk
+                    yield chunk
+            except GeneratorExit:
+                # The student went away mid-answer; that's not the provider's fault
+                self._release(health)
+                raise
+            except Exception as e:
+                self._failed(health)
+                if relayed:
+                    raise
+                errors.append(f"{health.name}: {e}")
+                continue
+            self._stream_succeeded(health, time.monotonic() - started, last)
+            return
+        raise self._exhausted(errors)
+
+    async def async_chat_stream(self, messages, timeout=None, **kwargs):
+        """Async counterpart of chat_stream(), over the providers' async_chat_stream()."""
+        started = time.monotonic()
+        try:
+            async for chunk in self._async_chat_stream(messages, kwargs):
+                yield chunk
+        finally:
+            record_llm_wait(time.monotonic() - started)
+
+    async def _async_chat_stream(self, messages, kwargs):
+        queue, errors = self._candidates(), []
+        while (health := self._take(queue)) is not None:
+            relayed, last, started = False, None, time.monotonic()
+            try:
+                async for chunk in health.provider.async_chat_stream(messages=messages, **kwargs):
+                    relayed, last = True, chunk
+                    yield chunk
+            except (GeneratorExit, asyncio.CancelledError):
+                # The student went away mid-answer; that's not the provider's fault
+                self._release(health)
+                raise
+            except Exception as e:
+                self._failed(health)
+                if relayed:
+                    raise
+                errors.append(f"{health.name}: {e}")
+                continue
+            self._stream_succeeded(health, time.monotonic() - started, last)
+            return
+        raise self._exhausted(errors)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedges": self.hedges,
+                "providers": {
+                    health.name: {
+                        "state": health.state,
+                        "calls": health.calls,
+                        "failures": health.failures,
+                        "ewma_ms": round(health.ewma * 1000) if health.ewma is not None else None,
+                        "p95_ms": round(health.p95() * 1000) if health.p95() is not None else None,
+                    }
+                    for health in self.health
+                },
+            }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for provider in self.providers:
+            provider.close()
+
+    def _candidates(self):
+        """Providers in the order they should be tried."""
+        with self._lock:
+            if settings.LLM_ROUTING == 'latency':
+                return sorted(self.health, key=lambda h: math.inf if h.ewma is None else h.ewma)
+            return list(self.health)
+
+    def _take(self, queue):
+        """Pop the next provider in `queue` whose breaker lets a request through, or None."""
+        now = time.monotonic()
+        with self._lock:
+            while queue:
+                health = queue.pop(0)
+                if health.acquire(now):
+                    return health
+        return None
+
+    def _release(self, health):
+        # Taken but never asked: give a half-open provider's trial slot back
+        with self._lock:
+            health.trial_in_flight = False
+
+    def _hedge_delay(self, health):
+        p95 = health.p95()
+        low, high = settings.LLM_HEDGE_MIN_DELAY_MS / 1000, settings.LLM_HEDGE_MAX_DELAY_MS / 1000
+        return high if p95 is None else min(max(p95, low), high)
+
+    def _in_pool(self, queue, call, deadline, hedge):
+        pending, errors = {}, []
+        hedge_at = math.inf
+
+        def launch():
+            health = self._take(queue)
+            if health is not None:
+                pending[self._pool().submit(self._attempt, health, call, deadline)] = health
+            return health
+
+        if (first := launch()) is not None and hedge:
+            hedge_at = time.monotonic() + self._hedge_delay(first)
+        while pending:
+            wake_at = min(deadline, hedge_at)
+            done, _ = wait(pending, timeout=max(0.0, wake_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                if time.monotonic() >= deadline:
+                    # Abandoned attempts time out in the pool soon after (their HTTP timeout is
+                    # capped by the deadline), freeing the thread, and feed their provider's stats
+                    errors.append("deadline exceeded")
+                    break
+                hedge_at = math.inf
+                if launch() is not None:
+                    self._count_hedge()
+                continue
+            for future in done:
+                health = pending.pop(future)
+                if future.exception() is None:
+                    # A slower hedge still finishes in the pool and updates its provider's stats
+                    return future.result()
+                errors.append(f"{health.name}: {future.exception()}")
+            if not pending:
+                launch()
+        raise self._exhausted(errors)
+
+    def _attempt(self, health, call, deadline):
+        started = time.monotonic()
+        token = _attempt_deadline.set(deadline)
+        try:
+            result = call(health.provider)
+        except Exception:
+            self._failed(health)
+            raise
+        finally:
+            _attempt_deadline.reset(token)
+        self._succeeded(health, time.monotonic() - started, result)
+        return result
+
+    async def _async_attempt(self, health, messages, kwargs):
+        started = time.monotonic()
+        try:
+            result = await health.provider.async_chat(messages=messages, **kwargs)
+        except asyncio.CancelledError:
+            # A cancelled hedge says nothing about the provider's health
+            self._release(health)
+            raise
+        except Exception:
+            self._failed(health)
+            raise
+        self._succeeded(health, time.monotonic() - started, result)
+        return result
+
+    def _succeeded(self, health, latency, response):
+        with self._lock:
+            health.record_success(latency)
+        metrics.observe_llm(health.name, latency, response.usage.total_tokens if response.usage else 0)
+
+    def _stream_succeeded(self, health, latency, last_chunk):
+        # Whole-stream times aren't comparable with chat() latencies, so they
+        # stay out of the routing stats but still show up in /metrics
+        with self._lock:
+            health.record_success()
+        usage = getattr(last_chunk, 'usage', None)
+        metrics.observe_llm(health.name, latency, usage.total_tokens if usage else 0)
+
+    def _failed(self, health):
+        with self._lock:
+            health.record_failure(time.monotonic())
+        metrics.observe_llm(health.name, 0.0, ok=False)
+
+    def _count_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=settings.LLM_POOL_SIZE * max(1, len(self.providers)),
+                        thread_name_prefix='llm-router',
+                    )
+        return self._executor
+
+    def _exhausted(self, errors):
+        if not errors:
+            errors = ["every provider's circuit breaker is open"]
+        summary = "\n".join(f"  - {error}" for error in errors)
+        return NoProvidersAvailableError(f"All providers exhausted. Attempts:\n{summary}")
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile, Level, Achievement, UserAchievement, XPTransaction, Quiz, UserQuizAttempt
+from .catalog import catalog
+from .models import UserProfile, Level, Achievement, UserAchievement, XPTransaction, Quiz, Question, Option
 
 class LevelSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,6 +24,25 @@ class XPTransactionSerializer(serializers.ModelSerializer):
         model = XPTransaction
         fields = ['amount', 'reason', 'timestamp']
 
+# Quiz content as students see it: no is_correct, so the answers stay on the server (see core/grading.py)
+class OptionContentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Option
+        fields = ['id', 'text']
+
+class QuestionContentSerializer(serializers.ModelSerializer):
+    options = OptionContentSerializer(many=True, read_only=True)
+    class Meta:
+        model = Question
+        fields = ['id', 'text', 'order', 'options']
+
+class QuizContentSerializer(serializers.ModelSerializer):
+    subject = serializers.CharField(source='subject.name')
+    questions = QuestionContentSerializer(many=True, read_only=True)
+    class Meta:
+        model = Quiz
+        fields = ['id', 'title', 'description', 'subject', 'difficulty', 'xp_reward', 'time_limit_seconds', 'questions']
+
 class DashboardStatsSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username')
     full_name = serializers.CharField()
@@ -42,21 +62,23 @@ class DashboardStatsSerializer(serializers.ModelSerializer):
         ]
 
     def get_level(self, obj):
-        if obj.current_level:
-            return LevelSerializer(obj.current_level).data
+        level = catalog.level_by_id(obj.current_level_id)
+        if level:
+            return LevelSerializer(level).data
         return {"number": 1, "title": "Smart Explorer", "xp_threshold": 100}
 
+    # The counters below come from core.dashboard.dashboard_profile()'s annotations
     def get_achievements_count(self, obj):
-        return obj.user.achievements.count()
+        return obj.achievements_count
 
     def get_recent_achievements(self, obj):
-        achs = obj.user.achievements.all().order_by('-unlocked_at')[:4]
+        achs = obj.user.recent_achievements
+        for ua in achs:
+            ua.achievement = catalog.achievement(ua.achievement_id)
         return UserAchievementSerializer(achs, many=True).data
 
     def get_quizzes_remaining(self, obj):
-        total_quizzes = Quiz.objects.count()
-        completed = UserQuizAttempt.objects.filter(user=obj.user).values('quiz').distinct().count()
-        return max(0, total_quizzes - completed)
+        return max(0, obj.quizzes_total - obj.quizzes_taken)
 
     def get_xp_to_next_level(self, obj):
         # 100 XP per level increment
@@ -1,41 +1,74 @@
-from .models import XPTransaction, Level, Achievement, UserAchievement, UserProfile
-from django.db.models import F
+from .models import XPTransaction, Level, UserAchievement, UserProfile, ActivityEvent
+from .catalog import catalog
+from .dashboard import invalidate_dashboard
+from .leaderboard import record_weekly_xp
+from .write_buffer import activity_event_writes, xp_transaction_writes
+from django.db import transaction
+from django.db.models import F, Q
 
-def award_xp(user, amount, reason):
+def award_xp(user, amount, reason, activity=True, quiz_completed=False):
     """
     Centralized function to award XP to a user.
-    Records transaction, updates profile, checks for level up and achievements.
+    Records transaction, updates profile and this week's leaderboard row,
+    checks for level up and achievements. With `activity`, the reward also
+    goes on the student's activity feed (callers that write their own event,
+    like quiz completion, pass False). `quiz_completed` counts a finished quiz
+    in the same profile UPDATE.
+
+    The XP increment is a single `UPDATE ... SET total_xp = total_xp + n` inside
+    one transaction, so concurrent awards (quiz completions, login rewards)
+    never lose each other's XP. The XPTransaction ledger row goes through
+    core.write_buffer, so in 'buffered' mode it lands shortly after commit.
     """
-    profile = user.profile
-    
-    # 1. Record Transaction
-    XPTransaction.objects.create(user=user, amount=amount, reason=reason)
-    
-    # 2. Update Total XP
-    profile.total_xp += amount
-    
-    # 3. Check for Level Up
-    # level = total_xp // 100 as per requirement
-    new_level_number = profile.total_xp // 100
-    if new_level_number == 0: new_level_number = 1
-    
-    current_level_number = profile.current_level.number if profile.current_level else 0
-    
-    if new_level_number > current_level_number:
-        # Update current level and title
-        level_obj, created = Level.objects.get_or_create(
-            number=new_level_number,
-            defaults={
-                'title': get_level_title(new_level_number),
-                'xp_threshold': new_level_number * 100
-            }
-        )
-        profile.current_level = level_obj
-    
-    profile.save()
-    
+    with transaction.atomic():
+        # 1. Record Transaction
+        xp_transaction = XPTransaction(user=user, amount=amount, reason=reason)
+        # Achievements are checked once below; stop the post_save fallback doing it again
+        xp_transaction._achievements_checked = True
+        xp_transaction_writes.add(xp_transaction)
+        if activity:
+            activity_event_writes.add(ActivityEvent(user=user, kind='xp', title=reason, xp=amount))
+
+        # 2. Update Total XP (atomically, in the database)
+        counters = {'total_xp': F('total_xp') + amount}
+        if quiz_completed:
+            counters['quizzes_completed'] = F('quizzes_completed') + 1
+        UserProfile.objects.filter(user=user).update(**counters)
+        record_weekly_xp(user, amount)
+        # The UPDATE holds the row lock until commit, so this read sees a stable total
+        profile = UserProfile.objects.get(user=user)
+        profile.current_level = catalog.level_by_id(profile.current_level_id)
+
+        # 3. Check for Level Up
+        # level = total_xp // 100 as per requirement
+        new_level_number = max(profile.total_xp // 100, 1)
+        current_level_number = profile.current_level.number if profile.current_level else 0
+
+        if new_level_number > current_level_number:
+            # Update current level and title
+            level_obj = catalog.level(new_level_number)
+            if level_obj is None:
+                level_obj, created = Level.objects.get_or_create(
+                    number=new_level_number,
+                    defaults={
+                        'title': get_level_title(new_level_number),
+                        'xp_threshold': new_level_number * 100
+                    }
+                )
+            # Never move a student down if a concurrent award already levelled them further
+            UserProfile.objects.filter(
+                Q(current_level__isnull=True) | Q(current_level__number__lt=new_level_number),
+                pk=profile.pk,
+            ).update(current_level=level_obj)
+            profile.current_level = level_obj
+
+    # Keep the caller's cached user.profile in step with the database
+    user.profile = profile
+    # A buffered ledger row sends no post_save, so expire the dashboard here
+    invalidate_dashboard(user.id)
+
     # 4. Check for Achievement Milestones
-    check_achievements(user)
+    check_achievements(user, profile)
 
 def get_level_title(level_number):
     """ Mapping level numbers to dynamic titles """
@@ -44,20 +77,47 @@ def get_level_title(level_number):
     if level_number <= 10: return "Mind Master"
     return "AI Scholar"
 
-def check_achievements(user):
+def check_achievements(user, profile=None):
     """
-    Check if user has met requirements for any new achievements.
+    Unlock every achievement the user now qualifies for.
+
+    Eligibility is decided against the cached catalog (a zero requirement
+    always passes), earned ones are filtered out in one query, and the
+    unlocks go in with one bulk_create, so the cost is the same however
+    many achievements exist.
     """
-    profile = user.profile
-    
-    # Get achievements not yet earned
-    earned_ids = user.achievements.values_list('achievement_id', flat=True)
-    potential_achievements = Achievement.objects.exclude(id__in=earned_ids)
-    
-    for ach in potential_achievements:
-        meet_xp = (ach.xp_required == 0 or profile.total_xp >= ach.xp_required)
-        meet_streak = (ach.streak_required == 0 or profile.current_streak >= ach.streak_required)
-        meet_quiz = (ach.quiz_count_required == 0 or profile.quizzes_completed >= ach.quiz_count_required)
-        
-        if meet_xp and meet_streak and meet_quiz:
-            UserAchievement.objects.get_or_create(user=user, achievement=ach)
+    if profile is None:
+        profile = UserProfile.objects.only(
+            'total_xp', 'current_streak', 'quizzes_completed'
+        ).get(user=user)
+
+    eligible_ids = {
+        ach.id for ach in catalog.achievements
+        if ach.xp_required <= profile.total_xp
+        and ach.streak_required <= profile.current_streak
+        and ach.quiz_count_required <= profile.quizzes_completed
+    }
+    if not eligible_ids:
+        return
+    eligible_ids -= set(
+        UserAchievement.objects.filter(user=user, achievement_id__in=eligible_ids)
+        .values_list('achievement_id', flat=True)
+    )
+    if eligible_ids:
+        UserAchievement.objects.bulk_create(
+            [UserAchievement(user=user, achievement_id=ach_id) for ach_id in eligible_ids],
+            ignore_conflicts=True,
+        )
+        # Keyed like the unlock itself, so a racing check can't add the event twice
+        ActivityEvent.objects.bulk_create(
+            [
+                ActivityEvent(
+                    user=user, kind='achievement', title=catalog.achievement(ach_id).name,
+                    source_key=f"achievement:{user.id}:{ach_id}",
+                )
+                for ach_id in eligible_ids
+            ],
+            ignore_conflicts=True,
+        )
+        # bulk_create sends no post_save
+        invalidate_dashboard(user.id)
@@ -1,9 +1,17 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in
-from .models import XPTransaction, UserProfile, Level, Achievement, UserAchievement, LoginHistory
-from .services import award_xp, check_achievements
+from .models import XPTransaction, UserProfile, Level, Achievement, UserAchievement, Quiz, Question, Option, UserQuizAttempt, Subject, SubjectProgress
+from .services import check_achievements
+from .catalog import catalog
+from .dashboard import invalidate_dashboard
+from .curriculum import forget_progress, invalidate_curriculum
+from .grading import invalidate_answer_keys
+from .quiz_content import invalidate_quiz_content
+from .tasks import enqueue
+from .ratelimit import forget_plan
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -13,13 +21,13 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(user_logged_in)
 def track_login(sender, request, user, **kwargs):
-    """ Record login activity and award daily login XP """
-    ip = request.META.get('REMOTE_ADDR')
-    ua = request.META.get('HTTP_USER_AGENT')
-    LoginHistory.objects.create(user=user, ip_address=ip, user_agent=ua)
-    
-    # Award daily login XP (+10)
-    award_xp(user, 10, "Daily Login Reward")
+    """ Record login activity and award daily login XP (queued, see core/tasks.py) """
+    ip = request.META.get('REMOTE_ADDR') if request else None
+    ua = request.META.get('HTTP_USER_AGENT') if request else None
+    enqueue(
+        'record_login',
+        user_id=user.pk, ip_address=ip, user_agent=ua, logged_in_at=timezone.now().isoformat(),
+    )
 
 @receiver(post_save, sender=XPTransaction)
 def handle_xp_transaction(sender, instance, created, **kwargs):
@@ -27,6 +35,75 @@ def handle_xp_transaction(sender, instance, created, **kwargs):
     NOTE: XP is now primarily handled in services.award_xp.
     This signal remains as a fallback or for direct model manipulation tracking.
     """
-    if created:
-        # We check achievements again just in case XP was added via direct model creation
+    if created and not getattr(instance, '_achievements_checked', False):
+        # Only for XP added via direct model creation; award_xp checks achievements itself
         check_achievements(instance.user)
+
+@receiver([post_save, post_delete], sender=Level)
+@receiver([post_save, post_delete], sender=Achievement)
+def invalidate_catalog(sender, **kwargs):
+    """ Level/Achievement changed: reload the cached catalog in every process. """
+    catalog.invalidate()
+
+# Profile fields shown on the dashboard; saves touching only others (e.g. questions_asked) keep the cache
+DASHBOARD_PROFILE_FIELDS = {'full_name', 'total_xp', 'current_level', 'current_streak', 'max_streak'}
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_dashboard_on_profile(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or DASHBOARD_PROFILE_FIELDS & set(update_fields):
+        invalidate_dashboard(instance.user_id)
+
+@receiver(post_save, sender=UserProfile)
+def refresh_rate_limit_plan(sender, instance, update_fields=None, **kwargs):
+    """ Plan changes resize the student's /ask/ rate limit straight away. """
+    if update_fields is None or 'plan' in update_fields:
+        forget_plan(instance.user_id)
+
+@receiver(post_save, sender=XPTransaction)
+@receiver(post_save, sender=UserAchievement)
+@receiver([post_save, post_delete], sender=UserQuizAttempt)
+def invalidate_dashboard_on_progress(sender, instance, **kwargs):
+    """ XP, achievement or quiz activity changes the student's dashboard numbers. """
+    invalidate_dashboard(instance.user_id)
+
+@receiver([post_save, post_delete], sender=Quiz)
+def invalidate_dashboards_on_quiz(sender, **kwargs):
+    """ A new or removed quiz changes everyone's quizzes_remaining. """
+    invalidate_dashboard()
+
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_curriculum_on_subject(sender, **kwargs):
+    """ A subject's curriculum (or its existence) changed: rebuild the cached day lists. """
+    invalidate_curriculum()
+
+@receiver([post_save, post_delete], sender=SubjectProgress)
+def forget_progress_on_change(sender, instance, **kwargs):
+    forget_progress(instance.user_id, instance.subject_id)
+
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=Quiz)
+@receiver([post_save, post_delete], sender=Question)
+@receiver([post_save, post_delete], sender=Option)
+def invalidate_answer_keys_on_change(sender, **kwargs):
+    """ Questions, options or a quiz's reward/subject changed: regrade from a fresh answer key. """
+    invalidate_answer_keys()
+
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_quiz_content_on_subject(sender, **kwargs):
+    """ Quiz payloads carry their subject's name. """
+    invalidate_quiz_content()
+
+@receiver([post_save, post_delete], sender=Quiz)
+def invalidate_quiz_content_on_quiz(sender, instance, **kwargs):
+    invalidate_quiz_content(instance.id)
+
+@receiver([post_save, post_delete], sender=Question)
+def invalidate_quiz_content_on_question(sender, instance, **kwargs):
+    invalidate_quiz_content(instance.quiz_id)
+
+@receiver([post_save, post_delete], sender=Option)
+def invalidate_quiz_content_on_option(sender, instance, **kwargs):
+    # The question may already be gone when its whole quiz is deleted; the quiz's own signal covers that
+    quiz_id = Question.objects.filter(pk=instance.question_id).values_list('quiz_id', flat=True).first()
+    if quiz_id is not None:
+        invalidate_quiz_content(quiz_id)
@@ -0,0 +1,267 @@
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+STAT_NAMES = ('leaders', 'coalesced', 'remote_coalesced')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class _Abandoned(Exception):
+    """A streaming leader's caller went away before the result was complete."""
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one: the first caller for a key
+    (the leader) runs the function, everyone else arriving before it returns
+    waits and gets the same result, or the same exception.
+
+    Within a process this is a dict of in-flight calls. With
+    settings.SINGLEFLIGHT_DISTRIBUTED, leaders also take a short lock in the
+    default cache; a leader in another process that finds the lock taken
+    waits for the owner's result instead of repeating the call, and falls
+    back to calling itself if the owner gives up or fails.
+    """
+    POLL_SECONDS = 0.05
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key, fn):
+        """Run fn() once per concurrent `key`; returns (result, shared)."""
+        call, leader = self._wait_or_lead(key)
+        if not leader:
+            self._incr('coalesced')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_distributed(key, fn)
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+
+    def do_stream(self, key, stream_fn):
+        """
+        Streaming counterpart of do(), within this process: the leader relays
+        the string chunks of stream_fn() as they arrive, and callers arriving
+        before it finishes (here or in do()) get the joined text as one chunk.
+        If the leader's caller stops reading early, its followers start over.
+        """
+        call, leader = self._wait_or_lead(key)
+        if not leader:
+            self._incr('coalesced')
+            if call.error is not None:
+                raise call.error
+            yield call.result
+            return
+
+        self._incr('leaders')
+        parts = []
+        try:
+            for chunk in stream_fn():
+                parts.append(chunk)
+                yield chunk
+            call.result = ''.join(parts)
+        except GeneratorExit:
+            call.abandoned = True
+            raise
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+
+    async def ado(self, key, coro_fn):
+        """Async counterpart of do(): awaits coro_fn() once per concurrent `key`."""
+        future, leader = await self._await_or_lead(key)
+        if not leader:
+            self._incr('coalesced')
+            return future.result(), True
+
+        try:
+            result, shared = await self._arun_distributed(key, coro_fn)
+            future.set_result(result)
+            return result, shared
+        except asyncio.CancelledError:
+            # The leader's request went away; its followers start over
+            self._fail(future, _Abandoned())
+            raise
+        except Exception as e:
+            self._fail(future, e)
+            raise
+        finally:
+            self._async_calls.pop((asyncio.get_running_loop(), key), None)
+
+    async def ado_stream(self, key, stream_fn):
+        """Async counterpart of do_stream(), over an async iterator of string chunks."""
+        future, leader = await self._await_or_lead(key)
+        if not leader:
+            self._incr('coalesced')
+            yield future.result()
+            return
+
+        self._incr('leaders')
+        parts = []
+        try:
+            async for chunk in stream_fn():
+                parts.append(chunk)
+                yield chunk
+            future.set_result(''.join(parts))
+        except (GeneratorExit, asyncio.CancelledError):
+            self._fail(future, _Abandoned())
+            raise
+        except Exception as e:
+            self._fail(future, e)
+            raise
+        finally:
+            self._async_calls.pop((asyncio.get_running_loop(), key), None)
+
+    def stats(self):
+        values = cache.get_many([self._stat_key(name) for name in STAT_NAMES])
+        return {name: values.get(self._stat_key(name), 0) for name in STAT_NAMES}
+
+    def _run_distributed(self, key, fn):
+        if not settings.SINGLEFLIGHT_DISTRIBUTED:
+            self._incr('leaders')
+            return fn(), False
+
+        lock_key, result_key = self._cache_keys(key)
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_LOCK_SECONDS
+        while not cache.add(lock_key, 1, settings.SINGLEFLIGHT_LOCK_SECONDS):
+            # Another process is already asking; wait for its result
+            result = cache.get(result_key)
+            if result is not None:
+                self._incr('remote_coalesced')
+                return result, True
+            if time.monotonic() > deadline:
+                break
+            time.sleep(self.POLL_SECONDS)
+        else:
+            # The owner may have published and released between our polls
+            result = cache.get(result_key)
+            if result is not None:
+                cache.delete(lock_key)
+                self._incr('remote_coalesced')
+                return result, True
+            return self._lead(lock_key, result_key, fn), False
+
+        # The owner is taking too long; ask ourselves rather than wait forever
+        self._incr('leaders')
+        return fn(), False
+
+    async def _arun_distributed(self, key, coro_fn):
+        if not settings.SINGLEFLIGHT_DISTRIBUTED:
+            self._incr('leaders')
+            return await coro_fn(), False
+
+        lock_key, result_key = self._cache_keys(key)
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_LOCK_SECONDS
+        while not await cache.aadd(lock_key, 1, settings.SINGLEFLIGHT_LOCK_SECONDS):
+            result = await cache.aget(result_key)
+            if result is not None:
+                self._incr('remote_coalesced')
+                return result, True
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(self.POLL_SECONDS)
+        else:
+            result = await cache.aget(result_key)
+            if result is not None:
+                await cache.adelete(lock_key)
+                self._incr('remote_coalesced')
+                return result, True
+            self._incr('leaders')
+            try:
+                result = await coro_fn()
+                await cache.aset(result_key, result, settings.SINGLEFLIGHT_RESULT_SECONDS)
+                return result, False
+            finally:
+                await cache.adelete(lock_key)
+
+        self._incr('leaders')
+        return await coro_fn(), False
+
+    def _lead(self, lock_key, result_key, fn):
+        self._incr('leaders')
+        try:
+            result = fn()
+            cache.set(result_key, result, settings.SINGLEFLIGHT_RESULT_SECONDS)
+            return result
+        finally:
+            # Released on failure too, so waiting processes stop polling and ask themselves
+            cache.delete(lock_key)
+
+    def _wait_or_lead(self, key):
+        """(call, True) when the caller leads `key`, else (finished call, False)."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    return call, True
+            call.done.wait()
+            if not call.abandoned:
+                return call, False
+
+    def _finish(self, key, call):
+        with self._lock:
+            self._calls.pop(key, None)
+        call.done.set()
+
+    async def _await_or_lead(self, key):
+        """Async _wait_or_lead() over this event loop's in-flight futures."""
+        loop = asyncio.get_running_loop()
+        while True:
+            future = self._async_calls.get((loop, key))
+            if future is None:
+                future = self._async_calls[(loop, key)] = loop.create_future()
+                return future, True
+            try:
+                await asyncio.shield(future)
+            except _Abandoned:
+                continue
+            except Exception:
+                pass
+            return future, False
+
+    @staticmethod
+    def _fail(future, error):
+        future.set_exception(error)
+        # Nobody may be waiting on it; don't warn about an unretrieved exception
+        future.exception()
+
+    def _cache_keys(self, key):
+        return f"singleflight:{self.name}:lock:{key}", f"singleflight:{self.name}:result:{key}"
+
+    def _stat_key(self, name):
+        return f"singleflight:{self.name}:stats:{name}"
+
+    def _incr(self, name):
+        key = self._stat_key(name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr(); losing one sample is fine
+            pass
+
+
+llm_flights = SingleFlight('llm')
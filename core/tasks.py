@@ -0,0 +1,117 @@
+import logging
+import random
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ActivityEvent, BackgroundTask, LoginHistory
+from .services import award_xp
+from .write_buffer import activity_event_writes, login_history_writes
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(func):
+    """Register `func` as a background task under its function name."""
+    _registry[func.__name__] = func
+    return func
+
+def enqueue(name, key=None, **kwargs):
+    """
+    Run task `name` with JSON-serialisable `kwargs` off the request path.
+
+    The row is written in the caller's transaction, so the task only becomes
+    visible to `run_tasks` if the request's own writes commit. A task with an
+    `idempotency_key` already in the queue is not enqueued again. With
+    settings.TASKS_EAGER (the default, and what the tests use) the task
+    simply runs now, in-line, and exceptions propagate.
+    """
+    if name not in _registry:
+        raise KeyError(f"Unknown task: {name}")
+    if settings.TASKS_EAGER:
+        _registry[name](**kwargs)
+        return
+    BackgroundTask.objects.bulk_create(
+        [BackgroundTask(name=name, payload=kwargs, idempotency_key=key, max_attempts=settings.TASK_MAX_ATTEMPTS)],
+        ignore_conflicts=True,
+    )
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter: ~base, 2*base, 4*base ... capped at TASK_RETRY_MAX_SECONDS."""
+    delay = min(settings.TASK_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.TASK_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def run_pending(limit=100):
+    """
+    Claim and run up to `limit` due tasks; returns how many were run.
+
+    A task is claimed with a conditional UPDATE that moves it to RUNNING and
+    pushes `run_after` out by TASK_LEASE_SECONDS, so concurrent workers never
+    run the same task and one whose worker died is picked up again once the
+    lease expires. The handler and the DONE mark commit together.
+    """
+    now = timezone.now()
+    due_ids = list(
+        BackgroundTask.objects.filter(status__in=['PENDING', 'RUNNING'], run_after__lte=now)
+        .order_by('run_after').values_list('id', flat=True)[:limit]
+    )
+    ran = 0
+    for task_id in due_ids:
+        claimed = BackgroundTask.objects.filter(
+            id=task_id, status__in=['PENDING', 'RUNNING'], run_after__lte=now
+        ).update(
+            status='RUNNING',
+            attempts=F('attempts') + 1,
+            run_after=now + timedelta(seconds=settings.TASK_LEASE_SECONDS),
+        )
+        if claimed:
+            _run(BackgroundTask.objects.get(id=task_id))
+            ran += 1
+    return ran
+
+def _run(task_row):
+    handler = _registry.get(task_row.name)
+    try:
+        if handler is None:
+            raise KeyError(f"Unknown task: {task_row.name}")
+        with transaction.atomic():
+            handler(**task_row.payload)
+            BackgroundTask.objects.filter(id=task_row.id).update(status='DONE', last_error='')
+    except Exception as e:
+        failed = task_row.attempts >= task_row.max_attempts
+        BackgroundTask.objects.filter(id=task_row.id).update(
+            status='FAILED' if failed else 'PENDING',
+            run_after=timezone.now() + retry_delay(task_row.attempts),
+            last_error=f"{type(e).__name__}: {e}",
+        )
+        logger.exception("Task %s #%s failed (attempt %s/%s)",
+                         task_row.name, task_row.id, task_row.attempts, task_row.max_attempts)
+
+def purge_finished(older_than):
+    """Delete DONE tasks finished before `older_than`; their idempotency keys expire with them."""
+    deleted, _ = BackgroundTask.objects.filter(status='DONE', created_at__lt=older_than).delete()
+    return deleted
+
+
+# ─── Tasks ───────────────────────────────────────────────────────────────────
+
+@task
+def record_login(user_id, ip_address, user_agent, logged_in_at):
+    """ Login bookkeeping moved off the login request: history row and daily login XP. """
+    # Timestamped with the login itself, not with the (queued/buffered) write
+    logged_in_at = datetime.fromisoformat(logged_in_at)
+    login_history_writes.add(LoginHistory(
+        user_id=user_id, ip_address=ip_address, user_agent=user_agent, timestamp=logged_in_at,
+    ))
+    activity_event_writes.add(ActivityEvent(
+        user_id=user_id, kind='login', title="Logged in", detail=ip_address or '', created_at=logged_in_at,
+    ))
+
+    # Award daily login XP (+10)
+    award_xp(User.objects.get(pk=user_id), 10, "Daily Login Reward")
@@ -1,3 +1,2280 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import runpy
+import signal
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, transaction
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+
+from . import views
+from freeflow_llm import FreeFlowResponse, GroqProvider
+from freeflow_llm.models import Choice, Message
+from freeflow_llm.exceptions import NoProvidersAvailableError, ProviderError, RateLimitError
+
+from .answer_cache import answer_cache
+from .catalog import catalog
+from .context import build_tutor_messages, estimate_tokens
+from .leaderboard import leaderboards, rank_week, record_weekly_xp, week_start
+from .llm import LLMClientRegistry
+from .services import award_xp, check_achievements
+from .grading import answer_key, grade
+from .quiz_content import quiz_builds, quiz_content
+from .tasks import enqueue, run_pending, task
+from .write_buffer import WriteBuffer, flush_all
+from .sessions import SessionStore, revoke_user_sessions
+from .ratelimit import LocMemTokenBucket, get_rate_limiter
+from .singleflight import SingleFlight, llm_flights
+from .router import ProviderRouter
+from .metrics import metrics
+from .models import (
+    Achievement, ActivityEvent, BackgroundTask, Conversation, ConversationSummary, Level, LoginHistory, Option, Question, Quiz,
+    Subject, SubjectProgress, UserAchievement, UserAnswer, UserProfile, UserQuizAttempt, UserSession, WeeklyLeaderboard,
+    XPTransaction,
+)
+
+logger = logging.getLogger(__name__)
+
+# Timed benchmarks (production-sized fixtures, wall-clock thresholds) only run
+# when asked for: RUN_BENCHMARKS=1 python manage.py test core
+benchmark = skipUnless(os.environ.get('RUN_BENCHMARKS') == '1', "timed benchmark; set RUN_BENCHMARKS=1 to run it")
+
+# URLconf with the ASGI views mounted, as core/urls.py does when ASYNC_VIEWS is on
+urlpatterns = [
+    path('ask/', views.ask_ai_async_view),
+    path('ask/stream/', views.ask_ai_stream_async_view),
+    path('history/', views.chat_history_async_view),
+    path('dashboard/stats/', views.dashboard_stats_async_view),
+    path('', include('core.urls')),
+]
+
+
+class FreshProcessStateMixin:
+    """
+    Reset per-process state after every test. Rolled-back rows send no
+    signals, so the default cache (catalog/dashboard versions, cached plans)
+    and the cached gamification catalog are dropped, and the rate limiter's
+    buckets emptied.
+    """
+    def tearDown(self):
+        cache.clear()
+        catalog.invalidate()
+        get_rate_limiter().clear()
+        super().tearDown()
+
+
+def parse_sse(body):
+    """Split an SSE body into a list of (event, payload) tuples."""
+    events = []
+    for frame in body.strip().split('\n\n'):
+        event, data = 'message', ''
+        for line in frame.split('\n'):
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data += line[5:].strip()
+        events.append((event, json.loads(data)))
+    return events
+
+
+class FakeFreeFlowClient:
+    """
+    Local stand-in for FreeFlowClient.
+    Replays `chunks` as the answer, sleeping `delay` seconds before each one.
+    """
+    def __init__(self, chunks=None, delay=0.0, provider='fake'):
+        self.chunks = list(chunks) if chunks is not None else ["Hello ", "from ", "Mentora! ✨"]
+        self.delay = delay
+        self.provider = provider
+        self.calls = 0
+
+    def chat(self, messages, **kwargs):
+        self.calls += 1
+        for _ in self.chunks:
+            time.sleep(self.delay)
+        return FreeFlowResponse(
+            id=f"fake-{self.calls}",
+            choices=[Choice(index=0, message=Message(role='assistant', content=''.join(self.chunks)))],
+            provider=self.provider,
+        )
+
+    async def async_chat(self, messages, **kwargs):
+        self.calls += 1
+        for _ in self.chunks:
+            await asyncio.sleep(self.delay)
+        return FreeFlowResponse(
+            id=f"fake-{self.calls}",
+            choices=[Choice(index=0, message=Message(role='assistant', content=''.join(self.chunks)))],
+            provider=self.provider,
+        )
+
+    def chat_stream(self, messages, **kwargs):
+        self.calls += 1
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield FreeFlowResponse(
+                id=f"fake-{self.calls}",
+                object='chat.completion.chunk',
+                choices=[Choice(index=0, delta={'content': chunk})],
+                provider=self.provider,
+            )
+
+    async def async_chat_stream(self, messages, **kwargs):
+        self.calls += 1
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield FreeFlowResponse(
+                id=f"fake-{self.calls}",
+                object='chat.completion.chunk',
+                choices=[Choice(index=0, delta={'content': chunk})],
+                provider=self.provider,
+            )
+
+    def close(self):
+        pass
+
+
+class FakeProvider:
+    """
+    Local stand-in for one FreeFlow provider, for exercising ProviderRouter:
+    answers `answer` after `delay` seconds, or raises `error` (an exception,
+    or a list of exceptions/None consumed one per call).
+    """
+    def __init__(self, name, answer="Hello from Mentora! ✨", delay=0.0, error=None):
+        self.name = name
+        self.answer = answer
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def chat(self, messages, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        self._maybe_fail()
+        return self._response()
+
+    async def async_chat(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        self._maybe_fail()
+        return self._response()
+
+    def chat_stream(self, messages, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        self._maybe_fail()
+        for word in self.answer.split(' '):
+            yield self._chunk(word)
+
+    async def async_chat_stream(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        self._maybe_fail()
+        for word in self.answer.split(' '):
+            yield self._chunk(word)
+
+    def close(self):
+        pass
+
+    def _maybe_fail(self):
+        error = self.error.pop(0) if isinstance(self.error, list) and self.error else self.error
+        if isinstance(error, Exception):
+            raise error
+
+    def _chunk(self, word):
+        return FreeFlowResponse(
+            id=f"{self.name}-{self.calls}",
+            object='chat.completion.chunk',
+            choices=[Choice(index=0, delta={'content': word + ' '})],
+            provider=self.name,
+        )
+
+    def _response(self):
+        return FreeFlowResponse(
+            id=f"{self.name}-{self.calls}",
+            choices=[Choice(index=0, message=Message(role='assistant', content=self.answer))],
+            provider=self.name,
+        )
+
+
+class AskAIStreamTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        answer_cache.clear()
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+
+    def ask(self, fake, question="What is a black hole?"):
+        with mock.patch('core.views.get_freeflow_client', return_value=fake):
+            return self.client.post(
+                '/ask/stream/',
+                data=json.dumps({"question": question, "topic": "Astronomy"}),
+                content_type='application/json'
+            )
+
+    def test_streams_tokens_then_persists_conversation(self):
+        fake = FakeFreeFlowClient(chunks=["Black ", "holes ", "are dense! 🌌"])
+        response = self.ask(fake)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(Conversation.objects.exists())
+
+        events = parse_sse(b''.join(response.streaming_content).decode())
+        tokens = [p['token'] for e, p in events if e == 'token']
+        self.assertEqual(tokens, ["Black ", "holes ", "are dense! 🌌"])
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(events[-1][1]['answer'], "Black holes are dense! 🌌")
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.answer, "Black holes are dense! 🌌")
+        self.assertEqual(events[-1][1]['id'], conversation.id)
+
+    def test_first_token_arrives_before_full_answer(self):
+        fake = FakeFreeFlowClient(chunks=["a", "b", "c", "d", "e"], delay=0.05)
+        response = self.ask(fake)
+        stream = iter(response.streaming_content)
+
+        start = time.monotonic()
+        next(stream)
+        first_byte = time.monotonic() - start
+        for _ in stream:
+            pass
+        total = time.monotonic() - start
+
+        self.assertLess(first_byte, total / 2)
+
+    def test_identical_questions_share_one_stream(self):
+        fake = FakeFreeFlowClient(chunks=["Black ", "holes ", "are dense!"], delay=0.05)
+        leader = iter(self.ask(fake).streaming_content)
+        follower = iter(self.ask(fake).streaming_content)
+
+        leader_body = next(leader)
+        follower_body = []
+        # The follower blocks until the leader's stream is done
+        waiting = threading.Thread(target=lambda: follower_body.append(next(follower)))
+        waiting.start()
+        leader_body += b''.join(leader)
+        waiting.join(timeout=2)
+        follower_body.append(b''.join(follower))
+
+        self.assertEqual(fake.calls, 1)
+        leader_events = parse_sse(leader_body.decode())
+        follower_events = parse_sse(b''.join(follower_body).decode())
+        self.assertEqual([p['token'] for e, p in leader_events if e == 'token'], ["Black ", "holes ", "are dense!"])
+        self.assertEqual([p['token'] for e, p in follower_events if e == 'token'], ["Black holes are dense!"])
+        self.assertEqual(follower_events[-1][1]['answer'], "Black holes are dense!")
+        self.assertEqual(Conversation.objects.count(), 2)
+
+    def test_upstream_failure_emits_error_event_and_saves_nothing(self):
+        class BrokenClient(FakeFreeFlowClient):
+            def chat_stream(self, messages, **kwargs):
+                yield from super().chat_stream(messages, **kwargs)
+                raise RuntimeError("provider down")
+
+        response = self.ask(BrokenClient(chunks=["partial"]))
+        events = parse_sse(b''.join(response.streaming_content).decode())
+        self.assertEqual(events[-1], ('error', {"error": "provider down"}))
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_limit_reached_returns_json_not_stream(self):
+        self.user.profile.questions_asked = 100
+        self.user.profile.save()
+        response = self.ask(FakeFreeFlowClient())
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(response.json()['limit_reached'])
+
+
+@override_settings(
+    ROOT_URLCONF='core.tests',
+    MIDDLEWARE=[m for m in settings.MIDDLEWARE if 'whitenoise' not in m],
+)
+class AsyncViewTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        answer_cache.clear()
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+
+    async def ask(self, question="What is a black hole?", topic="Astronomy"):
+        return await self.async_client.post(
+            '/ask/',
+            data=json.dumps({"question": question, "topic": topic}),
+            content_type='application/json'
+        )
+
+    def test_wsgi_refuses_to_start_with_async_views(self):
+        with override_settings(ASYNC_VIEWS=True), self.assertRaises(ImproperlyConfigured):
+            runpy.run_path(os.path.join(settings.BASE_DIR, 'ai_teacher_backend', 'wsgi.py'))
+
+    async def test_ask_saves_conversation_and_counts_question(self):
+        await self.async_client.aforce_login(self.user)
+        with mock.patch('core.views.get_freeflow_client', return_value=FakeFreeFlowClient(chunks=["Hi ", "there"])):
+            response = await self.ask()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"answer": "Hi there", "cached": False})
+        self.assertEqual(await Conversation.objects.filter(user=self.user).acount(), 1)
+        profile = await UserProfile.objects.aget(user=self.user)
+        self.assertEqual(profile.questions_asked, 1)
+
+    async def test_stream_relays_tokens_and_saves_conversation(self):
+        await self.async_client.aforce_login(self.user)
+        fake = FakeFreeFlowClient(chunks=["Black ", "holes ", "bend light."])
+        with mock.patch('core.views.get_freeflow_client', return_value=fake):
+            response = await self.async_client.post(
+                '/ask/stream/',
+                data=json.dumps({"question": "What is a black hole?", "topic": "Astronomy"}),
+                content_type='application/json'
+            )
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        events = parse_sse(body)
+        self.assertEqual([e for e, _ in events], ['token', 'token', 'token', 'done'])
+        self.assertEqual(events[-1][1]["answer"], "Black holes bend light.")
+        self.assertEqual(await Conversation.objects.filter(user=self.user).acount(), 1)
+
+    async def test_identical_streamed_questions_share_one_llm_stream(self):
+        await self.async_client.aforce_login(self.user)
+        await UserProfile.objects.filter(user=self.user).aupdate(plan='ULTRA')
+        fake = FakeFreeFlowClient(chunks=["Black ", "holes ", "bend light."], delay=0.05)
+
+        async def ask_and_read():
+            response = await self.async_client.post(
+                '/ask/stream/',
+                data=json.dumps({"question": "What is a black hole?", "topic": "Astronomy"}),
+                content_type='application/json'
+            )
+            return parse_sse(b''.join([chunk async for chunk in response.streaming_content]).decode())
+
+        with mock.patch('core.views.get_freeflow_client', return_value=fake):
+            streams = await asyncio.gather(*(ask_and_read() for _ in range(3)))
+
+        self.assertEqual(fake.calls, 1)
+        token_counts = sorted(len([e for e, _ in events if e == 'token']) for events in streams)
+        self.assertEqual(token_counts, [1, 1, 3])
+        self.assertEqual({events[-1][1]["answer"] for events in streams}, {"Black holes bend light."})
+
+    async def test_guest_limit(self):
+        with mock.patch('core.views.get_freeflow_client', return_value=FakeFreeFlowClient()):
+            codes = [(await self.ask()).status_code for _ in range(4)]
+        self.assertEqual(codes, [200, 200, 200, 403])
+
+    async def test_concurrent_questions_overlap_llm_waits(self):
+        await self.async_client.aforce_login(self.user)
+        # Ten questions at once is past the free plan's burst
+        await UserProfile.objects.filter(user=self.user).aupdate(plan='ULTRA')
+        fake = FakeFreeFlowClient(chunks=["slow"], delay=0.2)
+        with mock.patch('core.views.get_freeflow_client', return_value=fake):
+            start = time.monotonic()
+            responses = await asyncio.gather(*(self.ask(question=f"Q{i}") for i in range(10)))
+            elapsed = time.monotonic() - start
+
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        # Ten 0.2s LLM calls served serially would take 2s
+        self.assertLess(elapsed, 1.0)
+
+    async def test_identical_questions_make_one_llm_call(self):
+        await self.async_client.aforce_login(self.user)
+        await UserProfile.objects.filter(user=self.user).aupdate(plan='ULTRA')
+        fake = FakeFreeFlowClient(chunks=["Stars fuse hydrogen. ⭐"], delay=0.3)
+        with mock.patch('core.views.get_freeflow_client', return_value=fake):
+            responses = await asyncio.gather(*(self.ask(question="What is a star?") for _ in range(8)))
+
+        self.assertEqual([r.status_code for r in responses], [200] * 8)
+        self.assertEqual({r.json()["answer"] for r in responses}, {"Stars fuse hydrogen. ⭐"})
+        # One slow upstream call served the whole class
+        self.assertEqual(fake.calls, 1)
+        stats = await sync_to_async(llm_flights.stats)()
+        self.assertEqual((stats["leaders"], stats["coalesced"]), (1, 7))
+
+    async def test_history_and_dashboard(self):
+        await Conversation.objects.acreate(user=self.user, topic="Astronomy", question="Q", answer="A")
+        await self.async_client.aforce_login(self.user)
+
+        history = (await self.async_client.get('/history/?topic=Astronomy')).json()["history"]
+        self.assertEqual([h["answer"] for h in history], ["A"])
+
+        stats = (await self.async_client.get('/dashboard/stats/')).json()
+        self.assertEqual(stats["username"], self.user.username)
+        self.assertEqual(stats["current_streak"], 1)
+
+
+class _CompletionHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-style /chat/completions endpoint that keeps connections alive."""
+    protocol_version = 'HTTP/1.1'
+    # Seconds to stall before answering, consumed one per request
+    delays = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        body = json.dumps({
+            "id": "local",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "pong"}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LLMClientRegistryTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _CompletionHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+        class LocalProvider(GroqProvider):
+            def get_api_base_url(self):
+                return base_url
+
+        self.registry = LLMClientRegistry()
+        self.registry.build(providers=[LocalProvider(api_key='test')])
+
+    def tearDown(self):
+        self.registry.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_sequential_requests_reuse_one_connection(self):
+        client = self.registry.get()
+        for _ in range(20):
+            self.assertEqual(client.chat(messages=[{"role": "user", "content": "ping"}]).content, "pong")
+
+        self.assertIs(self.registry.get(), client)
+        self.assertEqual(self.registry.stats()["handshakes"], 1)
+        self.assertEqual(self.registry.stats()["idle"], 1)
+        self.assertEqual(self.registry.stats()["in_use"], 0)
+
+    @override_settings(LLM_POOL_SIZE=4)
+    def test_concurrent_requests_stay_within_pool_size(self):
+        self.registry.build(providers=self.registry.get().providers)
+        client = self.registry.get()
+
+        async def ask_all():
+            # One event loop, so connections are handed over without thread races
+            return await asyncio.gather(*(
+                client.async_chat(messages=[{"role": "user", "content": "ping"}]) for _ in range(16)
+            ))
+
+        responses = asyncio.run(ask_all())
+        self.assertEqual({response.content for response in responses}, {"pong"})
+        stats = self.registry.stats()
+        self.assertGreaterEqual(stats["handshakes"], 1)
+        self.assertLessEqual(stats["handshakes"], 4)
+        self.assertLessEqual(stats["idle"] + stats["in_use"], 4)
+
+    @override_settings(LLM_POOL_SIZE=1)
+    def test_attempt_past_the_deadline_frees_its_pool_thread(self):
+        self.registry.build(providers=self.registry.get().providers)
+        client = self.registry.get()
+        _CompletionHandler.delays.append(3)
+        self.addCleanup(_CompletionHandler.delays.clear)
+
+        with self.assertRaises(NoProvidersAvailableError):
+            client.chat(messages=[{"role": "user", "content": "ping"}], timeout=0.3)
+        # The router's pool has one thread: this only runs once the abandoned attempt gave it up
+        self.assertEqual(client.chat(messages=[{"role": "user", "content": "ping"}], timeout=1.5).content, "pong")
+
+    def test_async_requests_reuse_one_pooled_connection(self):
+        client = self.registry.get()
+
+        async def ask_twenty():
+            for _ in range(20):
+                self.assertEqual((await client.async_chat(messages=[{"role": "user", "content": "ping"}])).content, "pong")
+
+        asyncio.run(ask_twenty())
+        self.assertEqual(self.registry.stats()["handshakes"], 1)
+        self.assertEqual(self.registry.stats()["idle"], 1)
+
+
+class AnswerCacheTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        answer_cache.clear()
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        self.fake = FakeFreeFlowClient(chunks=["Black holes pull light in. 🌌"])
+
+    def ask(self, question, topic="Astronomy"):
+        with mock.patch('core.views.get_freeflow_client', return_value=self.fake):
+            return self.client.post(
+                '/ask/',
+                data=json.dumps({"question": question, "topic": topic}),
+                content_type='application/json'
+            ).json()
+
+    def test_repeat_question_skips_llm(self):
+        first = self.ask("What is a black hole?")
+        # Fresh history would change the fingerprint, so ask as a second student
+        other = User.objects.create_user(username='other@example.com', password='pass12345')
+        self.client.force_login(other)
+        second = self.ask("  what is a BLACK hole ")
+
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["answer"], first["answer"])
+        self.assertEqual(self.fake.calls, 1)
+        self.assertEqual(Conversation.objects.filter(user=other).count(), 1)
+
+        stats = answer_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_key_includes_topic_skill_level_and_history(self):
+        self.ask("What is a star?")
+        self.assertFalse(self.ask("What is a star?")["cached"])  # own history changed the fingerprint
+        self.ask("What is a star?", topic="Science")
+
+        other = User.objects.create_user(username='other@example.com', password='pass12345')
+        other.profile.skill_level = 'ADVANCED'
+        other.profile.save()
+        self.client.force_login(other)
+        self.assertFalse(self.ask("What is a star?")["cached"])
+        self.assertEqual(self.fake.calls, 4)
+
+    @override_settings(ANSWER_CACHE_EMBEDDER='core.answer_cache.ngram_embedding')
+    def test_similarity_tier_matches_rephrased_question(self):
+        self.ask("What is a black hole?")
+        other = User.objects.create_user(username='other@example.com', password='pass12345')
+        self.client.force_login(other)
+
+        self.assertTrue(self.ask("what's a black hole")["cached"])
+        self.assertFalse(self.ask("How far away is the moon?")["cached"])
+        self.assertEqual(answer_cache.stats()["similar_hits"], 1)
+        self.assertEqual(self.fake.calls, 2)
+
+
+@override_settings(TUTOR_CONTEXT_TOKENS=300, TUTOR_SUMMARY_TOKENS=60)
+class ContextBuilderTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+
+    def add_turns(self, count, answer_words=40):
+        Conversation.objects.bulk_create([
+            Conversation(user=self.user, topic="Astronomy", question=f"Question number {i}?",
+                         answer=" ".join(["stars"] * answer_words))
+            for i in range(count)
+        ])
+
+    def prompt_tokens(self, messages):
+        return sum(estimate_tokens(m["content"]) for m in messages)
+
+    def test_prompt_stays_bounded_as_history_grows(self):
+        self.add_turns(5)
+        small = self.prompt_tokens(build_tutor_messages(self.user, "Astronomy", "Next?"))
+        self.add_turns(300)
+        large = self.prompt_tokens(build_tutor_messages(self.user, "Astronomy", "Next?"))
+
+        self.assertLess(large, 300 + 60 + 100)
+        self.assertLess(large - small, 100)
+
+    def test_dropped_turns_are_folded_into_summary(self):
+        self.add_turns(12)
+        messages = build_tutor_messages(self.user, "Astronomy", "Next?")
+
+        summary = ConversationSummary.objects.get(user=self.user, topic="Astronomy")
+        self.assertIn("Question number", summary.summary)
+        self.assertLessEqual(estimate_tokens(summary.summary), 60)
+        self.assertEqual(messages[1]["role"], "system")
+        self.assertIn(summary.summary, messages[1]["content"])
+        self.assertEqual(messages[-1], {"role": "user", "content": "Next?"})
+        # Recent turns are replayed oldest first
+        self.assertEqual(messages[-3]["content"], "Question number 11?")
+
+    def test_turns_beyond_the_window_are_folded_even_when_they_fit(self):
+        self.add_turns(14, answer_words=1)
+        messages = build_tutor_messages(self.user, "Astronomy", "Next?")
+
+        summary = ConversationSummary.objects.get(user=self.user, topic="Astronomy")
+        self.assertIn("Question number 3?", summary.summary)
+        self.assertNotIn("Question number 4?", summary.summary)
+        self.assertEqual(messages[2]["content"], "Question number 4?")
+        self.assertEqual(len(messages), 1 + 1 + 2 * 10 + 1)
+
+        # Each new turn pushes the oldest one of the window into the summary
+        self.add_turns(1, answer_words=1)
+        build_tutor_messages(self.user, "Astronomy", "Next?")
+        summary.refresh_from_db()
+        self.assertIn("Question number 3?; Question number 4?", summary.summary)
+
+    def test_concurrent_first_folds_share_one_summary(self):
+        self.add_turns(14, answer_words=1)
+        build_tutor_messages(self.user, "Astronomy", "Next?")
+
+        # A second request that looked before the first one stored the summary
+        with mock.patch.object(ConversationSummary.objects, 'filter') as lookup:
+            lookup.return_value.only.return_value.first.return_value = None
+            build_tutor_messages(self.user, "Astronomy", "Next?")
+        summary = ConversationSummary.objects.get(user=self.user, topic="Astronomy")
+        self.assertIn("Question number 3?", summary.summary)
+
+    def test_oversized_latest_answer_is_truncated(self):
+        self.add_turns(1, answer_words=2000)
+        messages = build_tutor_messages(self.user, "Astronomy", "Next?")
+        self.assertLessEqual(self.prompt_tokens(messages[1:-1]), 300 + 5)
+        self.assertTrue(messages[-2]["content"].endswith("…"))
+
+    def test_steady_state_issues_two_reads_and_no_writes(self):
+        self.add_turns(50)
+        build_tutor_messages(self.user, "Astronomy", "Next?")
+        with self.assertNumQueries(2):
+            build_tutor_messages(self.user, "Astronomy", "Next?")
+
+
+SEED_TS = "datetime('2026-01-01', '+' || x || ' seconds')"
+
+def seed_rows(table, columns, values, rows):
+    """INSERT `rows` rows in one statement; `values` is SQL over x = 0..rows-1."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH RECURSIVE seq(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM seq WHERE x < {rows - 1}) "
+            f"INSERT INTO {table} ({columns}) SELECT {values} FROM seq"
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite syntax")
+class HotQueryPlanTests(FreshProcessStateMixin, TestCase):
+    """
+    Seed a small history, ANALYZE it and check with EXPLAIN QUERY PLAN that
+    every hot per-user query is an index range scan that also yields the
+    requested order (no full scan, no temp sort).
+    """
+    ROWS = 5_000
+    USERS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([User(username=f"seed{i}@example.com") for i in range(cls.USERS)])
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in User.objects.all()])
+        first_id = User.objects.order_by('id').values_list('id', flat=True).first()
+        cls.user = User.objects.get(id=first_id + 7)
+        quiz = Quiz.objects.create(subject=Subject.objects.create(name="Astronomy"), title="Stars")
+
+        user_id = f"{first_id} + x % {cls.USERS}"
+        seed_rows(Conversation._meta.db_table, "user_id, topic, question, answer, created_at",
+                  f"{user_id}, 'Topic ' || (x % 7), 'q', 'a', {SEED_TS}", cls.ROWS)
+        seed_rows(XPTransaction._meta.db_table, "user_id, amount, reason, timestamp",
+                  f"{user_id}, 10, 'Daily Login Reward', {SEED_TS}", cls.ROWS // 4)
+        seed_rows(LoginHistory._meta.db_table, "user_id, timestamp",
+                  f"{user_id}, {SEED_TS}", cls.ROWS // 4)
+        seed_rows(UserQuizAttempt._meta.db_table,
+                  "user_id, quiz_id, score, total_questions, started_at, completed_at",
+                  f"{user_id}, {quiz.id}, 1, 5, {SEED_TS}, CASE WHEN x % 3 = 0 THEN NULL ELSE {SEED_TS} END",
+                  cls.ROWS // 4)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return " | ".join(row[-1] for row in cursor.fetchall())
+
+    def assertIndexed(self, queryset, index_name):
+        plan = self.plan(queryset)
+        self.assertIn(f"USING INDEX {index_name}", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_tutor_prompt_history(self):
+        qs = (Conversation.objects.filter(user=self.user, topic="Topic 3")
+              .order_by('-created_at', '-id').values_list('id', 'question', 'answer')[:10])
+        self.assertIndexed(qs, 'conversation_user_topic_idx')
+
+    def test_chat_history(self):
+        self.assertIndexed(Conversation.objects.filter(user=self.user, topic="Topic 3"), 'conversation_user_topic_idx')
+
+    def test_history_cursor_page(self):
+        row = Conversation.objects.filter(user=self.user, topic="Topic 3").values('id', 'created_at')[10]
+        qs, _ = views._history_page_query(self.user, {"topic": "Topic 3", "cursor": views._encode_history_cursor(row)})
+        self.assertIndexed(qs, 'conversation_user_topic_idx')
+        self.assertIn("created_at<?", self.plan(qs).replace(" ", ""))
+
+    def test_recent_xp_transactions(self):
+        qs = XPTransaction.objects.filter(user=self.user).order_by('-timestamp')[:5]
+        self.assertIndexed(qs, 'xptransaction_user_time_idx')
+
+    def test_recent_logins(self):
+        self.assertIndexed(self.user.login_history.all()[:5], 'loginhistory_user_time_idx')
+
+    def test_recent_quiz_attempts(self):
+        qs = UserQuizAttempt.objects.filter(
+            user=self.user, completed_at__isnull=False
+        ).order_by('-completed_at')[:5]
+        self.assertIndexed(qs, 'quizattempt_user_done_idx')
+
+
+@benchmark
+class HistoryPagingBenchmarks(FreshProcessStateMixin, TestCase):
+    """A 100k-row history pages as fast as a short one, however deep the cursor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        cls.power_user = User.objects.create_user(username='power@example.com', password='pass12345')
+        seed_rows(Conversation._meta.db_table, "user_id, topic, question, answer, created_at",
+                  f"{cls.user.id}, 'Astronomy', 'q', 'a', {SEED_TS}", 140)
+        seed_rows(Conversation._meta.db_table, "user_id, topic, question, answer, created_at",
+                  f"{cls.power_user.id}, 'Astronomy', 'What is a star?', 'A hot ball of gas ✨', {SEED_TS}", 100_000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def median_page_time(self, user, deep=False):
+        self.client.force_login(user)
+        params = {"topic": "Astronomy", "limit": 30}
+        if deep:
+            row = (Conversation.objects.filter(user=user, topic="Astronomy")
+                   .order_by('-created_at', '-id').values('id', 'created_at')[50_000])
+            params["cursor"] = views._encode_history_cursor(row)
+        samples = []
+        for _ in range(15):
+            start = time.perf_counter()
+            response = self.client.get('/history/', params)
+            samples.append(time.perf_counter() - start)
+        self.assertEqual(len(response.json()["history"]), 30)
+        return sorted(samples)[len(samples) // 2]
+
+    def test_history_page_time_is_flat_in_history_length(self):
+        short_history = self.median_page_time(self.user)
+        long_history = self.median_page_time(self.power_user)
+        deep_page = self.median_page_time(self.power_user, deep=True)
+
+        self.assertLess(long_history, short_history * 3)
+        self.assertLess(deep_page, short_history * 3)
+
+
+class ChatHistoryPaginationTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        for i in range(75):
+            Conversation.objects.create(user=self.user, topic="Astronomy", question=f"Q{i}", answer=f"A{i}")
+        Conversation.objects.create(user=self.user, topic="History", question="Other topic", answer="-")
+
+    def test_pages_walk_the_whole_history_newest_first(self):
+        seen, cursor, sizes = [], None, []
+        while True:
+            params = {"topic": "Astronomy", "limit": 30}
+            if cursor:
+                params["cursor"] = cursor
+            data = self.client.get('/history/', params).json()
+            sizes.append(len(data["history"]))
+            seen += [item["question"] for item in data["history"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(sizes, [30, 30, 15])
+        self.assertEqual(seen, [f"Q{i}" for i in reversed(range(75))])
+
+    def test_limit_is_clamped_and_bad_cursor_rejected(self):
+        with mock.patch('core.views.HISTORY_MAX_PAGE_SIZE', 50):
+            data = self.client.get('/history/', {"topic": "Astronomy", "limit": 1000}).json()
+        self.assertEqual(len(data["history"]), 50)
+        self.assertIsNotNone(data["next_cursor"])
+        self.assertEqual(len(self.client.get('/history/', {"topic": "Astronomy", "limit": 0}).json()["history"]), 1)
+        self.assertEqual(self.client.get('/history/', {"topic": "Astronomy", "cursor": "nope"}).status_code, 400)
+
+    def test_page_is_a_single_projected_query(self):
+        self.client.get('/history/', {"topic": "Astronomy"})  # warm the session/user lookups
+        with self.assertNumQueries(3):  # session, user, history page
+            data = self.client.get('/history/', {"topic": "Astronomy", "limit": 5}).json()
+        self.assertEqual(set(data["history"][0]), {"id", "question", "answer", "topic", "day", "timestamp"})
+
+
+class AwardXPConcurrencyTests(FreshProcessStateMixin, TransactionTestCase):
+    """Threads hammering award_xp on the file-backed test database must not lose XP."""
+    THREADS = 8
+    AWARDS_PER_THREAD = 25
+
+    def hammer(self, user, per_thread):
+        """Award 10 XP `per_thread` times from each of THREADS threads; returns (errors, seconds)."""
+        errors = []
+
+        def worker():
+            try:
+                # Each thread works on its own User instance, like separate requests
+                thread_user = User.objects.get(pk=user.pk)
+                for _ in range(per_thread):
+                    award_xp(thread_user, 10, "Quiz Completed: Stress")
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors, time.perf_counter() - start
+
+    def test_concurrent_awards_lose_no_updates(self):
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        errors, _ = self.hammer(user, self.AWARDS_PER_THREAD)
+
+        awards = self.THREADS * self.AWARDS_PER_THREAD
+        self.assertEqual(errors, [])
+        profile = UserProfile.objects.select_related('current_level').get(user=user)
+        self.assertEqual(profile.total_xp, awards * 10)
+        self.assertEqual(XPTransaction.objects.filter(user=user).count(), awards)
+        self.assertEqual(profile.current_level.number, awards * 10 // 100)
+
+    @benchmark
+    def test_concurrent_award_throughput(self):
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        errors, elapsed = self.hammer(user, 250)
+
+        awards = self.THREADS * 250
+        logger.warning("award_xp: %d concurrent awards in %.2fs (%.0f/s)", awards, elapsed, awards / elapsed)
+        self.assertEqual(errors, [])
+        self.assertEqual(UserProfile.objects.get(user=user).total_xp, awards * 10)
+
+
+class AchievementEvaluationTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        # Start at level 1 so the measured awards never trigger a level-up
+        UserProfile.objects.filter(user=self.user).update(
+            current_level=Level.objects.create(number=1, title="Smart Explorer", xp_threshold=100)
+        )
+        # Create this week's leaderboard row so every measured award is a plain UPDATE
+        record_weekly_xp(self.user, 0)
+
+    def make_achievements(self, count):
+        Achievement.objects.bulk_create([
+            Achievement(name=f"XP {i}", icon="star", description="", xp_required=i * 10)
+            for i in range(count)
+        ])
+        # bulk_create sends no post_save
+        catalog.invalidate()
+
+    def award_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            award_xp(self.user, 50, "Quiz Completed: Stars")
+        return len(queries)
+
+    def test_unlocks_only_met_requirements(self):
+        Achievement.objects.create(name="First steps", icon="rocket", description="", xp_required=0)
+        Achievement.objects.create(name="Collector", icon="coins", description="", xp_required=100)
+        Achievement.objects.create(name="Streaker", icon="flame", description="", xp_required=50, streak_required=3)
+        Achievement.objects.create(name="Quizzer", icon="award", description="", quiz_count_required=1)
+
+        award_xp(self.user, 120, "Bonus")
+        earned = set(UserAchievement.objects.filter(user=self.user).values_list('achievement__name', flat=True))
+        self.assertEqual(earned, {"First steps", "Collector"})
+
+        # Re-evaluating is idempotent
+        check_achievements(self.user)
+        self.assertEqual(UserAchievement.objects.filter(user=self.user).count(), 2)
+
+    def test_query_count_independent_of_catalog_size(self):
+        self.make_achievements(5)
+        small = self.award_query_count()
+        Achievement.objects.all().delete()
+        UserProfile.objects.filter(user=self.user).update(total_xp=0)
+
+        self.make_achievements(500)
+        large = self.award_query_count()
+        self.assertEqual(small, large)
+        self.assertEqual(UserAchievement.objects.filter(user=self.user).count(), 6)
+
+    def test_award_evaluates_achievements_once(self):
+        with mock.patch('core.services.check_achievements', wraps=check_achievements) as spy, \
+                mock.patch('core.signals.check_achievements', wraps=check_achievements) as signal_spy:
+            award_xp(self.user, 10, "Daily Login Reward")
+        self.assertEqual(spy.call_count + signal_spy.call_count, 1)
+
+    def test_direct_xp_transaction_still_checked(self):
+        Achievement.objects.create(name="First steps", icon="rocket", description="")
+        XPTransaction.objects.create(user=self.user, amount=5, reason="Admin grant")
+        self.assertTrue(UserAchievement.objects.filter(user=self.user).exists())
+
+
+class GamificationCatalogTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.level = Level.objects.create(number=1, title="Smart Explorer", xp_threshold=100)
+        Level.objects.create(number=2, title="Smart Explorer", xp_threshold=200)
+        Achievement.objects.create(name="First steps", icon="rocket", description="")
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        UserProfile.objects.filter(user=self.user).update(current_level=self.level)
+
+    def catalog_queries(self, queries):
+        return [
+            q['sql'] for q in queries
+            if 'FROM "core_level"' in q['sql'] or 'FROM "core_achievement"' in q['sql']
+        ]
+
+    def test_steady_state_does_no_catalog_queries(self):
+        catalog.get()
+        with CaptureQueriesContext(connection) as queries:
+            award_xp(self.user, 250, "Quiz Completed: Stars")
+        self.assertEqual(self.catalog_queries(queries), [])
+        self.assertEqual(UserProfile.objects.get(user=self.user).current_level.number, 2)
+
+        self.client.force_login(self.user)
+        request = RequestFactory().get('/account/')
+        request.user = self.user
+        account_view = views.AccountPageView()
+        account_view.setup(request)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/dashboard/stats/')
+            context = account_view.get_context_data()
+        self.assertEqual(self.catalog_queries(queries), [])
+        self.assertEqual(context['next_level'], None)
+        self.assertEqual(len(context['badges_with_status']), 1)
+
+    def test_model_changes_invalidate_snapshot(self):
+        before = catalog.get()
+        Achievement.objects.create(name="Collector", icon="coins", description="", xp_required=100)
+        after = catalog.get()
+        self.assertNotEqual(before.version, after.version)
+        self.assertEqual([a.name for a in after.achievements], ["First steps", "Collector"])
+
+        self.level.delete()
+        self.assertIsNone(catalog.level(1))
+
+    def test_version_bump_from_another_process_reloads(self):
+        snapshot = catalog.get()
+        self.assertIs(catalog.get(), snapshot)
+
+        # Another worker saved a Level: only the shared version key changes here
+        Level.objects.filter(number=2).update(title="Knowledge Seeker")
+        cache.incr('catalog:version')
+        self.assertEqual(catalog.level(2).title, "Knowledge Seeker")
+
+    def test_rows_saved_by_another_process_are_picked_up(self):
+        snapshot = catalog.get()
+        # Written elsewhere: no signal here, and the version bump stayed in that process's locmem cache
+        level, = Level.objects.bulk_create([Level(number=3, title="Knowledge Seeker", xp_threshold=300)])
+        achievement, = Achievement.objects.bulk_create([Achievement(name="Collector", icon="coins", description="")])
+        self.assertEqual(catalog.level_by_id(level.id), level)
+        self.assertEqual(catalog.achievement(achievement.id), achievement)
+        self.assertIsNot(catalog.get(), snapshot)
+
+        Level.objects.filter(number=2).update(title="Star Gazer")
+        self.assertEqual(catalog.level(2).title, "Smart Explorer")
+        later = time.monotonic() + settings.CATALOG_MAX_AGE
+        with mock.patch('core.catalog.time.monotonic', return_value=later):
+            self.assertEqual(catalog.level(2).title, "Star Gazer")
+
+    def test_gunicorn_workers_load_it_at_startup(self):
+        hooks = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        hooks['post_worker_init'](None)
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.level(2).xp_threshold, 200)
+
+    def test_warm_before_migrate_leaves_loading_to_first_use(self):
+        with mock.patch.object(catalog, '_load', side_effect=OperationalError("no such table: core_level")), \
+                self.assertLogs('core.catalog', 'WARNING'):
+            catalog.warm()
+        self.assertEqual(catalog.level(1), self.level)
+
+    def test_snapshot_is_immutable(self):
+        snapshot = catalog.get()
+        with self.assertRaises(AttributeError):
+            snapshot.achievements = ()
+        with self.assertRaises(TypeError):
+            snapshot.levels_by_number[3] = self.level
+
+
+class DashboardStatsTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        self.subject = Subject.objects.create(name="Space")
+        self.quiz = Quiz.objects.create(subject=self.subject, title="Stars")
+
+    def get_stats(self, **headers):
+        return self.client.get('/dashboard/stats/', headers=headers)
+
+    def profile_queries(self, queries):
+        # Everything but the session lookup every authenticated request makes
+        return [q['sql'] for q in queries if 'core_' in q['sql'] and 'core_usersession' not in q['sql']]
+
+    def test_repeat_polls_hit_the_cache_without_writes(self):
+        first = self.get_stats()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['current_streak'], 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.get_stats()
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.profile_queries(queries), [])
+
+    def test_payload_query_count_is_fixed(self):
+        def payload_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.get_stats()
+            return len(self.profile_queries(queries))
+
+        self.get_stats()  # first poll of the day also writes the streak
+        baseline = payload_queries()
+        for i in range(20):
+            achievement = Achievement.objects.create(name=f"A{i}", icon="star", description="")
+            UserAchievement.objects.create(user=self.user, achievement=achievement)
+            UserQuizAttempt.objects.create(user=self.user, quiz=self.quiz, total_questions=5)
+        self.assertEqual(payload_queries(), baseline)
+
+        data = self.get_stats().json()
+        self.assertEqual(data['achievements_count'], 20)
+        self.assertEqual(len(data['recent_achievements']), 4)
+        self.assertEqual(data['quizzes_remaining'], 0)
+
+    def test_etag_revalidation_returns_304(self):
+        etag = self.get_stats()['ETag']
+        response = self.get_stats(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get_stats(if_none_match='"stale"').status_code, 200)
+
+    def test_progress_events_invalidate_the_payload(self):
+        etag = self.get_stats()['ETag']
+
+        award_xp(self.user, 40, "Quiz Completed: Stars")
+        response = self.get_stats(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_xp'], 50)  # +10 daily login
+
+        Quiz.objects.create(subject=self.subject, title="Planets")
+        self.assertEqual(self.get_stats().json()['quizzes_remaining'], 2)
+
+    def test_unrelated_profile_saves_keep_the_cache(self):
+        etag = self.get_stats()['ETag']
+        profile = UserProfile.objects.get(user=self.user)
+        profile.questions_asked = 3
+        profile.save(update_fields=['questions_asked'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_stats(if_none_match=etag).status_code, 304)
+        self.assertEqual(self.profile_queries(queries), [])
+
+
+class LeaderboardTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"student{i}@example.com", password='pass12345') for i in range(4)
+        ]
+        self.week = week_start()
+
+    def weekly_xp(self, user):
+        return WeeklyLeaderboard.objects.get(user=user, week_start=self.week).xp_gained
+
+    def test_award_xp_accumulates_weekly_row(self):
+        award_xp(self.users[0], 50, "Quiz Completed: Stars")
+        award_xp(self.users[0], 30, "Quiz Completed: Planets")
+        self.assertEqual(self.weekly_xp(self.users[0]), 80)
+        self.assertEqual(WeeklyLeaderboard.objects.filter(user=self.users[0]).count(), 1)
+
+    def test_ranking_and_api(self):
+        for user, xp in zip(self.users, [40, 90, 40, 10]):
+            award_xp(user, xp, "Quiz Completed: Stars")
+        self.assertEqual(rank_week(self.week), 4)
+        ranks = dict(WeeklyLeaderboard.objects.filter(week_start=self.week).values_list('user_id', 'rank'))
+        # RANK(): ties share a place and the next one is skipped
+        self.assertEqual([ranks[u.id] for u in self.users], [2, 1, 2, 4])
+
+        UserProfile.objects.filter(user=self.users[0]).update(full_name="Ada Lovelace")
+        rank_week(self.week)
+
+        self.client.force_login(self.users[3])
+        response = self.client.get('/leaderboard/', {"limit": 2})
+        page = response.json()
+        self.assertEqual(page["count"], 4)
+        self.assertEqual([r["rank"] for r in page["results"]], [1, 2])
+        # Full name when set, otherwise a masked handle: never the email address
+        self.assertEqual([r["name"] for r in page["results"]], ["st***", "Ada Lovelace"])
+        self.assertNotIn(b"@example.com", response.content)
+        self.assertEqual(page["next_offset"], 2)
+        self.assertEqual(page["me"], {"rank": 4, "xp_gained": 20})  # +10 daily login
+
+        # "me" follows live XP between ranking runs; the table itself waits for the next run
+        award_xp(self.users[3], 200, "7-Day Streak Bonus!")
+        page = self.client.get('/leaderboard/', {"offset": 2}).json()
+        self.assertEqual(page["me"], {"rank": 1, "xp_gained": 220})
+        self.assertEqual([r["rank"] for r in page["results"]], [2, 4])
+        self.assertIsNone(page["next_offset"])
+
+        self.assertEqual(self.client.get('/leaderboard/', {"week": "nope"}).status_code, 400)
+
+    def test_reads_after_ranking_use_the_snapshot(self):
+        for user, xp in zip(self.users, [40, 90, 40, 10]):
+            award_xp(user, xp, "Quiz Completed: Stars")
+        rank_week(self.week)
+        self.client.get('/leaderboard/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/leaderboard/', {"offset": 1, "limit": 2})
+        self.assertEqual([q['sql'] for q in queries if 'core_' in q['sql']], [])
+
+    def test_ranking_in_another_process_shows_up_within_the_max_age(self):
+        award_xp(self.users[0], 40, "Quiz Completed: Stars")
+        self.assertEqual(len(leaderboards.get(self.week)), 0)
+
+        # rank_leaderboard ran elsewhere: its version bump never reached this process's locmem cache
+        WeeklyLeaderboard.objects.filter(week_start=self.week).update(rank=1)
+        self.assertEqual(len(leaderboards.get(self.week)), 0)
+        later = time.monotonic() + settings.LEADERBOARD_SNAPSHOT_MAX_AGE
+        with mock.patch('core.leaderboard.time.monotonic', return_value=later):
+            self.assertEqual(len(leaderboards.get(self.week)), 1)
+
+    def seed_students(self, students):
+        first_id = User.objects.order_by('-id').values_list('id', flat=True).first() + 1
+        with connection.cursor() as cursor:
+            seq = f"WITH RECURSIVE seq(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM seq WHERE x < {students - 1}) "
+            cursor.execute(
+                seq + f"INSERT INTO {User._meta.db_table} (id, password, is_superuser, username, first_name, "
+                "last_name, email, is_staff, is_active, date_joined) "
+                f"SELECT {first_id} + x, '', 0, 'seed' || x, '', '', '', 0, 1, '2026-01-01' FROM seq"
+            )
+            cursor.execute(
+                seq + f"INSERT INTO {WeeklyLeaderboard._meta.db_table} (user_id, week_start, xp_gained) "
+                f"SELECT {first_id} + x, %s, (x * 7919) % 5000 FROM seq", [self.week]
+            )
+
+    def assertRanksMatchTheTable(self, board):
+        for xp in (0, 1234, 4999):
+            ahead = WeeklyLeaderboard.objects.filter(week_start=self.week, xp_gained__gt=xp).count()
+            self.assertEqual(board.rank_for_xp(xp), ahead + 1)
+
+    def test_rank_lookup_matches_the_table(self):
+        self.seed_students(1000)
+        rank_week(self.week)
+        board = leaderboards.get(self.week)
+
+        self.assertRanksMatchTheTable(board)
+        total = WeeklyLeaderboard.objects.filter(week_start=self.week).count()
+        self.assertEqual(len(board.page(total - 10, 20)), 10)
+
+    @benchmark
+    def test_rank_lookup_at_scale(self):
+        students = 100_000
+        self.seed_students(students)
+
+        start = time.perf_counter()
+        rank_week(self.week)
+        rank_seconds = time.perf_counter() - start
+        board = leaderboards.get(self.week)
+
+        start = time.perf_counter()
+        for xp in range(0, 5000, 5):
+            board.rank_for_xp(xp)
+        lookup_us = (time.perf_counter() - start) / 1000 * 1e6
+        logger.warning("leaderboard: ranked %d students in %.2fs, rank lookup %.1fµs", students, rank_seconds, lookup_us)
+
+        self.assertRanksMatchTheTable(board)
+        self.assertEqual(len(board.page(99_990, 20)), 10)
+
+
+flaky_calls = []
+
+@task
+def flaky_task(fail_times):
+    flaky_calls.append(fail_times)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError("provider hiccup")
+
+
+@override_settings(TASKS_EAGER=False)
+class BackgroundTaskTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        flaky_calls.clear()
+
+    def test_login_bookkeeping_is_queued(self):
+        self.client.force_login(self.user)
+        self.assertFalse(LoginHistory.objects.filter(user=self.user).exists())
+        self.assertEqual(BackgroundTask.objects.get().name, 'record_login')
+
+        self.assertEqual(run_pending(), 1)
+        self.assertTrue(LoginHistory.objects.filter(user=self.user).exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_xp, 10)
+        self.assertEqual(BackgroundTask.objects.get().status, 'DONE')
+        self.assertEqual(run_pending(), 0)
+
+    def test_idempotency_key_enqueues_once(self):
+        for _ in range(3):
+            enqueue('record_login', key="record_login:1", user_id=self.user.pk, ip_address='127.0.0.1',
+                    user_agent='', logged_in_at=timezone.now().isoformat())
+        self.assertEqual(BackgroundTask.objects.count(), 1)
+        run_pending()
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_xp, 10)
+        self.assertEqual(LoginHistory.objects.filter(user=self.user).count(), 1)
+
+    def test_failures_retry_with_backoff_then_give_up(self):
+        enqueue('flaky_task', fail_times=1)
+        run_pending()
+        row = BackgroundTask.objects.get()
+        self.assertEqual((row.status, row.attempts), ('PENDING', 1))
+        self.assertIn("provider hiccup", row.last_error)
+        self.assertGreater(row.run_after, timezone.now())
+        self.assertEqual(run_pending(), 0)  # not due yet
+
+        BackgroundTask.objects.update(run_after=timezone.now())
+        run_pending()
+        self.assertEqual(BackgroundTask.objects.get().status, 'DONE')
+
+        BackgroundTask.objects.all().delete()
+        flaky_calls.clear()
+        enqueue('flaky_task', fail_times=99)
+        for _ in range(settings.TASK_MAX_ATTEMPTS):
+            BackgroundTask.objects.update(run_after=timezone.now())
+            run_pending()
+        row = BackgroundTask.objects.get()
+        self.assertEqual((row.status, row.attempts), ('FAILED', settings.TASK_MAX_ATTEMPTS))
+
+    def test_expired_lease_is_reclaimed(self):
+        enqueue('flaky_task', fail_times=0)
+        # A worker claimed it and died: RUNNING with a lease that has run out
+        BackgroundTask.objects.update(status='RUNNING', attempts=1, run_after=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        row = BackgroundTask.objects.get()
+        self.assertEqual((row.status, row.attempts), ('DONE', 2))
+
+    @benchmark
+    def test_login_p99_latency(self):
+        def p99_login_ms():
+            samples = []
+            for _ in range(100):
+                start = time.perf_counter()
+                self.client.force_login(self.user)
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            return samples[98], samples[50]
+
+        with override_settings(TASKS_EAGER=True):
+            eager_p99, eager_p50 = p99_login_ms()
+        queued_p99, queued_p50 = p99_login_ms()
+        logger.warning("login: eager p50 %.2fms p99 %.2fms, queued p50 %.2fms p99 %.2fms",
+                       eager_p50, eager_p99, queued_p50, queued_p99)
+        self.assertLess(queued_p50, eager_p50)
+
+
+@override_settings(WRITE_BUFFER_MODE='buffered', WRITE_BUFFER_MAX_ROWS=50, WRITE_BUFFER_MAX_DELAY_MS=50)
+class WriteBufferTests(FreshProcessStateMixin, TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.buffer = WriteBuffer(LoginHistory)
+        self.addCleanup(flush_all)
+
+    def login_row(self, user_id=None):
+        return LoginHistory(user_id=user_id or self.user.pk, ip_address='127.0.0.1')
+
+    def test_flushes_every_n_rows(self):
+        with override_settings(WRITE_BUFFER_MAX_DELAY_MS=60_000):
+            for _ in range(49):
+                self.buffer.add(self.login_row())
+            self.assertEqual((LoginHistory.objects.count(), self.buffer.pending()), (0, 49))
+            self.buffer.add(self.login_row())
+            self.assertEqual((LoginHistory.objects.count(), self.buffer.pending()), (50, 0))
+
+    def test_flushes_after_max_delay(self):
+        self.buffer.add(self.login_row())
+        deadline = time.monotonic() + 2
+        while not LoginHistory.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(LoginHistory.objects.count(), 1)
+
+    def test_rolled_back_rows_are_never_written(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.buffer.add(self.login_row())
+                raise RuntimeError("request failed")
+        self.assertEqual(self.buffer.pending(), 0)
+
+    def test_flush_all_drains_pending_rows_and_skips_bad_ones(self):
+        doomed = User.objects.create_user(username='gone@example.com', password='pass12345')
+        with override_settings(WRITE_BUFFER_MAX_DELAY_MS=60_000):
+            self.buffer.add(self.login_row())
+            self.buffer.add(self.login_row(doomed.pk))
+            self.buffer.add(self.login_row())
+            doomed.delete()
+            flush_all()
+        self.assertEqual(LoginHistory.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.buffer.pending(), 0)
+
+    def test_run_tasks_flushes_pending_rows_on_sigterm(self):
+        def work(limit):
+            self.buffer.add(self.login_row())
+            os.kill(os.getpid(), signal.SIGTERM)
+            return 1
+
+        with override_settings(WRITE_BUFFER_MAX_DELAY_MS=60_000), \
+                mock.patch('core.management.commands.run_tasks.run_pending', side_effect=work):
+            call_command('run_tasks', stdout=StringIO())
+        self.assertEqual((LoginHistory.objects.count(), self.buffer.pending()), (1, 0))
+
+    def test_gunicorn_worker_exit_flushes_pending_rows(self):
+        hooks = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        with override_settings(WRITE_BUFFER_MAX_DELAY_MS=60_000):
+            self.buffer.add(self.login_row())
+            hooks['worker_exit'](None, None)
+        self.assertEqual((LoginHistory.objects.count(), self.buffer.pending()), (1, 0))
+
+    def test_award_xp_buffers_the_ledger_row(self):
+        with override_settings(WRITE_BUFFER_MAX_DELAY_MS=60_000):
+            award_xp(self.user, 40, "Quiz Completed: Stars")
+            self.assertEqual(UserProfile.objects.get(user=self.user).total_xp, 40)
+            self.assertFalse(XPTransaction.objects.exists())
+            flush_all()
+        self.assertEqual(XPTransaction.objects.get().amount, 40)
+
+    @benchmark
+    def test_batched_insert_throughput(self):
+        rows = 2000
+
+        def rows_per_second(mode):
+            start = time.perf_counter()
+            with override_settings(WRITE_BUFFER_MODE=mode, WRITE_BUFFER_MAX_ROWS=500,
+                                   WRITE_BUFFER_MAX_DELAY_MS=60_000):
+                for _ in range(rows):
+                    self.buffer.add(self.login_row())
+                self.buffer.flush()
+            return rows / (time.perf_counter() - start)
+
+        per_row = rows_per_second('sync')
+        batched = rows_per_second('buffered')
+        logger.warning("login history inserts: per-row %.0f rows/s, batched %.0f rows/s", per_row, batched)
+        self.assertEqual(LoginHistory.objects.count(), rows * 2)
+        self.assertGreater(batched, per_row * 2)
+
+
+class UserSessionTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.other = User.objects.create_user(username='friend@example.com', password='pass12345')
+
+    def login_client(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def test_sessions_record_the_signed_in_user(self):
+        client = self.login_client(self.user)
+        row = UserSession.objects.get(session_key=client.session.session_key)
+        self.assertEqual(row.user_id, self.user.pk)
+
+        client.get('/logout/')
+        self.assertFalse(UserSession.objects.filter(user=self.user).exists())
+
+    def test_logout_all_revokes_only_that_users_sessions(self):
+        devices = [self.login_client(self.user) for _ in range(3)]
+        friend = self.login_client(self.other)
+
+        response = devices[0].post('/account/', {"action": "logout_all"})
+        self.assertRedirects(response, '/login/', fetch_redirect_response=False)
+        self.assertFalse(UserSession.objects.filter(user=self.user).exists())
+        self.assertEqual(UserSession.objects.filter(user=self.other).count(), 1)
+        self.assertNotIn('_auth_user_id', devices[1].session)
+        self.assertEqual(friend.session['_auth_user_id'], str(self.other.pk))
+
+    def test_migration_carries_live_sessions_over(self):
+        from django.apps import apps
+        from django.contrib.sessions.backends.db import SessionStore as DjangoSessionStore
+        copy_sessions = import_module('core.migrations.0010_copy_django_sessions').copy_sessions
+
+        def old_session(data, expiry=3600):
+            store = DjangoSessionStore()
+            store.update(data)
+            store.set_expiry(expiry)
+            store.save()
+            return store.session_key
+
+        signed_in = old_session({'_auth_user_id': str(self.user.pk)})
+        guest = old_session({'guest_question_count': 2})
+        gone = old_session({'_auth_user_id': '999999'})
+        expired = old_session({'_auth_user_id': str(self.other.pk)}, expiry=-60)
+
+        copy_sessions(apps, None)
+        copied = dict(UserSession.objects.values_list('session_key', 'user_id'))
+        self.assertEqual(copied, {signed_in: self.user.pk, guest: None, gone: None})
+        self.assertNotIn(expired, copied)
+        self.assertEqual(SessionStore(signed_in).load()['_auth_user_id'], str(self.user.pk))
+
+    @benchmark
+    def test_revoke_with_500k_sessions(self):
+        sessions = 500_000
+        first_id = self.user.pk
+        data = SessionStore().encode({'_auth_user_id': str(first_id)})
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH RECURSIVE seq(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM seq WHERE x < {sessions - 1}) "
+                f"INSERT INTO {UserSession._meta.db_table} (session_key, session_data, expire_date, user_id) "
+                f"SELECT 'k' || x, %s, datetime('now', '+1 day'), "
+                f"CASE WHEN x % 50000 = 0 THEN {first_id} ELSE {self.other.pk} END FROM seq",
+                [data],
+            )
+
+        # The old loop decoded every live session; time it on a sample and scale up
+        sample = 10_000
+        start = time.perf_counter()
+        for session in UserSession.objects.all()[:sample]:
+            session.get_decoded()
+        scan_seconds = (time.perf_counter() - start) * sessions / sample
+
+        start = time.perf_counter()
+        revoked = revoke_user_sessions(self.user)
+        revoke_ms = (time.perf_counter() - start) * 1000
+        logger.warning("logout all: decode scan ~%.1fs over %d sessions, indexed delete %.1fms",
+                       scan_seconds, sessions, revoke_ms)
+        self.assertEqual(revoked, sessions // 50_000)
+        self.assertLess(revoke_ms, 500)
+
+
+class RateLimitTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        answer_cache.clear()
+
+    def ask(self, client=None, **extra):
+        return (client or self.client).post(
+            '/ask/', {"question": "What is a star?", "topic": "Astronomy"}, content_type='application/json', **extra
+        )
+
+    def test_bucket_refills_over_time(self):
+        bucket = LocMemTokenBucket()
+        with mock.patch('core.ratelimit.time.monotonic', return_value=100.0):
+            self.assertEqual([bucket.consume('k', 2, 0.5)[0] for _ in range(3)], [True, True, False])
+            self.assertEqual(bucket.consume('k', 2, 0.5), (False, 2.0))
+        with mock.patch('core.ratelimit.time.monotonic', return_value=102.0):
+            self.assertEqual(bucket.consume('k', 2, 0.5), (True, 0.0))
+
+    def test_burst_is_rejected_with_retry_after_before_profile_work(self):
+        burst, _ = settings.RATE_LIMITS['FREE']
+        with mock.patch('core.views.get_freeflow_client', return_value=FakeFreeFlowClient()):
+            for _ in range(burst):
+                self.assertEqual(self.ask().status_code, 200)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.ask()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(response.json()["retry_after"], int(response['Retry-After']))
+        # Only the session lookup ran; the profile was neither read nor counted
+        self.assertEqual([q['sql'] for q in queries if 'core_userprofile' in q['sql']], [])
+        self.assertEqual(UserProfile.objects.get(user=self.user).questions_asked, burst)
+
+    def test_plan_sizes_the_bucket(self):
+        profile = UserProfile.objects.get(user=self.user)
+        profile.plan = 'ULTRA'
+        profile.save(update_fields=['plan'])
+        burst, _ = settings.RATE_LIMITS['ULTRA']
+        with mock.patch('core.views.get_freeflow_client', return_value=FakeFreeFlowClient()):
+            codes = [self.ask().status_code for _ in range(burst + 1)]
+        self.assertEqual(codes, [200] * burst + [429])
+
+    def test_guests_are_limited_per_ip(self):
+        burst, _ = settings.RATE_LIMITS['GUEST']
+        with mock.patch('core.views.get_freeflow_client', return_value=FakeFreeFlowClient()):
+            # Fresh guest sessions from one address don't get fresh buckets
+            codes = [self.ask(Client(), REMOTE_ADDR='10.0.0.1').status_code for _ in range(burst + 1)]
+            self.assertEqual(codes, [200] * burst + [429])
+            self.assertEqual(self.ask(Client(), REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @benchmark
+    def test_rejection_cost(self):
+        bucket = LocMemTokenBucket()
+        bucket.consume('abuser', 1, 0.001)
+        start = time.perf_counter()
+        for _ in range(10_000):
+            bucket.consume('abuser', 1, 0.001)
+        per_call_us = (time.perf_counter() - start) / 10_000 * 1e6
+        logger.warning("rate limiter: rejection costs %.2fµs", per_call_us)
+        self.assertLess(per_call_us, 100)
+
+
+class SingleFlightTests(FreshProcessStateMixin, TestCase):
+    def run_concurrently(self, fn, count):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(fn())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        flight, calls = SingleFlight('test'), []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return "answer"
+
+        results, _ = self.run_concurrently(lambda: flight.do('k', slow), 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("answer", False)] + [("answer", True)] * 4)
+        self.assertEqual(flight.stats(), {"leaders": 1, "coalesced": 4, "remote_coalesced": 0})
+
+        # Once it has returned, the next caller asks again
+        self.assertEqual(flight.do('k', slow), ("answer", False))
+        self.assertEqual(len(calls), 2)
+
+    def test_followers_get_the_leaders_exception(self):
+        flight = SingleFlight('test')
+
+        def broken():
+            time.sleep(0.1)
+            raise RuntimeError("provider down")
+
+        results, errors = self.run_concurrently(lambda: flight.do('k', broken), 3)
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ["provider down"] * 3)
+
+    def test_stream_followers_get_the_whole_answer_as_one_chunk(self):
+        flight, calls = SingleFlight('test'), []
+
+        def stream():
+            calls.append(1)
+            for word in ("Stars ", "fuse ", "hydrogen."):
+                time.sleep(0.05)
+                yield word
+
+        results, _ = self.run_concurrently(lambda: list(flight.do_stream('k', stream)), 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            sorted(results, key=len), [["Stars fuse hydrogen."]] * 3 + [["Stars ", "fuse ", "hydrogen."]]
+        )
+        self.assertEqual(flight.stats(), {"leaders": 1, "coalesced": 3, "remote_coalesced": 0})
+
+    def test_stream_followers_start_over_when_the_leader_goes_away(self):
+        flight, calls = SingleFlight('test'), []
+
+        def stream():
+            calls.append(1)
+            yield "Stars "
+            time.sleep(0.1)
+            yield "fuse hydrogen."
+
+        leader = flight.do_stream('k', stream)
+        self.assertEqual(next(leader), "Stars ")
+        results = []
+        follower = threading.Thread(target=lambda: results.append(''.join(flight.do_stream('k', stream))))
+        follower.start()
+        time.sleep(0.05)
+        # The student reading the leader's stream went away; the follower asks itself
+        leader.close()
+        follower.join(timeout=2)
+
+        self.assertEqual(results, ["Stars fuse hydrogen."])
+        self.assertEqual(len(calls), 2)
+
+    def test_async_followers_start_over_when_the_leader_is_cancelled(self):
+        flight, calls = SingleFlight('test'), []
+
+        async def ask():
+            calls.append(1)
+            await asyncio.sleep(0.2 if len(calls) == 1 else 0)
+            return "answer"
+
+        async def scenario():
+            leader = asyncio.create_task(flight.ado('k', ask))
+            await asyncio.sleep(0.05)
+            follower = asyncio.create_task(flight.ado('k', ask))
+            await asyncio.sleep(0.05)
+            # The leader's client disconnected and Django cancelled its view
+            leader.cancel()
+            return await asyncio.wait_for(follower, timeout=2)
+
+        self.assertEqual(asyncio.run(scenario()), ("answer", False))
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(SINGLEFLIGHT_DISTRIBUTED=True)
+    def test_distributed_lock_coalesces_across_processes(self):
+        # Two instances with the same name stand in for two worker processes sharing the cache
+        flights, calls = [SingleFlight('test'), SingleFlight('test')], []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.3)
+            return "answer"
+
+        workers = iter(flights)
+        results, _ = self.run_concurrently(lambda: next(workers).do('k', slow), 2)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("answer", False), ("answer", True)])
+        self.assertEqual(flights[0].stats()["remote_coalesced"], 1)
+
+
+@override_settings(LLM_HEDGE=False, LLM_ROUTING='ordered', LLM_BREAKER_FAILURES=3, LLM_BREAKER_COOLDOWN_SECONDS=30)
+class ProviderRouterTests(FreshProcessStateMixin, TestCase):
+    messages = [{"role": "user", "content": "What is a star?"}]
+
+    def test_fails_over_to_the_next_provider(self):
+        groq = FakeProvider('groq', error=RateLimitError('groq'))
+        gemini = FakeProvider('gemini', answer="Stars fuse hydrogen.")
+        router = ProviderRouter([groq, gemini])
+
+        response = router.chat(messages=self.messages, timeout=5)
+        self.assertEqual((response.content, response.provider), ("Stars fuse hydrogen.", 'gemini'))
+        self.assertEqual(router.stats()["providers"]["groq"]["failures"], 1)
+
+    def test_breaker_skips_a_failing_provider_until_cooldown(self):
+        groq = FakeProvider('groq', error=ProviderError('groq', "503"))
+        gemini = FakeProvider('gemini')
+        router = ProviderRouter([groq, gemini])
+
+        for _ in range(5):
+            router.chat(messages=self.messages)
+        # Three failures open the breaker; the other two requests went straight to gemini
+        self.assertEqual(groq.calls, 3)
+        self.assertEqual(router.stats()["providers"]["groq"]["state"], 'open')
+
+        groq.error = None
+        with override_settings(LLM_BREAKER_COOLDOWN_SECONDS=0):
+            self.assertEqual(router.chat(messages=self.messages).provider, 'groq')
+        self.assertEqual(router.stats()["providers"]["groq"]["state"], 'closed')
+
+    def test_half_open_failure_reopens(self):
+        groq = FakeProvider('groq', error=ProviderError('groq', "503"))
+        router = ProviderRouter([groq, FakeProvider('gemini')])
+        for _ in range(3):
+            router.chat(messages=self.messages)
+        with override_settings(LLM_BREAKER_COOLDOWN_SECONDS=0):
+            router.chat(messages=self.messages)
+        self.assertEqual(groq.calls, 4)
+        self.assertEqual(router.stats()["providers"]["groq"]["state"], 'open')
+
+    def test_all_providers_down(self):
+        router = ProviderRouter([FakeProvider('groq', error=ProviderError('groq', "down"))])
+        with self.assertRaises(NoProvidersAvailableError):
+            router.chat(messages=self.messages)
+
+    @override_settings(LLM_ROUTING='latency')
+    def test_latency_routing_prefers_the_fastest_provider(self):
+        slow, fast = FakeProvider('groq', delay=0.05), FakeProvider('gemini')
+        router = ProviderRouter([slow, fast])
+        # Untried providers go last, so gemini is only measured once groq fails over to it
+        slow.error = [None, ProviderError('groq', "blip")]
+        router.chat(messages=self.messages)
+        router.chat(messages=self.messages)
+
+        self.assertEqual(router.chat(messages=self.messages).provider, 'gemini')
+        stats = router.stats()["providers"]
+        self.assertLess(stats["gemini"]["ewma_ms"], stats["groq"]["ewma_ms"])
+
+    @override_settings(LLM_HEDGE=True, LLM_HEDGE_MIN_DELAY_MS=50, LLM_HEDGE_MAX_DELAY_MS=50)
+    def test_hedge_answers_from_the_second_provider_when_the_first_stalls(self):
+        stalled, backup = FakeProvider('groq', delay=1.0), FakeProvider('gemini', delay=0.05)
+        router = ProviderRouter([stalled, backup])
+        try:
+            start = time.monotonic()
+            response = router.chat(messages=self.messages, timeout=5)
+            elapsed = time.monotonic() - start
+        finally:
+            router.close()
+
+        self.assertEqual(response.provider, 'gemini')
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(router.stats()["hedges"], 1)
+
+    @override_settings(LLM_HEDGE=True, LLM_HEDGE_MIN_DELAY_MS=50, LLM_HEDGE_MAX_DELAY_MS=50)
+    def test_async_hedge_and_deadline(self):
+        router = ProviderRouter([FakeProvider('groq', delay=1.0), FakeProvider('gemini', delay=0.05)])
+        response = asyncio.run(router.async_chat(messages=self.messages, timeout=5))
+        self.assertEqual(response.provider, 'gemini')
+
+        router = ProviderRouter([FakeProvider('groq', delay=1.0)])
+        start = time.monotonic()
+        with self.assertRaises(NoProvidersAvailableError):
+            asyncio.run(router.async_chat(messages=self.messages, timeout=0.2))
+        self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_deadline_cuts_a_stalled_attempt_short_without_hedging(self):
+        router = ProviderRouter([FakeProvider('groq', delay=1.0), FakeProvider('gemini')])
+        try:
+            start = time.monotonic()
+            with self.assertRaises(NoProvidersAvailableError) as raised:
+                router.chat(messages=self.messages, timeout=0.2)
+            elapsed = time.monotonic() - start
+        finally:
+            router.close()
+
+        self.assertLess(elapsed, 0.6)
+        self.assertIn("deadline exceeded", str(raised.exception))
+        self.assertEqual(router.stats()["hedges"], 0)
+
+    def test_stream_fails_over_before_the_first_chunk(self):
+        router = ProviderRouter([FakeProvider('groq', error=ProviderError('groq', "down")), FakeProvider('gemini', answer="Hi there")])
+        chunks = [chunk.choices[0].delta['content'] for chunk in router.chat_stream(messages=self.messages)]
+        self.assertEqual(''.join(chunks), "Hi there ")
+
+    def test_async_stream_fails_over_before_the_first_chunk(self):
+        router = ProviderRouter([FakeProvider('groq', error=ProviderError('groq', "down")), FakeProvider('gemini', answer="Hi there")])
+
+        async def relay():
+            return [chunk.choices[0].delta['content'] async for chunk in router.async_chat_stream(messages=self.messages)]
+
+        self.assertEqual(''.join(asyncio.run(relay())), "Hi there ")
+        self.assertEqual(router.stats()["providers"]["groq"]["failures"], 1)
+
+    def test_ask_returns_503_when_every_provider_fails(self):
+        answer_cache.clear()
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(user)
+        router = ProviderRouter([FakeProvider('groq', error=ProviderError('groq', "down"))])
+        with mock.patch('core.views.get_freeflow_client', return_value=router):
+            response = self.client.post(
+                '/ask/', {"question": "What is a star?", "topic": "Astronomy"}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn("groq", response.json()["error"])
+
+
+class SubjectCurriculumTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.subject = Subject.objects.create(name="Astronomy")
+        self.quiz = Quiz.objects.create(subject=self.subject, title="Stars")
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+
+    def days(self, subject="Astronomy"):
+        return self.client.get('/subject/days/', {"subject": subject}).json()["days"]
+
+    def test_warm_get_reads_nothing_and_writes_nothing(self):
+        self.days()
+        with CaptureQueriesContext(connection) as queries:
+            days = self.days()
+
+        self.assertEqual([d["status"] for d in days[:2]], ["in_progress", "locked"])
+        self.assertEqual(len(days), 14)
+        sql = [q['sql'] for q in queries]
+        self.assertEqual([q for q in sql if not q.startswith('SELECT')], [])
+        # Only the session and user lookups of any signed-in request remain
+        self.assertEqual([q for q in sql if 'core_subject' in q], [])
+
+    def test_get_never_creates_a_subject(self):
+        self.assertEqual(len(self.days("Underwater Basket Weaving")), 14)
+        self.client.get('/teacher/Underwater Basket Weaving/')
+        self.assertFalse(Subject.objects.filter(name="Underwater Basket Weaving").exists())
+
+    def complete(self, quiz, correct=True):
+        question = Question.objects.filter(quiz=quiz).first() or Question.objects.create(quiz=quiz, text="Hot?", order=0)
+        if not question.options.exists():
+            Option.objects.bulk_create([Option(question=question, text=text, is_correct=text == "Yes") for text in ("Yes", "No")])
+        answer = question.options.get(text="Yes" if correct else "No")
+        return self.client.post(
+            '/quiz/complete/', {"quiz_id": quiz.id, "answers": {str(question.id): answer.id}}, content_type='application/json'
+        )
+
+    def progress(self):
+        return SubjectProgress.objects.get(user=self.user, subject=self.subject).current_day
+
+    def test_completing_a_quiz_finishes_the_current_day(self):
+        self.days()
+        self.complete(self.quiz)
+
+        self.assertEqual(SubjectProgress.objects.get(user=self.user, subject=self.subject).current_day, 2)
+        self.assertEqual([d["status"] for d in self.days()[:3]], ["completed", "in_progress", "locked"])
+        self.assertEqual(self.client.get('/teacher/Astronomy/').context['current_day'], 2)
+        # Other students are still on day one
+        self.client.force_login(User.objects.create_user(username='other@example.com', password='pass12345'))
+        self.assertEqual(self.days()[0]["status"], "in_progress")
+
+    def test_retakes_and_zero_scores_do_not_advance(self):
+        self.complete(self.quiz, correct=False)
+        self.assertFalse(SubjectProgress.objects.exists())
+        self.complete(self.quiz)
+        self.complete(self.quiz)
+        self.assertEqual(self.progress(), 2)
+
+    def test_progress_stops_after_the_last_day(self):
+        self.subject.curriculum = ["The Sun", "The Moon"]
+        self.subject.save()
+        for title in ("Sun", "Moon", "Comets"):
+            self.complete(Quiz.objects.create(subject=self.subject, title=title))
+        self.assertEqual(self.progress(), 3)
+        self.assertEqual([d["status"] for d in self.days()], ["completed", "completed"])
+
+    def test_curriculum_edits_expire_the_cache(self):
+        self.days()
+        self.subject.curriculum = ["The Sun", "The Moon", "Stars"]
+        self.subject.save()
+
+        days = self.days()
+        self.assertEqual([d["label"] for d in days], ["The Sun", "The Moon", "Stars"])
+
+        SubjectProgress.objects.create(user=self.user, subject=self.subject, current_day=9)
+        self.assertEqual([d["status"] for d in self.days()], ["completed"] * 3)
+
+
+class MetricsTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        metrics.clear()
+        answer_cache.clear()
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+
+    def scrape(self, **extra):
+        staff = User.objects.create_user(username='ops@example.com', password='pass12345', is_staff=True)
+        client = Client()
+        client.force_login(staff)
+        return client.get('/metrics', **extra)
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_ask_reports_llm_and_db_time(self):
+        router = ProviderRouter([FakeProvider('groq', delay=0.05)])
+        with mock.patch('core.views.get_freeflow_client', return_value=router):
+            response = self.client.post(
+                '/ask/', {"question": "What is a comet?", "topic": "Astronomy"}, content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        llm_ms = float(timing['llm'].split('dur=')[1].split(';')[0])
+        self.assertGreaterEqual(llm_ms, 50)
+        self.assertIn('desc="1 calls"', timing['llm'])
+        self.assertRegex(timing['db'], r'desc="[1-9]\d* queries"')
+
+        body = self.scrape().content.decode()
+        self.assertIn('mentora_request_duration_seconds_count{view="ask_ai",method="POST",status="200"} 1', body)
+        self.assertIn('mentora_llm_call_duration_seconds_count{provider="groq"} 1', body)
+        self.assertIn('mentora_llm_call_duration_seconds_bucket{provider="groq",le="0.1"} 1', body)
+
+    def test_stream_is_observed_when_its_body_has_been_sent(self):
+        router = ProviderRouter([FakeProvider('groq', answer="Comets are icy.", delay=0.05)])
+        with mock.patch('core.views.get_freeflow_client', return_value=router):
+            response = self.client.post(
+                '/ask/stream/', {"question": "What is a comet?", "topic": "Astronomy"}, content_type='application/json'
+            )
+            self.assertNotIn('view="ask_ai_stream"', "\n".join(metrics.render()))
+            b''.join(response.streaming_content)
+
+        body = self.scrape().content.decode()
+        self.assertIn('mentora_request_duration_seconds_count{view="ask_ai_stream",method="POST",status="200"} 1', body)
+        self.assertIn('mentora_llm_call_duration_seconds_count{provider="groq"} 1', body)
+        duration = next(
+            line for line in body.splitlines()
+            if line.startswith('mentora_request_duration_seconds_sum{view="ask_ai_stream"')
+        )
+        self.assertGreaterEqual(float(duration.split()[-1]), 0.05)
+
+    def test_query_counts_per_view(self):
+        self.client.get('/dashboard/stats/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/dashboard/stats/')
+
+        body = self.scrape().content.decode()
+        counted = [line for line in body.splitlines() if line.startswith('mentora_request_db_queries_total{view="dashboard_stats"}')]
+        self.assertEqual(len(counted), 1)
+        self.assertGreaterEqual(int(counted[0].split()[-1]), len(queries))
+        self.assertIn('mentora_answer_cache_lookups_total{result="misses"}', body)
+
+    def test_unresolved_paths_share_a_label(self):
+        self.client.get('/no-such-page/1')
+        self.client.get('/no-such-page/2')
+        self.assertIn('mentora_request_duration_seconds_count{view="unmatched",method="GET",status="404"} 2',
+                      self.scrape().content.decode())
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_scrape_needs_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(Client().get('/metrics', HTTP_AUTHORIZATION='Bearer nope').status_code, 403)
+        response = Client().get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class AccountPageTests(FreshProcessStateMixin, TestCase):
+    # Session, user, profile, earned achievement ids and the activity events
+    QUERY_BUDGET = 5
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.subject = Subject.objects.create(name="Astronomy")
+        now = timezone.now()
+        for i in range(6):
+            quiz = Quiz.objects.create(subject=self.subject, title=f"Stars {i}", xp_reward=50)
+            UserQuizAttempt.objects.create(
+                user=self.user, quiz=quiz, total_questions=5, completed_at=now - timedelta(minutes=10 * i)
+            )
+        for i in range(6):
+            LoginHistory.objects.create(user=self.user, timestamp=now - timedelta(minutes=10 * i + 5))
+        XPTransaction.objects.create(user=self.user, amount=10, reason="Daily Login Reward")
+        XPTransaction.objects.create(user=self.user, amount=50, reason="Quiz Completed: Stars 0")
+        # History from before the feed existed
+        call_command('backfill_activity', stdout=StringIO())
+        # Written live: a login event and its Daily Login Reward
+        self.client.force_login(self.user)
+
+    def test_activity_feed_merges_sources_newest_first(self):
+        items = self.client.get('/account/').context['activity_items']
+
+        self.assertEqual(len(items), 8)
+        self.assertEqual([item['timestamp'] for item in items], sorted((item['timestamp'] for item in items), reverse=True))
+        self.assertEqual(items[0]['title'], "Daily Login Reward")
+        self.assertEqual(items[0]['xp'], "+10 XP")
+        quiz = next(item for item in items if item['type'] == 'quiz')
+        self.assertEqual(quiz['title'], "Completed Quiz — Stars 0")
+        self.assertTrue(quiz['sub'].startswith("Astronomy · "))
+        self.assertEqual({item['xp'] for item in items if item['type'] == 'login'}, {'—'})
+        # Quiz XP is already shown with its quiz
+        self.assertNotIn("Quiz Completed: Stars 0", [item['title'] for item in items])
+
+    def test_query_budget(self):
+        self.client.get('/account/')
+        # More history must not cost more queries
+        ActivityEvent.objects.bulk_create([ActivityEvent(user=self.user, kind='login', title="Logged in") for _ in range(20)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/account/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), self.QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_backfill_is_idempotent(self):
+        self.assertEqual(ActivityEvent.objects.filter(user=self.user).count(), 15)
+        out = StringIO()
+        call_command('backfill_activity', '--chunk-size', '4', stdout=out)
+
+        # Nothing doubled, and the live login isn't copied again
+        self.assertEqual(ActivityEvent.objects.filter(user=self.user).count(), 15)
+        self.assertIn("logins: 6 read, 0 new", out.getvalue())
+
+    def test_events_are_written_when_they_happen(self):
+        ActivityEvent.objects.all().delete()
+        quiz = Quiz.objects.create(subject=self.subject, title="Comets", xp_reward=30)
+        question = Question.objects.create(quiz=quiz, text="What is a comet's tail made of?", order=0)
+        option = Option.objects.create(question=question, text="Gas and dust", is_correct=True)
+        Achievement.objects.create(name="First Steps", icon='rocket', description="Finish a quiz", quiz_count_required=1)
+        catalog.invalidate()
+
+        self.client.post('/quiz/complete/', {"quiz_id": quiz.id, "answers": {question.id: option.id}},
+                         content_type='application/json')
+
+        events = list(ActivityEvent.objects.filter(user=self.user).order_by('id').values_list('kind', 'title', 'detail', 'xp'))
+        self.assertEqual(events, [
+            ('quiz', "Comets", "Astronomy", 30),
+            ('achievement', "First Steps", '', None),
+        ])
+        # A later check that finds the same unlock doesn't repeat its event
+        UserAchievement.objects.filter(user=self.user).delete()
+        check_achievements(self.user)
+        self.assertEqual(ActivityEvent.objects.filter(user=self.user, kind='achievement').count(), 1)
+
+        award_xp(self.user, 20, "Streak Bonus")
+        self.assertEqual(ActivityEvent.objects.filter(user=self.user, kind='xp').get().xp, 20)
+
+    def test_activity_api_pages_with_a_cursor(self):
+        first = self.client.get('/activity/', {'limit': 5}).json()
+        self.assertEqual(len(first['events']), 5)
+        self.assertEqual(first['events'][0]['title'], "Daily Login Reward")
+
+        seen = [event['timestamp'] for event in first['events']]
+        cursor = first['next_cursor']
+        while cursor:
+            page = self.client.get('/activity/', {'limit': 5, 'cursor': cursor}).json()
+            seen += [event['timestamp'] for event in page['events']]
+            cursor = page['next_cursor']
+        self.assertEqual(len(seen), 15)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+        self.assertEqual(self.client.get('/activity/', {'cursor': 'nope'}).status_code, 400)
+
+
+class QuizSubmissionTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        self.subject = Subject.objects.create(name="Astronomy")
+        self.quiz = self.make_quiz(3)
+
+    def make_quiz(self, questions):
+        quiz = Quiz.objects.create(subject=self.subject, title=f"Stars x{questions}", xp_reward=40)
+        for i in range(questions):
+            question = Question.objects.create(quiz=quiz, text=f"Question {i}", order=i)
+            Option.objects.bulk_create([Option(question=question, text=str(n), is_correct=n == 1) for n in range(3)])
+        return quiz
+
+    def answers(self, quiz, correct):
+        """{question id: option id}, the first `correct` answers right and the rest wrong."""
+        chosen = {}
+        for i, question in enumerate(quiz.questions.order_by('order')):
+            options = {option.text: option.id for option in question.options.all()}
+            chosen[str(question.id)] = options["1" if i < correct else "2"]
+        return chosen
+
+    def submit(self, quiz, answers):
+        return self.client.post(
+            '/quiz/submit/', {"quiz_id": quiz.id, "answers": answers, "time_taken": 42}, content_type='application/json'
+        )
+
+    def test_grades_on_the_server_and_saves_every_answer(self):
+        xp_before = UserProfile.objects.get(user=self.user).total_xp
+        response = self.submit(self.quiz, self.answers(self.quiz, correct=2))
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["score"], body["total_questions"], body["xp_earned"]), (2, 3, 40))
+        self.assertEqual([result["is_correct"] for result in body["results"]], [True, True, False])
+        attempt = UserQuizAttempt.objects.get(user=self.user)
+        self.assertEqual((attempt.score, attempt.time_taken_seconds), (2, 42))
+        self.assertEqual(UserAnswer.objects.filter(attempt=attempt, is_correct=True).count(), 2)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.total_xp - xp_before, profile.quizzes_completed), (40, 1))
+        self.assertEqual(SubjectProgress.objects.get(user=self.user, subject=self.subject).current_day, 2)
+        self.assertTrue(ActivityEvent.objects.filter(user=self.user, kind='quiz', title=self.quiz.title).exists())
+
+    def test_complete_ignores_a_client_supplied_score(self):
+        response = self.client.post('/quiz/complete/', {
+            "quiz_id": self.quiz.id, "score": 100, "answers": self.answers(self.quiz, correct=1),
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["score"], 1)
+        self.assertEqual(UserQuizAttempt.objects.get(user=self.user).score, 1)
+        self.assertEqual(UserAnswer.objects.filter(attempt__user=self.user).count(), 3)
+
+        # Without answers nothing is right, whatever the client claims
+        xp_before = UserProfile.objects.get(user=self.user).total_xp
+        quiz = self.make_quiz(2)
+        response = self.client.post('/quiz/complete/', {"quiz_id": quiz.id, "score": 100}, content_type='application/json')
+        self.assertEqual(UserQuizAttempt.objects.filter(user=self.user).latest('id').score, 0)
+        self.assertEqual(response.json()["xp_earned"], 0)
+        self.assertNotIn("You earned", response.json()["message"])
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_xp, xp_before)
+
+    def test_xp_is_paid_once_per_quiz_on_the_first_scoring_attempt(self):
+        xp_before = UserProfile.objects.get(user=self.user).total_xp
+
+        def complete(correct):
+            return self.client.post('/quiz/complete/', {
+                "quiz_id": self.quiz.id, "answers": self.answers(self.quiz, correct=correct),
+            }, content_type='application/json').json()
+
+        earned = [complete(correct)["xp_earned"] for correct in (0, 2, 3, 3)]
+        self.assertEqual(earned, [0, 40, 0, 0])
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.total_xp - xp_before, profile.quizzes_completed), (40, 1))
+        self.assertEqual(complete(3)["message"], "Quiz completed! You already earned the XP for this one.")
+        self.assertEqual(XPTransaction.objects.filter(user=self.user, reason__startswith="Quiz Completed").count(), 1)
+
+    def test_bad_submissions_save_nothing(self):
+        other = self.make_quiz(1)
+        mixed = {**self.answers(self.quiz, correct=3), **self.answers(other, correct=1)}
+
+        self.assertEqual(self.submit(self.quiz, mixed).status_code, 400)
+        self.assertEqual(self.submit(self.quiz, ["not", "a", "mapping"]).status_code, 400)
+        self.assertEqual(self.submit(Quiz(id=999_999), {}).status_code, 404)
+        question_id, option_id = next(iter(self.answers(self.quiz, correct=1).items()))
+        wrong_question = next(q for q in self.answers(self.quiz, correct=1) if q != question_id)
+        self.assertEqual(self.submit(self.quiz, {wrong_question: option_id}).status_code, 400)
+        self.assertFalse(UserQuizAttempt.objects.exists())
+        self.assertFalse(UserAnswer.objects.exists())
+
+    def test_query_count_does_not_grow_with_the_quiz(self):
+        self.submit(self.quiz, self.answers(self.quiz, correct=1))
+
+        def queries_for(quiz):
+            answers = self.answers(quiz, correct=1)
+            answer_key(quiz.id)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.submit(quiz, answers).status_code, 200)
+            return [q['sql'] for q in queries]
+
+        # Both first attempts, so both move the student on a day
+        small, large = queries_for(self.make_quiz(3)), queries_for(self.make_quiz(30))
+        self.assertEqual(len(small), len(large), large)
+        # The answer key comes from the cache
+        self.assertEqual([q for q in large if 'core_option' in q and q.startswith('SELECT')], [])
+
+    def test_answer_key_follows_edits(self):
+        answers = {int(q): o for q, o in self.answers(self.quiz, correct=0).items()}
+        self.assertEqual(grade(answer_key(self.quiz.id), answers)[0], 0)
+
+        Option.objects.filter(id=next(iter(answers.values()))).update(is_correct=True)
+        self.assertEqual(grade(answer_key(self.quiz.id), answers)[0], 0)  # update() sends no signal
+        Option.objects.get(id=next(iter(answers.values()))).save()
+        self.assertEqual(grade(answer_key(self.quiz.id), answers)[0], 1)
+
+    def test_benchmark_command_leaves_nothing_behind(self):
+        # No Level rows yet: the benchmark student's reward creates Level 1
+        Level.objects.all().delete()
+        quizzes, users, levels = Quiz.objects.count(), User.objects.count(), Level.objects.count()
+        out = StringIO()
+        call_command('bench_grading', '--submissions', '20', '--questions', '5', stdout=out)
+
+        self.assertIn("20 submissions of 5 questions", out.getvalue())
+        self.assertEqual((Quiz.objects.count(), User.objects.count()), (quizzes, users))
+        self.assertEqual(Level.objects.count(), levels)
+        self.assertFalse(UserAnswer.objects.exists())
+
+
+class QuizContentTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        subject = Subject.objects.create(name="Astronomy")
+        self.quiz = Quiz.objects.create(subject=subject, title="Stars", xp_reward=40)
+        for i in reversed(range(5)):
+            question = Question.objects.create(quiz=self.quiz, text=f"Question {i}", order=i)
+            Option.objects.bulk_create([Option(question=question, text=f"{i}.{n}", is_correct=n == 1) for n in range(3)])
+        self.other = Quiz.objects.create(subject=subject, title="Planets")
+
+    def test_one_build_returns_the_whole_quiz_without_answers(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/quiz/{self.quiz.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        # Quiz with its subject, then questions, then options: not one query per question
+        self.assertEqual(len(queries), 3, [q['sql'] for q in queries])
+        body = response.json()
+        self.assertEqual((body["title"], body["subject"], body["xp_reward"]), ("Stars", "Astronomy", 40))
+        self.assertEqual([q["text"] for q in body["questions"]], [f"Question {i}" for i in range(5)])
+        self.assertEqual([o["text"] for o in body["questions"][0]["options"]], ["0.0", "0.1", "0.2"])
+        self.assertNotIn(b"is_correct", response.content)
+
+    def test_repeat_requests_are_served_from_cache_with_an_etag(self):
+        first = self.client.get(f'/quiz/{self.quiz.id}/')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(f'/quiz/{self.quiz.id}/')
+            not_modified = self.client.get(f'/quiz/{self.quiz.id}/', HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('public', second['Cache-Control'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.client.get('/quiz/999999/').status_code, 404)
+
+    def test_edits_expire_only_that_quiz(self):
+        first = self.client.get(f'/quiz/{self.quiz.id}/')
+        self.client.get(f'/quiz/{self.other.id}/')
+        option = Option.objects.filter(question__quiz=self.quiz).first()
+        option.text = "Betelgeuse"
+        option.save()
+
+        edited = self.client.get(f'/quiz/{self.quiz.id}/')
+        self.assertNotEqual(edited['ETag'], first['ETag'])
+        self.assertIn(b"Betelgeuse", edited.content)
+        self.assertEqual(self.client.get(f'/quiz/{self.quiz.id}/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/quiz/{self.other.id}/')
+        self.assertEqual(len(queries), 0)
+
+        Question.objects.create(quiz=self.quiz, text="Question 5", order=5)
+        self.assertEqual(len(self.client.get(f'/quiz/{self.quiz.id}/').json()["questions"]), 6)
+
+    def test_concurrent_misses_share_one_build(self):
+        builds = []
+
+        def slow_build(quiz_id):
+            builds.append(quiz_id)
+            time.sleep(0.2)
+            return {"body": b"{}", "etag": '"x"'}
+
+        with mock.patch('core.quiz_content._build', slow_build):
+            threads = [threading.Thread(target=quiz_content, args=(self.quiz.id,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(builds, [self.quiz.id])
+        self.assertEqual(quiz_builds.stats()["coalesced"], 7)
+
+
+class QuizImportExportTests(FreshProcessStateMixin, TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'quizzes.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def write_bank(self, quizzes, questions=4, subjects=("Astronomy", "Psychology")):
+        with open(self.path, 'w', encoding='utf-8') as bank:
+            for i in range(quizzes):
+                bank.write(json.dumps({
+                    "subject": subjects[i % len(subjects)],
+                    "title": f"Quiz {i}",
+                    "xp_reward": 30,
+                    "questions": [
+                        {"text": f"Q{i}.{q}", "options": [{"text": f"{n}", "is_correct": n == q % 3} for n in range(3)]}
+                        for q in range(questions)
+                    ],
+                }) + "\n")
+
+    def import_bank(self, *args):
+        out = StringIO()
+        call_command('import_quizzes', self.path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_loads_in_batches(self):
+        Subject.objects.create(name="Astronomy")
+        self.write_bank(60)
+        with CaptureQueriesContext(connection) as queries:
+            out = self.import_bank('--chunk-size', '25')
+
+        self.assertIn("Imported 60 quizzes, 240 questions and 720 options", out)
+        self.assertIn("rows/second", out)
+        self.assertEqual(Subject.objects.count(), 2)
+        quiz = Quiz.objects.get(title="Quiz 1")
+        self.assertEqual((quiz.subject.name, quiz.xp_reward), ("Psychology", 30))
+        self.assertEqual(list(quiz.questions.order_by('order').values_list('text', flat=True)), [f"Q1.{q}" for q in range(4)])
+        self.assertEqual(Option.objects.filter(question__quiz=quiz, is_correct=True).count(), 4)
+        # A handful of statements per chunk, not one per row
+        self.assertLess(len(queries), 40, len(queries))
+
+    def test_reimport_skips_existing_quizzes(self):
+        self.write_bank(10)
+        self.import_bank()
+        out = self.import_bank()
+
+        self.assertIn("Imported 0 quizzes", out)
+        self.assertIn("(10 quizzes already existed)", out)
+        self.assertEqual(Quiz.objects.count(), 10)
+
+    def test_bad_line_stops_before_its_chunk(self):
+        self.write_bank(4)
+        with open(self.path, 'a', encoding='utf-8') as bank:
+            bank.write('{"subject": "Astronomy", "questions": []}\n')
+
+        with self.assertRaisesMessage(CommandError, "Line 5"):
+            self.import_bank('--chunk-size', '2')
+        # The two chunks before it are committed; the bad one wrote nothing
+        self.assertEqual(Quiz.objects.count(), 4)
+
+    def test_export_round_trips_through_import(self):
+        self.write_bank(6)
+        self.import_bank()
+        exported = os.path.join(self.directory.name, 'exported.jsonl')
+        call_command('export_quizzes', '--output', exported, '--chunk-size', '4', stderr=StringIO())
+
+        Quiz.objects.all().delete()
+        self.path = exported
+        self.import_bank()
+        again = StringIO()
+        call_command('export_quizzes', stdout=again, stderr=StringIO())
+
+        with open(exported, encoding='utf-8') as first:
+            self.assertEqual(again.getvalue(), first.read())
+        self.assertEqual(len(again.getvalue().splitlines()), 6)
+        line = json.loads(again.getvalue().splitlines()[0])
+        self.assertEqual(line["questions"][1]["options"][1], {"text": "1", "is_correct": True})
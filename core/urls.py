@@ -1,6 +1,19 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI (settings.ASYNC_VIEWS) the LLM-bound endpoints are served by async views
+if settings.ASYNC_VIEWS:
+    ask_view = views.ask_ai_async_view
+    ask_stream_view = views.ask_ai_stream_async_view
+    history_view = views.chat_history_async_view
+    dashboard_stats_view = views.dashboard_stats_async_view
+else:
+    ask_view = views.AskAIView.as_view()
+    ask_stream_view = views.AskAIStreamView.as_view()
+    history_view = views.chat_history_view
+    dashboard_stats_view = views.DashboardStatsView.as_view()
+
 urlpatterns = [
     path('', views.landing_view, name='landing_page'),
     path('teacher/', views.teacher_view, name='teacher_interface'),
@@ -10,11 +23,17 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('account/', views.AccountPageView.as_view(), name='account'),
     path('pricing/', views.pricing_view, name='pricing'),
-    path('ask/', views.AskAIView.as_view(), name='ask_ai'),
-    path('history/', views.chat_history_view, name='chat_history'),
+    path('ask/', ask_view, name='ask_ai'),
+    path('ask/stream/', ask_stream_view, name='ask_ai_stream'),
+    path('history/', history_view, name='chat_history'),
     path('subject/days/', views.subject_days_view, name='subject_days'),
     path('history/delete/<int:chat_id>/', views.delete_chat_view, name='delete_chat'),
-    path('dashboard/stats/', views.DashboardStatsView.as_view(), name='dashboard_stats'),
+    path('activity/', views.activity_view, name='activity'),
+    path('dashboard/stats/', dashboard_stats_view, name='dashboard_stats'),
+    path('leaderboard/', views.LeaderboardView.as_view(), name='leaderboard'),
     path('quiz/complete/', views.CompleteQuizView.as_view(), name='complete_quiz'),
+    path('quiz/<int:quiz_id>/', views.quiz_content_view, name='quiz_content'),
+    path('quiz/submit/', views.SubmitQuizView.as_view(), name='submit_quiz'),
     path('health/', views.health_check, name='health_check'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
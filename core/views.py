@@ -1,38 +1,48 @@
-import os
+import json
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import JsonResponse
-from freeflow_llm import FreeFlowClient
-from dotenv import load_dotenv
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from .models import Subject, Conversation, UserProfile, XPTransaction, Level, Achievement, UserAchievement, Quiz, UserQuizAttempt, UserAnswer
+from .models import ActivityEvent, Conversation, UserProfile, UserAchievement, UserAnswer, WeeklyLeaderboard
 from .services import award_xp
+from .sessions import revoke_user_sessions
+from .catalog import catalog
+from .grading import answer_key, submit_quiz
+from .quiz_content import quiz_content
+from .curriculum import current_day as current_subject_day, get_curriculum, subject_days
+from .dashboard import dashboard_cache_key, dashboard_profile, store_dashboard
+from .leaderboard import leaderboards, week_start
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from django.utils.crypto import constant_time_compare
+from django.conf import settings
+from .metrics import app_stat_lines, metrics
+from .llm import get_freeflow_client
+from freeflow_llm.exceptions import NoProvidersAvailableError
+from .answer_cache import answer_cache
+from .singleflight import llm_flights
+from .context import build_tutor_messages
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
-from django.contrib.sessions.models import Session
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-
-# Initialize FreeFlow Client
-def get_freeflow_client():
-    from django.conf import settings
-    env_path = os.path.join(settings.BASE_DIR, '.env')
-    load_dotenv(env_path)
-    return FreeFlowClient()
+from asgiref.sync import sync_to_async
 
 def teacher_view(request, subject="General Learning"):
     """Render the AI Teacher interface."""
-    current_day = 1
-    subject_obj, _ = Subject.objects.get_or_create(name=subject)
-    
+    curriculum = get_curriculum(subject)
+    _, current_day = subject_days(curriculum, current_subject_day(request.user.id, curriculum["subject_id"]))
+
     return render(request, 'core/teacher.html', {
-        'subject': subject_obj.name,
+        'subject': curriculum["name"],
         'current_day': current_day
     })
 
@@ -76,48 +86,78 @@ def logout_view(request):
     logout(request)
     return redirect('teacher_interface')
 
+HISTORY_PAGE_SIZE = 30
+HISTORY_MAX_PAGE_SIZE = 100
+
+def _conversation_as_dict(row):
+    return {
+        "id": row["id"],
+        "question": row["question"], 
+        "answer": row["answer"], 
+        "topic": row["topic"],
+        "day": None,
+        "timestamp": row["created_at"].isoformat()
+    }
+
+def _encode_history_cursor(row):
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_history_cursor(cursor):
+    """Return (created_at, id) from a `next_cursor` value; raises ValueError if malformed."""
+    created_at, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
+
+def _history_page_query(user, params):
+    """
+    Keyset-paginated /history/ query, newest first, projected with .values().
+    `params` may carry topic, limit and the previous page's `cursor`.
+    Returns (queryset, limit); the queryset fetches one extra row to tell
+    whether an older page exists.
+    """
+    topic = params.get('topic', 'General Learning')
+    try:
+        limit = min(max(int(params.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+
+    history = Conversation.objects.filter(user=user, topic=topic)
+    if params.get('cursor'):
+        created_at, pk = _decode_history_cursor(params['cursor'])
+        # (created_at, id) < cursor, written so the created_at range can use the index
+        history = history.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+
+    history = history.order_by('-created_at', '-id').values(
+        'id', 'question', 'answer', 'topic', 'created_at'
+    )[:limit + 1]
+    return history, limit
+
+def _history_page_response(rows, limit):
+    next_cursor = _encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return JsonResponse({
+        "history": [_conversation_as_dict(row) for row in rows[:limit]],
+        "next_cursor": next_cursor,
+    })
+
 def chat_history_view(request):
-    """API endpoint to get chat history."""
-    topic = request.GET.get('topic', 'General Learning')
-    
+    """
+    API endpoint to get chat history, newest first.
+    Query params: topic, limit (default 30, max 100) and cursor (`next_cursor` of the previous page).
+    """
     if not request.user.is_authenticated:
-        return JsonResponse({"history": []})
+        return JsonResponse({"history": [], "next_cursor": None})
 
-    history = Conversation.objects.filter(user=request.user, topic=topic)
-        
-    data = [
-        {
-            "id": h.id,
-            "question": h.question, 
-            "answer": h.answer, 
-            "topic": h.topic,
-            "day": None,
-            "timestamp": h.created_at.isoformat()
-        }
-        for h in history
-    ]
-    return JsonResponse({"history": data})
+    try:
+        history, limit = _history_page_query(request.user, request.GET)
+        rows = list(history)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor."}, status=400)
+    return _history_page_response(rows, limit)
 
 def subject_days_view(request):
-    """Return status for all 14 days of the requested subject."""
-    subject = request.GET.get('subject', 'General Learning')
-    subject_obj, _ = Subject.objects.get_or_create(name=subject)
-    current_day = 1 # Simplified for now
-    
-    days = []
-    # Using 14 days as a standard for now
-    for d in range(1, 15):
-        status = "locked"
-        if d < current_day:
-            status = "completed"
-        elif d == current_day:
-            status = "in_progress"
-        
-        days.append({
-            "day": d,
-            "status": status,
-            "label": f"Day {d}"
-        })
+    """Return status for every day of the requested subject (read-only; served from cache)."""
+    curriculum = get_curriculum(request.GET.get('subject', 'General Learning'))
+    days, _ = subject_days(curriculum, current_subject_day(request.user.id, curriculum["subject_id"]))
     return JsonResponse({"days": days})
 
 @login_required
@@ -130,6 +170,56 @@ def delete_chat_view(request, chat_id):
     except Conversation.DoesNotExist:
         return JsonResponse({"error": "Chat not found"}, status=404)
 
+ACTIVITY_FEED_SIZE = 8
+ACTIVITY_PAGE_SIZE = 20
+ACTIVITY_MAX_PAGE_SIZE = 100
+
+def _activity_item(event):
+    local = timezone.localtime(event.created_at)
+    title = event.title
+    if event.kind == 'login':
+        sub = local.strftime("%b %d, %H:%M")
+    elif event.kind == 'quiz':
+        title, sub = f'Completed Quiz — {title}', f'{event.detail} · {local.strftime("%b %d")}'
+    else:
+        sub = local.strftime("%b %d")
+    xp = '—' if event.xp is None else f'+{event.xp} XP'
+    return {'type': event.kind, 'title': title, 'sub': sub, 'timestamp': event.created_at, 'xp': xp}
+
+@login_required
+def activity_view(request):
+    """
+    The student's activity events, newest first: one (user, created_at) index scan per page.
+    Query params: limit (default 20, max 100) and cursor (`next_cursor` of the previous page).
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', ACTIVITY_PAGE_SIZE)), 1), ACTIVITY_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = ACTIVITY_PAGE_SIZE
+
+    events = ActivityEvent.objects.filter(user=request.user)
+    if request.GET.get('cursor'):
+        try:
+            created_at, pk = _decode_history_cursor(request.GET['cursor'])
+        except ValueError:
+            return JsonResponse({"error": "Invalid cursor."}, status=400)
+        events = events.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+
+    rows = list(events.order_by('-created_at', '-id').values(
+        'id', 'kind', 'title', 'detail', 'xp', 'created_at'
+    )[:limit + 1])
+    next_cursor = _encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return JsonResponse({
+        "events": [
+            {
+                "kind": row["kind"], "title": row["title"], "detail": row["detail"],
+                "xp": row["xp"], "timestamp": row["created_at"].isoformat(),
+            }
+            for row in rows[:limit]
+        ],
+        "next_cursor": next_cursor,
+    })
+
 class AccountPageView(LoginRequiredMixin, TemplateView):
     template_name = 'core/account.html'
 
@@ -138,71 +228,26 @@ class AccountPageView(LoginRequiredMixin, TemplateView):
         profile, _ = UserProfile.objects.get_or_create(user=self.request.user)
         
         # Gamification Data
-        achievements = self.request.user.achievements.all().select_related('achievement')
+        profile.current_level = catalog.level_by_id(profile.current_level_id)
         next_level_number = profile.current_level.number + 1 if profile.current_level else 2
-        next_level = Level.objects.filter(number=next_level_number).first()
+        next_level = catalog.level(next_level_number)
         
         # XP Progress (Targeting 100 XP per level)
-        current_lvl_num = profile.current_level.number if profile.current_level else 0
         xp_in_level = profile.total_xp % 100
         xp_progress = xp_in_level # Since 100 is the threshold
         xp_needed_to_next = 100 - xp_in_level
 
         # Achievements Fetch
-        all_achievements = Achievement.objects.all()
-        user_ach_ids = set(achievements.values_list('achievement_id', flat=True))
-        
-        achievements_with_status = []
-        for ach in all_achievements:
-            achievements_with_status.append({
-                'achievement': ach,
-                'is_earned': ach.id in user_ach_ids
-            })
-
-        # Activity Feed
-        activity_items = []
-        
-        # 1. Logins
-        for login_act in self.request.user.login_history.all()[:5]:
-            activity_items.append({
-                'type': 'login',
-                'title': 'Login',
-                'sub': f'{timezone.localtime(login_act.timestamp).strftime("%b %d, %H:%M")}',
-                'timestamp': login_act.timestamp,
-                'xp': '—'
-            })
-        
-        # 2. Quiz Attempts
-        quiz_attempts = UserQuizAttempt.objects.filter(
-            user=self.request.user, 
-            completed_at__isnull=False
-        ).order_by('-completed_at')[:5]
-        
-        for qa in quiz_attempts:
-            try:
-                dt_str = timezone.localtime(qa.completed_at).strftime("%b %d")
-                activity_items.append({
-                    'type': 'quiz',
-                    'title': f'Completed Quiz — {qa.quiz.title}',
-                    'sub': f'{qa.quiz.subject.name} · {dt_str}',
-                    'timestamp': qa.completed_at,
-                    'xp': f'+{qa.quiz.xp_reward} XP'
-                })
-            except Exception:
-                continue
-        
-        # 3. XP Transactions
-        xp_trans = XPTransaction.objects.filter(user=self.request.user).exclude(reason__icontains="Quiz").order_by('-timestamp')[:5]
-        for xt in xp_trans:
-            activity_items.append({
-                'type': 'achievement',
-                'title': xt.reason,
-                'sub': f'{timezone.localtime(xt.timestamp).strftime("%b %d")}',
-                'timestamp': xt.timestamp,
-                'xp': f'+{xt.amount} XP'
-            })
-        
-        activity_items.sort(key=lambda x: x['timestamp'], reverse=True)
+        user_ach_ids = set(self.request.user.achievements.values_list('achievement_id', flat=True))
+        achievements_with_status = [
+            {'achievement': ach, 'is_earned': ach.id in user_ach_ids}
+            for ach in catalog.achievements
+        ]
+
+        activity_items = [
+            _activity_item(event)
+            for event in self.request.user.activity_events.order_by('-created_at', '-id')[:ACTIVITY_FEED_SIZE]
+        ]
         
         context.update({
             'profile': profile,
@@ -210,7 +255,7 @@ class AccountPageView(LoginRequiredMixin, TemplateView):
             'xp_needed_to_next': xp_needed_to_next,
             'next_level': next_level,
             'badges_with_status': achievements_with_status[:8],
-            'activity_items': activity_items[:8],
+            'activity_items': activity_items,
             'completed_quizzes': profile.quizzes_completed,
             'password_form': PasswordChangeForm(self.request.user)
         })
@@ -247,7 +292,7 @@ class AccountPageView(LoginRequiredMixin, TemplateView):
             profile.skill_level = request.POST.get('skill_level', 'BEGINNER')
             if 'profile_picture' in request.FILES:
                 profile.profile_picture = request.FILES['profile_picture']
-            profile.save()
+            profile.save(update_fields=['full_name', 'interests', 'skill_level', 'profile_picture'])
             messages.success(request, "Profile updated successfully!")
             
         elif action == 'change_password':
@@ -263,15 +308,14 @@ class AccountPageView(LoginRequiredMixin, TemplateView):
                     
         elif action == 'toggle_2fa':
             profile.is_2fa_enabled = not profile.is_2fa_enabled
-            profile.save()
+            profile.save(update_fields=['is_2fa_enabled'])
             status_text = "enabled" if profile.is_2fa_enabled else "disabled"
             messages.success(request, f"2FA has been {status_text}!")
             
         elif action == 'logout_all':
-            sessions = Session.objects.filter(expire_date__gte=timezone.now())
-            for session in sessions:
-                if str(request.user.pk) == session.get_decoded().get('_auth_user_id'):
-                    session.delete()
+            revoke_user_sessions(request.user)
+            # This session's row is gone too; flush it so the response doesn't save it again
+            logout(request)
             messages.success(request, "You have been logged out from all devices.")
             return redirect('login')
 
@@ -288,10 +332,64 @@ def pricing_view(request):
     """Render the pricing plans page."""
     return render(request, 'core/pricing.html')
 
+def metrics_view(request):
+    """Prometheus scrape endpoint: request, SQL and LLM metrics for this worker process."""
+    if settings.METRICS_TOKEN:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}")
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=403)
+    body = "\n".join(metrics.render() + app_stat_lines()) + "\n"
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def health_check(request):
     """Simple health check endpoint."""
     return JsonResponse({"status": "Server running"})
 
+GUEST_LIMIT_ERROR = {"error": "Guest limit reached", "limit_reached": True}
+TUTOR_UNAVAILABLE_ERROR = "Mentora's AI tutors are all unavailable right now. Please try again in a moment!"
+FREE_PLAN_LIMIT_ERROR = {
+    "error": "You've used all your free lessons! Please upgrade your plan to keep learning.",
+    "limit_reached": True,
+    "is_logged_in": True,
+}
+
+def _admit_question(request):
+    """
+    Apply guest and plan limits for a tutor question.
+    Returns (user, None) when the question may proceed, or (None, error Response).
+    """
+    if not request.user.is_authenticated:
+        # Guest Limit Check (3 questions per session)
+        guest_count = request.session.get('guest_question_count', 0)
+        if guest_count >= 3:
+            return None, Response(GUEST_LIMIT_ERROR, status=status.HTTP_403_FORBIDDEN)
+
+        # Use/Create a shadow user for guests or just track in session
+        user, _ = User.objects.get_or_create(username='guest_student')
+        request.session['guest_question_count'] = guest_count + 1
+        return user, None
+
+    user = request.user
+    profile, _ = UserProfile.objects.get_or_create(user=user)
+
+    # Limit for Free Tier (Increased to 100 for testing)
+    if profile.plan == 'FREE' and profile.questions_asked >= 100:
+        return None, Response(FREE_PLAN_LIMIT_ERROR, status=status.HTTP_403_FORBIDDEN)
+
+    profile.questions_asked += 1
+    profile.save(update_fields=['questions_asked'])
+    user.profile = profile
+    return user, None
+
+def _skill_level(user, is_authenticated):
+    """Skill level the answer is pitched at (part of the answer cache key); guests get the default."""
+    return user.profile.skill_level if is_authenticated else 'BEGINNER'
+
+def _usage_tokens(response):
+    return response.usage.total_tokens if response.usage else 0
+
 class AskAIView(APIView):
     """
     POST endpoint to ask the AI Teacher a question.
@@ -308,66 +406,32 @@ class AskAIView(APIView):
             )
 
         # Handle Authentication and Guest Limits
-        if not request.user.is_authenticated:
-            # Guest Limit Check (3 questions per session)
-            guest_count = request.session.get('guest_question_count', 0)
-            if guest_count >= 3:
-                return Response(
-                    {"error": "Guest limit reached", "limit_reached": True},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            # Use/Create a shadow user for guests or just track in session
-            user, _ = User.objects.get_or_create(username='guest_student')
-            request.session['guest_question_count'] = guest_count + 1
-        else:
-            user = request.user
-            profile, _ = UserProfile.objects.get_or_create(user=user)
-            
-            # Limit for Free Tier (Increased to 100 for testing)
-            if profile.plan == 'FREE' and profile.questions_asked >= 100:
-                return Response(
-                    {"error": "You've used all your free lessons! Please upgrade your plan to keep learning.", "limit_reached": True, "is_logged_in": True},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            profile.questions_asked += 1
-            profile.save()
+        user, error_response = _admit_question(request)
+        if error_response:
+            return error_response
 
         try:
             # Call FreeFlow LLM API
             client = get_freeflow_client()
-            
-            # Simplified Day Tracking
-            current_day = 1
-            if request.user.is_authenticated:
-                # We could track subject progress here if needed, 
-                # but for now we follow the simple 100 XP leveling.
-                pass
-            
-            # Fetch recent conversation history for memory
-            history_objs = Conversation.objects.filter(
-                user=user, 
-                topic=topic
-            ).order_by('-created_at')[:5]
-
-            # Simplified curriculum context
-            curriculum_context = f"Topic: {topic}. Target Level: 100 XP milestones."
-
-            system_instr = (
-                f"You are Mentora, a friendly AI Tutor for {topic}. "
-                "Sound like a caring teacher. Keep responses concise (under 100 words). "
-                "Use emojis! 🌈✨"
-            )
-            
-            messages = [{"role": "system", "content": system_instr}]
-            for chat in reversed(history_objs):
-                messages.append({"role": "user", "content": chat.question})
-                messages.append({"role": "assistant", "content": chat.answer})
-            messages.append({"role": "user", "content": question})
+            messages = build_tutor_messages(user, topic, question)
+            skill_level = _skill_level(user, request.user.is_authenticated)
 
-            response = client.chat(messages=messages, timeout=15.0)
-            answer = response.content
+            # Repeated questions are answered from the cache without calling the LLM
+            cached = answer_cache.lookup(topic, question, skill_level, messages)
+            if cached:
+                answer = cached["answer"]
+            else:
+                def ask_llm():
+                    started = time.monotonic()
+                    response = client.chat(messages=messages, timeout=15.0)
+                    answer_cache.store(
+                        topic, question, skill_level, messages, response.content,
+                        time.monotonic() - started, _usage_tokens(response)
+                    )
+                    return response.content
+
+                # A class asking the same question at once shares one LLM call
+                answer, _ = llm_flights.do(answer_cache.key(topic, question, skill_level, messages), ask_llm)
 
             # Save conversation
             Conversation.objects.create(
@@ -377,80 +441,478 @@ class AskAIView(APIView):
                 answer=answer
             )
 
-            return Response({"answer": answer}, status=status.HTTP_200_OK)
+            return Response({"answer": answer, "cached": bool(cached)}, status=status.HTTP_200_OK)
+
+        except NoProvidersAvailableError:
+            return Response({"error": TUTOR_UNAVAILABLE_ERROR}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _sse_event(event, payload):
+    """Format a single Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def _stream_answer_events(client, messages, user, topic, question, skill_level):
+    """
+    Relay LLM chunks as `token` events while they arrive, then persist the
+    Conversation and finish with a `done` event carrying the full answer.
+    A cached answer, or one already being generated for someone else, is
+    sent as a single token without calling the LLM again.
+    """
+    cached = answer_cache.lookup(topic, question, skill_level, messages)
+    if cached:
+        answer = cached["answer"]
+        yield _sse_event('token', {"token": answer})
+    else:
+        def ask_llm():
+            parts = []
+            started = time.monotonic()
+            for chunk in client.chat_stream(messages=messages, timeout=15.0):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+            answer_cache.store(topic, question, skill_level, messages, ''.join(parts), time.monotonic() - started)
+
+        parts = []
+        try:
+            # Students asking the same question at once share one LLM stream;
+            # the others get the full answer as a single token when it is done
+            for token in llm_flights.do_stream(answer_cache.key(topic, question, skill_level, messages), ask_llm):
+                parts.append(token)
+                yield _sse_event('token', {"token": token})
+        except Exception as e:
+            yield _sse_event('error', {"error": str(e)})
+            return
+
+        answer = ''.join(parts)
+
+    conversation = Conversation.objects.create(
+        user=user,
+        topic=topic,
+        question=question,
+        answer=answer
+    )
+    yield _sse_event('done', {"answer": answer, "id": conversation.id})
+
+class AskAIStreamView(APIView):
+    """
+    POST endpoint that streams the AI Teacher's answer as Server-Sent Events.
+    Expects JSON: {"question": "...", "topic": "..."}
+    Emits `token` events as the answer is generated and a final `done` event.
+    """
+    def post(self, request):
+        question = request.data.get('question')
+        topic = request.data.get('topic')
+
+        if not question or not topic:
+            return Response(
+                {"error": "Both 'question' and 'topic' are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user, error_response = _admit_question(request)
+        if error_response:
+            return error_response
 
+        try:
+            client = get_freeflow_client()
+            messages = build_tutor_messages(user, topic, question)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        response = StreamingHttpResponse(
+            _stream_answer_events(client, messages, user, topic, question, _skill_level(user, request.user.is_authenticated)),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop reverse proxies (nginx) from buffering the whole stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class DashboardStatsView(APIView):
     """
     GET: Fetch personalized gamification stats for the student dashboard.
     Also handles daily streak updates and awards daily login XP.
+    Answers 304 when the client's If-None-Match still matches the payload.
     """
     def get(self, request):
-        profile, _ = UserProfile.objects.get_or_create(user=request.user)
-        today = timezone.now().date()
-        
-        # Streak Update Logic
-        if profile.last_login_date:
-            if profile.last_login_date == today:
-                pass
-            elif profile.last_login_date == today - timedelta(days=1):
-                profile.current_streak += 1
-                if profile.current_streak > profile.max_streak:
-                    profile.max_streak = profile.current_streak
-                
-                # Bonus XP for 7-day streak
-                if profile.current_streak == 7:
-                    award_xp(request.user, 100, "7-Day Streak Bonus!")
-            else:
-                profile.current_streak = 1
+        entry = _dashboard_entry(request.user)
+        return _dashboard_response(request, entry)
+
+def _dashboard_entry(user):
+    """
+    Cached dashboard payload for `user` ({"data", "etag", "streak_date"}).
+    Repeat polls on the same day are served from the cache without touching
+    the database; the profile is only written when the streak moves.
+    """
+    today = timezone.now().date()
+    key = dashboard_cache_key(user.id)
+    entry = cache.get(key)
+    if entry is not None and entry['streak_date'] == today:
+        return entry
+
+    try:
+        profile = dashboard_profile(user)
+    except UserProfile.DoesNotExist:
+        UserProfile.objects.get_or_create(user=user)
+        profile = dashboard_profile(user)
+
+    if profile.last_login_date != today:
+        streak_bonus = _advance_streak(profile, today)
+        profile.save(update_fields=STREAK_FIELDS)
+
+        # Bonus XP for 7-day streak (after saving, so award_xp's own profile write isn't clobbered)
+        if streak_bonus:
+            award_xp(user, 100, "7-Day Streak Bonus!")
+
+        # The writes above moved the cache generation; read the payload under the new one
+        key = dashboard_cache_key(user.id)
+        profile = dashboard_profile(user)
+
+    from .serializers import DashboardStatsSerializer
+    return store_dashboard(key, DashboardStatsSerializer(profile).data, today)
+
+def _dashboard_response(request, entry):
+    etags = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+    if entry['etag'] in etags or '*' in etags:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(entry['data'])
+    response['ETag'] = entry['etag']
+    # Let the browser keep the body but revalidate every poll
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+STREAK_FIELDS = ['current_streak', 'max_streak', 'last_login_date']
+
+def _advance_streak(profile, today):
+    """
+    Streak Update Logic: bump, keep or reset the daily streak on `profile` (unsaved).
+    Returns True when the student just reached the 7-day streak bonus.
+    """
+    streak_bonus = False
+    if profile.last_login_date:
+        if profile.last_login_date == today:
+            pass
+        elif profile.last_login_date == today - timedelta(days=1):
+            profile.current_streak += 1
+            if profile.current_streak > profile.max_streak:
+                profile.max_streak = profile.current_streak
+            streak_bonus = profile.current_streak == 7
         else:
             profile.current_streak = 1
-            
-        profile.last_login_date = today
-        profile.save()
+    else:
+        profile.current_streak = 1
         
-        from .serializers import DashboardStatsSerializer
-        serializer = DashboardStatsSerializer(profile)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    profile.last_login_date = today
+    return streak_bonus
 
-class CompleteQuizView(APIView):
+LEADERBOARD_PAGE_SIZE = 20
+LEADERBOARD_MAX_PAGE_SIZE = 100
+
+class LeaderboardView(APIView):
     """
-    POST: Mark a quiz as completed and reward the student with XP.
-    Expects JSON: {"quiz_id": 123, "score": 85, "time_taken": 120}
+    GET: Weekly XP leaderboard, best first, from the last ranking run.
+    Query params: week (any date in the week, default this week), offset, limit.
+    Signed-in students also get their own live rank under "me".
     """
+    def get(self, request):
+        try:
+            week = week_start(date.fromisoformat(request.GET['week'])) if request.GET.get('week') else week_start()
+            offset = max(int(request.GET.get('offset', 0)), 0)
+            limit = min(max(int(request.GET.get('limit', LEADERBOARD_PAGE_SIZE)), 1), LEADERBOARD_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({"error": "Invalid week, offset or limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        board = leaderboards.get(week)
+        results = [
+            {"rank": rank, "name": name, "xp_gained": xp}
+            for rank, _, name, xp in board.page(offset, limit)
+        ]
+        next_offset = offset + limit if offset + limit < len(board) else None
+
+        me = None
+        if request.user.is_authenticated:
+            # Live XP, ranked against the snapshot, so a student sees their climb before the next run
+            xp = WeeklyLeaderboard.objects.filter(user=request.user, week_start=week).values_list('xp_gained', flat=True).first()
+            if xp is not None:
+                me = {"rank": board.rank_for_xp(xp), "xp_gained": xp}
+
+        return Response({
+            "week": week.isoformat(),
+            "count": len(board),
+            "results": results,
+            "next_offset": next_offset,
+            "me": me,
+        }, status=status.HTTP_200_OK)
+
+def _quiz_answer_key(quiz_id):
+    try:
+        return answer_key(int(quiz_id))
+    except (TypeError, ValueError):
+        return None
+
+class SubmitQuizView(APIView):
+    """
+    POST: Submit every answer to a quiz at once; the server grades them.
+    Expects JSON: {"quiz_id": 123, "answers": {"<question id>": <option id>, ...}, "time_taken": 120}
+    The attempt, its answers, the student's counters and XP are saved in one transaction.
+    """
+    answers_required = True
+
     def post(self, request):
-        quiz_id = request.data.get('quiz_id')
-        score = request.data.get('score', 0)
-        time_taken = request.data.get('time_taken', 0)
-        
+        if not request.user.is_authenticated:
+            return Response({"error": "Authentication required."}, status=status.HTTP_403_FORBIDDEN)
+
+        quiz = _quiz_answer_key(request.data.get('quiz_id'))
+        if quiz is None:
+            return Response({"error": "Quiz not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        answers = request.data.get('answers')
+        if answers is None and not self.answers_required:
+            answers = {}
         try:
-            quiz = Quiz.objects.get(id=quiz_id)
-            
-            # Record Attempt
-            attempt = UserQuizAttempt.objects.create(
-                user=request.user,
-                quiz=quiz,
-                score=score,
-                total_questions=quiz.questions.count(),
-                time_taken_seconds=time_taken,
-                completed_at=timezone.now()
+            answers = {int(question_id): int(option_id) for question_id, option_id in answers.items()}
+            time_taken = int(request.data.get('time_taken', 0))
+        except (AttributeError, TypeError, ValueError):
+            return Response(
+                {"error": "answers must map question ids to option ids, and time_taken be seconds."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            
-            # Update Profile Count
-            profile = request.user.profile
-            profile.quizzes_completed += 1
-            profile.save()
-            
-            # Award XP using service (+50 XP as per requirement)
-            award_xp(request.user, quiz.xp_reward, f"Quiz Completed: {quiz.title}")
-            
-            return Response({
-                "status": "success", 
-                "xp_earned": quiz.xp_reward,
-                "message": f"Fantastic! You earned {quiz.xp_reward} XP!"
-            }, status=status.HTTP_200_OK)
-                
-        except Quiz.DoesNotExist:
-            return Response({"error": "Quiz not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            attempt, graded, xp = submit_quiz(request.user, quiz, answers, time_taken)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.response_data(attempt, graded, xp), status=status.HTTP_200_OK)
+
+    def response_data(self, attempt, graded, xp):
+        return {
+            "status": "success",
+            "attempt_id": attempt.id,
+            "score": attempt.score,
+            "total_questions": attempt.total_questions,
+            "xp_earned": xp,
+            "results": [
+                {"question_id": question_id, "option_id": option_id, "is_correct": is_correct}
+                for question_id, option_id, is_correct in graded
+            ],
+        }
+
+class CompleteQuizView(SubmitQuizView):
+    """
+    POST: Mark a quiz as completed and reward the student with XP.
+    Expects JSON: {"quiz_id": 123, "answers": {...}, "time_taken": 120}
+    Graded on the server like /quiz/submit/: a client-sent "score" is ignored,
+    and a completion without answers scores zero. XP is paid once per quiz,
+    on the first attempt that scores.
+    """
+    answers_required = False
+
+    def response_data(self, attempt, graded, xp):
+        if xp:
+            message = f"Fantastic! You earned {xp} XP!"
+        elif attempt.score:
+            message = "Quiz completed! You already earned the XP for this one."
+        else:
+            message = "Quiz completed, but no answers were right. Try again to earn XP!"
+        return {**super().response_data(attempt, graded, xp), "message": message}
+
+def quiz_content_view(request, quiz_id):
+    """
+    GET a quiz with its questions and options (never which ones are correct).
+    The payload is cached as bytes per quiz version, so every student opening
+    the same quiz shares one build; If-None-Match with its ETag answers 304.
+    """
+    entry = quiz_content(quiz_id)
+    if entry is None:
+        return JsonResponse({"error": "Quiz not found"}, status=404)
+
+    etags = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+    if entry['etag'] in etags or '*' in etags:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['body'], content_type='application/json')
+    response['ETag'] = entry['etag']
+    # The same for everyone, so shared caches may keep it too
+    response['Cache-Control'] = f'public, max-age={settings.QUIZ_CONTENT_MAX_AGE}'
+    return response
+
+# ─── Async (ASGI) views ──────────────────────────────────────────────────────
+# Used instead of AskAIView / AskAIStreamView / chat_history_view /
+# DashboardStatsView when settings.ASYNC_VIEWS is on, so an ASGI worker can
+# keep many slow LLM calls in flight without tying up a thread per request
+# (see DEPLOYMENT_GUIDE.md).
+
+async def _aadmit_question(request):
+    """Async counterpart of _admit_question, returning (user, None) or (None, JsonResponse)."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        guest_count = await request.session.aget('guest_question_count', 0)
+        if guest_count >= 3:
+            return None, JsonResponse(GUEST_LIMIT_ERROR, status=403)
+
+        guest, _ = await User.objects.aget_or_create(username='guest_student')
+        await request.session.aset('guest_question_count', guest_count + 1)
+        return guest, None
+
+    profile, _ = await UserProfile.objects.aget_or_create(user=user)
+    if profile.plan == 'FREE' and profile.questions_asked >= 100:
+        return None, JsonResponse(FREE_PLAN_LIMIT_ERROR, status=403)
+
+    profile.questions_asked += 1
+    await profile.asave(update_fields=['questions_asked'])
+    user.profile = profile
+    return user, None
+
+async def ask_ai_async_view(request):
+    """
+    Async POST endpoint to ask the AI Teacher a question.
+    Expects JSON: {"question": "...", "topic": "..."}
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        payload = {}
+    question = payload.get('question')
+    topic = payload.get('topic')
+
+    if not question or not topic:
+        return JsonResponse({"error": "Both 'question' and 'topic' are required."}, status=400)
+
+    user, error_response = await _aadmit_question(request)
+    if error_response:
+        return error_response
+
+    try:
+        client = get_freeflow_client()
+        messages = await sync_to_async(build_tutor_messages)(user, topic, question)
+        skill_level = _skill_level(user, (await request.auser()).is_authenticated)
+
+        cached = await sync_to_async(answer_cache.lookup)(topic, question, skill_level, messages)
+        if cached:
+            answer = cached["answer"]
+        else:
+            async def ask_llm():
+                started = time.monotonic()
+                response = await client.async_chat(messages=messages, timeout=15.0)
+                await sync_to_async(answer_cache.store)(
+                    topic, question, skill_level, messages, response.content,
+                    time.monotonic() - started, _usage_tokens(response)
+                )
+                return response.content
+
+            answer, _ = await llm_flights.ado(answer_cache.key(topic, question, skill_level, messages), ask_llm)
+
+        await Conversation.objects.acreate(
+            user=user,
+            topic=topic,
+            question=question,
+            answer=answer
+        )
+        return JsonResponse({"answer": answer, "cached": bool(cached)})
+
+    except NoProvidersAvailableError:
+        return JsonResponse({"error": TUTOR_UNAVAILABLE_ERROR}, status=503)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+async def _astream_answer_events(client, messages, user, topic, question, skill_level):
+    """Async counterpart of _stream_answer_events, over the client's async_chat_stream()."""
+    cached = await sync_to_async(answer_cache.lookup)(topic, question, skill_level, messages)
+    if cached:
+        answer = cached["answer"]
+        yield _sse_event('token', {"token": answer})
+    else:
+        async def ask_llm():
+            parts = []
+            started = time.monotonic()
+            async for chunk in client.async_chat_stream(messages=messages, timeout=15.0):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+            await sync_to_async(answer_cache.store)(
+                topic, question, skill_level, messages, ''.join(parts), time.monotonic() - started
+            )
+
+        parts = []
+        try:
+            async for token in llm_flights.ado_stream(answer_cache.key(topic, question, skill_level, messages), ask_llm):
+                parts.append(token)
+                yield _sse_event('token', {"token": token})
+        except Exception as e:
+            yield _sse_event('error', {"error": str(e)})
+            return
+
+        answer = ''.join(parts)
+
+    conversation = await Conversation.objects.acreate(
+        user=user,
+        topic=topic,
+        question=question,
+        answer=answer
+    )
+    yield _sse_event('done', {"answer": answer, "id": conversation.id})
+
+async def ask_ai_stream_async_view(request):
+    """
+    Async POST endpoint that streams the AI Teacher's answer as Server-Sent
+    Events (see AskAIStreamView). Expects JSON: {"question": "...", "topic": "..."}
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        payload = {}
+    question = payload.get('question')
+    topic = payload.get('topic')
+
+    if not question or not topic:
+        return JsonResponse({"error": "Both 'question' and 'topic' are required."}, status=400)
+
+    user, error_response = await _aadmit_question(request)
+    if error_response:
+        return error_response
+
+    try:
+        client = get_freeflow_client()
+        messages = await sync_to_async(build_tutor_messages)(user, topic, question)
+        skill_level = _skill_level(user, (await request.auser()).is_authenticated)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+    response = StreamingHttpResponse(
+        _astream_answer_events(client, messages, user, topic, question, skill_level),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the whole stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def chat_history_async_view(request):
+    """Async API endpoint to get chat history (same paging as chat_history_view)."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"history": [], "next_cursor": None})
+
+    try:
+        history, limit = _history_page_query(user, request.GET)
+        rows = [row async for row in history]
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor."}, status=400)
+    return _history_page_response(rows, limit)
+
+async def dashboard_stats_async_view(request):
+    """Async GET endpoint for the student dashboard stats (see DashboardStatsView)."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=403)
+
+    entry = await sync_to_async(_dashboard_entry)(user)
+    return _dashboard_response(request, entry)
@@ -0,0 +1,106 @@
+import atexit
+import logging
+import os
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+from .models import ActivityEvent, LoginHistory, XPTransaction
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for append-only rows (login history, the XP ledger,
+    the activity feed).
+
+    With settings.WRITE_BUFFER_MODE = 'buffered', `add()` queues the unsaved
+    instance once the caller's transaction commits, and the rows go in with
+    one bulk_create every WRITE_BUFFER_MAX_ROWS rows or WRITE_BUFFER_MAX_DELAY_MS
+    milliseconds, whichever comes first. Pending rows are flushed at interpreter
+    exit, when run_tasks stops (SIGTERM included) and when a gunicorn worker
+    exits (gunicorn.conf.py), but a hard crash loses them; 'sync' (the default) saves each row
+    straight away instead. Buffered rows skip save() and post_save.
+    """
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._rows = []
+        self._timer = None
+        _buffers.append(self)
+
+    def add(self, instance):
+        if settings.WRITE_BUFFER_MODE != 'buffered':
+            instance.save()
+            return
+        # Rows of a rolled-back transaction are never written
+        transaction.on_commit(partial(self._append, instance))
+
+    def flush(self):
+        """Write every pending row now; returns how many were written."""
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not rows:
+            return 0
+        try:
+            self.model.objects.bulk_create(rows)
+        except DatabaseError:
+            # One bad row (e.g. its user was deleted) must not sink the whole batch
+            logger.exception("Batched insert of %d %s rows failed; retrying one by one",
+                             len(rows), self.model.__name__)
+            for row in rows:
+                try:
+                    with transaction.atomic():
+                        row.save(force_insert=True)
+                except DatabaseError:
+                    logger.exception("Dropped %s row %r", self.model.__name__, row)
+        return len(rows)
+
+    def pending(self):
+        return len(self._rows)
+
+    def _append(self, instance):
+        with self._lock:
+            self._rows.append(instance)
+            full = len(self._rows) >= settings.WRITE_BUFFER_MAX_ROWS
+            if not full and self._timer is None:
+                self._timer = threading.Timer(settings.WRITE_BUFFER_MAX_DELAY_MS / 1000, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread opened its own connection; don't leak it
+            connections.close_all()
+
+    def _after_fork(self):
+        # Rows queued in the parent are the parent's to write
+        self._lock = threading.Lock()
+        self._rows = []
+        self._timer = None
+
+
+_buffers = []
+
+def flush_all():
+    """Flush every write buffer (interpreter exit, run_tasks and gunicorn worker shutdown, tests)."""
+    return sum(buffer.flush() for buffer in _buffers)
+
+atexit.register(flush_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: [buffer._after_fork() for buffer in _buffers])
+
+
+login_history_writes = WriteBuffer(LoginHistory)
+xp_transaction_writes = WriteBuffer(XPTransaction)
+activity_event_writes = WriteBuffer(ActivityEvent)
@@ -0,0 +1,17 @@
+# Picked up by gunicorn from the working directory (see Procfile)
+import sys
+
+
+def post_worker_init(worker):
+    # Load the Level/Achievement catalog before the first request needs it
+    catalog = sys.modules.get('core.catalog')
+    if catalog is not None:
+        catalog.catalog.warm()
+
+
+def worker_exit(server, worker):
+    # A worker stopped by SIGTERM may not reach the interpreter's atexit hooks,
+    # so write the rows still sitting in the write buffers here
+    write_buffer = sys.modules.get('core.write_buffer')
+    if write_buffer is not None:
+        write_buffer.flush_all()